@@ -0,0 +1,90 @@
+#!/usr/bin/env python2
+"""
+Compares the old GetStatus busy-spin with the acquisition waiters on the simulated camera.
+
+For every strategy it reports the CPU time burned while waiting, scaled to a 60 s exposure, the delay between the end
+of readout and the waiting thread waking up, and how long an abort takes to wake the waiter.
+
+Run from the repository root:
+    python benchmarks/bench_acquisition_wait.py --exposure 60
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import resource
+import threading
+import time
+
+import evora.server.acquisition_wait as acq_wait
+from evora.server.simulator import AndorSimulator
+
+
+def cpuTime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def busySpin(driver):
+    status = driver.GetStatus()
+    while status[1] == driver.DRV_ACQUIRING:
+        status = driver.GetStatus()
+    return status
+
+
+def runExposure(driver, wait, exposure):
+    driver.SetAcquisitionMode(1)
+    driver.SetExposureTime(exposure)
+    driver.StartAcquisition()
+    readoutEnd = driver._startTime + driver._cycleTime()
+
+    cpu = 0 - cpuTime()
+    wait()
+    cpu += cpuTime()
+    return cpu, time.time() - readoutEnd
+
+
+def runAbort(driver, waiter, exposure, abortAfter):
+    driver.SetAcquisitionMode(1)
+    driver.SetExposureTime(exposure)
+    waiter.arm()
+    driver.StartAcquisition()
+
+    aborted = []
+
+    def abort():
+        aborted.append(time.time())
+        driver.AbortAcquisition()
+        waiter.abort()
+
+    timer = threading.Timer(abortAfter, abort)
+    timer.start()
+    waiter.wait()
+    woke = time.time()
+    timer.join()
+    return woke - aborted[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--exposure", type=float, default=60.0, help="exposure time in seconds")
+    parser.add_argument("--readout", type=float, default=2.0, help="simulated readout time in seconds")
+    args = parser.parse_args()
+
+    driver = AndorSimulator(width=256, height=256, readoutTime=args.readout)
+    scale = 60.0 / (args.exposure + args.readout)
+
+    print("%-8s %18s %16s %14s" % ("strategy", "CPU s per 60 s exp", "wake delay (ms)", "abort (ms)"))
+
+    cpu, delay = runExposure(driver, lambda: busySpin(driver), args.exposure)
+    print("%-8s %18.3f %16.3f %14s" % ("spin", cpu * scale, delay * 1e3, "n/a"))
+
+    for mode in ("poll", "sdk"):
+        waiter = acq_wait.createWaiter(driver, mode)
+        waiter.arm()
+        cpu, delay = runExposure(driver, waiter.wait, args.exposure)
+        abortDelay = runAbort(driver, waiter, args.exposure, min(1.0, args.exposure / 2))
+        print("%-8s %18.3f %16.3f %14.3f" % (mode, cpu * scale, delay * 1e3, abortDelay * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python2
+"""
+Broadcast load: several clients that keep up and one that never reads its socket.
+
+A worker thread broadcasts --lines status lines (about 200 bytes, like a realSent with its statistics) at --rate lines
+per second, the way the acquisition loops do, to --fast clients reading normally and one client whose socket is never
+read.  Everything runs over loopback in one process; the server's socket buffers are made small so the slow client
+backs up after kilobytes rather than megabytes.
+
+"before" is the old EvoraServer.sendMessage, a sendLine to every client (made from the reactor thread here, the old
+code did it from the worker thread directly).  "after" is BroadcastHub with its default bounded queues.  The table
+shows the lines each fast client got, their worst delay from broadcast to arrival, what the server still held for
+the slow client at the end and whether it was disconnected.
+
+Run from the repository root:
+    python benchmarks/bench_broadcast.py --mode before
+    python benchmarks/bench_broadcast.py --mode after
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import socket
+import threading
+import time
+
+from twisted.internet import protocol, reactor
+from twisted.protocols import basic
+
+from evora.server.broadcast import BroadcastHub
+
+PAD = "x" * 160
+
+
+class ServerSide(basic.LineReceiver):
+    def connectionMade(self):
+        self.transport.getHandle().setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+        self.factory.connected(self)
+
+    def connectionLost(self, reason):
+        self.factory.lost(self)
+
+
+class ServerFactory(protocol.ServerFactory):
+    protocol = ServerSide
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.clients = []
+
+    def connected(self, client):
+        self.clients.append(client)
+        if self.hub is not None:
+            self.hub.add(client)
+
+    def lost(self, client):
+        self.clients.remove(client)
+        if self.hub is not None:
+            self.hub.remove(client)
+
+    def broadcast(self, line):
+        if self.hub is not None:
+            self.hub.broadcast(line)
+        else:
+            reactor.callFromThread(self.sendAll, line)
+
+    def sendAll(self, line):
+        for client in self.clients:
+            client.sendLine(line)
+
+    def backlog(self):
+        """
+        Bytes the server has accepted for the clients but not yet written to their sockets.
+        """
+        held = {}
+        for client in self.clients:
+            transport = client.transport
+            queue = [line for each in (self.hub.queues if self.hub is not None else []) if each.client is client
+                     for line in each.pending]
+            written = len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+            held[client] = written + sum(len(line) + 2 for line in queue)
+        return held
+
+
+class FastClient(basic.LineReceiver):
+    MAX_LENGTH = 1 << 20
+
+    def connectionMade(self):
+        self.received = 0
+        self.maxDelay = 0.0
+
+    def lineReceived(self, line):
+        self.received += 1
+        self.maxDelay = max(self.maxDelay, time.time() - float(line.split(",", 1)[0]))
+
+
+def run(lines, rate, fastCount, useHub):
+    hub = BroadcastHub() if useHub else None
+    factory = ServerFactory(hub)
+    port = reactor.listenTCP(0, factory, interface="127.0.0.1")
+    address = port.getHost()
+
+    fast = []
+    for i in range(fastCount):
+        client = FastClient()
+        fast.append(client)
+        reactor.connectTCP(address.host, address.port, protocol.ClientFactory.forProtocol(lambda c=client: c))
+    slow = socket.socket()
+    slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    slow.connect((address.host, address.port))  # never read
+
+    result = {}
+
+    def produce():
+        while len(factory.clients) < fastCount + 1:
+            time.sleep(0.01)
+        start = time.time()
+        for i in range(lines):
+            delay = start + i / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            factory.broadcast("%.6f,%d,%s" % (time.time(), i, PAD))
+        done = time.time()
+        while time.time() - done < 2 and min(client.received for client in fast) < lines:
+            time.sleep(0.05)
+        reactor.callFromThread(finish)
+
+    def finish():
+        backlog = factory.backlog()
+        slowSide = [client for client in factory.clients if client.transport.getPeer().port == slow.getsockname()[1]]
+        result['received'] = min(client.received for client in fast)
+        result['fastLeft'] = sum(1 for client in fast if not client.transport.connected)
+        result['delay'] = max(client.maxDelay for client in fast)
+        result['backlog'] = backlog[slowSide[0]] if slowSide else 0
+        result['disconnected'] = not slowSide
+        slow.close()
+        port.stopListening()
+        for client in fast:
+            client.transport.loseConnection()
+        reactor.callLater(0.2, reactor.stop)
+
+    threading.Thread(target=produce).start()
+    reactor.run(installSignalHandlers=False)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fast", type=int, default=4, help="clients that keep up")
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=2000, help="lines per second")
+    parser.add_argument("--mode", choices=("before", "after"), default="after",
+                        help="the reactor can only run once per process, run the script once for each")
+    args = parser.parse_args()
+
+    result = run(args.lines, args.rate, args.fast, args.mode == "after")
+    print("%d fast clients, 1 slow client, %d lines at %d/s" % (args.fast, args.lines, args.rate))
+    print("%-8s %10s %12s %12s %14s %14s" % ("", "received", "delay (ms)", "fast lost", "slow backlog", "slow closed"))
+    print("%-8s %10d %12.1f %12d %11.1f KB %14s" % (args.mode, result['received'], result['delay'] * 1e3,
+                                                    result['fastLeft'], result['backlog'] / 1024,
+                                                    result['disconnected']))
+
+
+if __name__ == "__main__":
+    main()
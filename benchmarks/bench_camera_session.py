@@ -0,0 +1,68 @@
+#!/usr/bin/env python2
+"""
+Setup cost of Evora.expose with and without the camera session cache, on the simulated camera.
+
+Every exposure is run through the server's expose() with the simulator in place of the andor module.  "cold" forgets
+the session before each exposure, which sends the full setup like the server used to; "cached" keeps it, so only the
+calls whose values changed are sent.  --setup-latency is the time each simulated setup call spends in the driver.
+
+Run from the repository root:
+    python benchmarks/bench_camera_session.py --setup-latency 0.005
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import shutil
+import tempfile
+
+import mock
+
+import evora.server.acquisition_wait as acq_wait
+import evora.server.server as server
+from evora.server.camera_session import CameraSession
+from evora.server.simulator import AndorSimulator
+
+
+def run(driver, exposures, itime, cold):
+    camera = CameraSession(driver)
+    sent, setupTime, savedTime = 0, 0.0, 0.0
+    with mock.patch.object(server, 'camera', camera):
+        evora = server.Evora()
+        for i in range(exposures):
+            if cold:
+                camera.invalidate()
+            evora.expose("object", itime=itime, binning=1, readTime=3)
+            report = camera.report()
+            sent += report['sent']
+            setupTime += report['setupTime']
+            savedTime += report['savedTime']
+    return sent / exposures, setupTime / exposures, savedTime / exposures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exposures", type=int, default=20)
+    parser.add_argument("--itime", type=float, default=0.01, help="exposure time in seconds")
+    parser.add_argument("--setup-latency", type=float, default=0.005, help="seconds per simulated setup call")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    driver = AndorSimulator(width=256, height=256, readoutTime=0.01, setupLatency=args.setup_latency)
+    try:
+        with mock.patch.object(server, 'andor', driver), \
+                mock.patch.object(server, 'waiter', acq_wait.createWaiter(driver)), \
+                mock.patch.object(server.headerFactory, 'driver', driver), \
+                mock.patch.object(server.fits_utils, 'get_image_path',
+                                  lambda type: tempfile.mktemp(suffix=".fits", dir=directory)):
+            results = [("cold", run(driver, args.exposures, args.itime, True)),
+                       ("cached", run(driver, args.exposures, args.itime, False))]
+    finally:
+        shutil.rmtree(directory)
+
+    print("%-8s %12s %16s %16s" % ("", "calls sent", "setup (ms)", "saved (ms)"))
+    for name, (sent, setupTime, savedTime) in results:
+        print("%-8s %12.1f %16.2f %16.2f" % (name, sent, setupTime * 1e3, savedTime * 1e3))
+
+
+if __name__ == "__main__":
+    main()
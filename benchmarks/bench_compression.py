@@ -0,0 +1,110 @@
+#!/usr/bin/env python2
+"""
+Tile-compressed FITS output: compression ratio and frames per second on synthetic sky and bias frames.
+
+Every mode writes --frames frames through FitsWriter.  "inline" compresses on the writer threads (processes=0);
+"pool" hands the compression to worker processes.  While the writers run, the main thread counts iterations of a
+pure Python loop, standing in for the acquisition thread; "main loop" is that rate relative to an idle process, so
+it shows how much the writers hold the GIL.
+
+Run from the repository root:
+    python benchmarks/bench_compression.py --size 2048 --frames 16
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from evora.server.fits_writer import FitsWriter, WriteJob, compressionType, outputName
+
+
+def skyFrame(rng, size):
+    """
+    Sky background of ~800 ADU with read noise, a few hundred stars and some cosmic rays.
+    """
+    image = rng.poisson(800, (size, size)).astype(np.float64) + rng.normal(0, 7, (size, size))
+    y, x = np.mgrid[-7:8, -7:8]
+    psf = np.exp(-(x ** 2 + y ** 2) / (2 * 1.8 ** 2))
+    for i in range(300):
+        cy, cx = rng.randint(8, size - 8, 2)
+        image[cy - 7:cy + 8, cx - 7:cx + 8] += psf * rng.pareto(1.5) * 2000
+    hits = rng.randint(0, size, (50, 2))
+    image[hits[:, 0], hits[:, 1]] = 60000
+    return np.clip(image, 0, 65535).astype(np.uint16)
+
+
+def biasFrame(rng, size):
+    """
+    Bias of ~1000 ADU with read noise and a fixed column pattern.
+    """
+    columns = rng.normal(0, 2, size)
+    return np.clip(1000 + columns + rng.normal(0, 5, (size, size)), 0, 65535).astype(np.uint16)
+
+
+def spin(done):
+    """
+    Counts loop iterations until done is set.
+    """
+    count = 0
+    while not done.is_set():
+        count += 1
+    return count
+
+
+def loopRate(seconds):
+    done = threading.Event()
+    threading.Timer(seconds, done.set).start()
+    return spin(done) / seconds
+
+
+def run(frame, frames, compress, threads, processes, directory, idleRate):
+    writer = FitsWriter(threads=threads, maxQueue=frames, processes=processes)
+    writer.startProcesses()
+    done = threading.Event()
+    start = time.time()
+    for i in range(frames):
+        filename = outputName(os.path.join(directory, "frame_%03d.fits" % i), compress)
+        notify = (lambda filename: done.set()) if i == frames - 1 else None
+        writer.submit(WriteJob(frame, filename, notify=notify, compress=compress))
+
+    count = spin(done)
+    elapsed = time.time() - start
+
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    return frame.nbytes * frames / size, frames / elapsed, count / elapsed / idleRate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048, help="frame width and height in pixels")
+    parser.add_argument("--frames", type=int, default=16)
+    parser.add_argument("--processes", type=int, default=2)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    directory = tempfile.mkdtemp()
+    idleRate = loopRate(1.0)
+    modes = [("none", "inline", 0), ("rice", "inline", 0), ("rice", "pool", args.processes),
+             ("gzip", "inline", 0), ("gzip", "pool", args.processes)]
+    try:
+        for name, frame in (("sky", skyFrame(rng, args.size)), ("bias", biasFrame(rng, args.size))):
+            print("%s frame, %dx%d:" % (name, args.size, args.size))
+            print("    %-6s %-7s %8s %10s %10s" % ("mode", "where", "ratio", "frames/s", "main loop"))
+            for compression, where, processes in modes:
+                ratio, fps, main = run(frame, args.frames, compressionType(compression), args.processes, processes,
+                                       directory, idleRate)
+                print("    %-6s %-7s %8.2f %10.1f %9.0f%%" % (compression, where, ratio, fps, main * 100))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python2
+"""
+Image transfer throughput: the HTTP file service against the anonymous FTP server it replaced, on loopback.
+
+"ftp" serves a directory with the same Twisted FTPFactory/FTPRealm setup as evora/server/ftp_server.py and fetches
+every file with ftplib, which opens a new passive data connection per file.  "http" serves it with
+evora/server/file_server.py and fetches every file over one kept-alive httplib connection, the way
+evora/client/transfer_images.py does.  Both write the files to disk on the client side.
+
+Run from the repository root:
+    python benchmarks/bench_file_transfer.py --files 20 --size 8
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import ftplib
+import httplib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from twisted.cred.checkers import AllowAnonymousAccess
+from twisted.cred.portal import Portal
+from twisted.internet import reactor
+from twisted.protocols.ftp import FTPFactory, FTPRealm
+
+from evora.server.file_server import FileServer, sendfile
+
+
+def summary(latencies, fileBytes):
+    latencies = np.array(latencies)
+    return (np.median(latencies) * 1e3, np.percentile(latencies, 95) * 1e3,
+            fileBytes * len(latencies) / latencies.sum() / 1e6)
+
+
+def runFtp(root, names, save):
+    factory = FTPFactory(Portal(FTPRealm(root), [AllowAnonymousAccess()]))
+    port = reactor.listenTCP(0, factory, interface="127.0.0.1")
+    thread = threading.Thread(target=reactor.run, kwargs={'installSignalHandlers': False})
+    thread.start()
+    latencies = []
+    try:
+        client = ftplib.FTP()
+        client.connect("127.0.0.1", port.getHost().port)
+        client.login()
+        for name in names:
+            start = time.time()
+            with open(os.path.join(save, name), 'wb') as f:
+                client.retrbinary("RETR " + name, f.write, 1024 * 1024)
+            latencies.append(time.time() - start)
+        client.quit()
+    finally:
+        reactor.callFromThread(reactor.stop)
+        thread.join()
+    return latencies
+
+
+def runHttp(root, names, save):
+    server = FileServer(root, ('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    latencies = []
+    try:
+        connection = httplib.HTTPConnection('127.0.0.1', server.server_address[1])
+        for name in names:
+            start = time.time()
+            connection.request("GET", "/files/" + name)
+            response = connection.getresponse()
+            with open(os.path.join(save, name), 'wb') as f:
+                shutil.copyfileobj(response, f, 1024 * 1024)
+            latencies.append(time.time() - start)
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--size", type=float, default=8, help="file size in MB")
+    args = parser.parse_args()
+
+    root, save = tempfile.mkdtemp(), tempfile.mkdtemp()
+    fileBytes = int(args.size * 1e6)
+    try:
+        names = ["image_%03d.fits" % i for i in range(args.files)]
+        data = os.urandom(fileBytes)
+        for name in names:
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(data)
+        print("%d files of %.1f MB, sendfile %s" % (args.files, args.size, "yes" if sendfile else "no"))
+        print("%-6s %14s %14s %10s" % ("", "median (ms)", "p95 (ms)", "MB/s"))
+        for name, run in (("ftp", runFtp), ("http", runHttp)):
+            print("%-6s %14.2f %14.2f %10.1f" % ((name,) + summary(run(root, names, save), fileBytes)))
+    finally:
+        shutil.rmtree(root)
+        shutil.rmtree(save)
+
+
+if __name__ == "__main__":
+    main()
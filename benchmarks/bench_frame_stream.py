@@ -0,0 +1,141 @@
+#!/usr/bin/env python2
+"""
+Real time preview latency: frame stream against the old disk and FTP round trip.
+
+"disk" repeats what every real time frame used to cost before it reached the plot, minus the network: the server
+writes the FITS file, the file is copied to a second directory (standing in for the FTP transfer into the client's
+/tmp/) and read back with fits.getdata.  "stream" publishes the frame through FramePushFactory to a FrameReceiver
+over a loopback TCP connection with the Twisted reactor running, and times it from publish() to frameReceived().
+"ring" is the same with the client in shm mode: the frame goes into a shared memory ring under /dev/shm and the
+client maps it from there after the notice arrives.
+
+Run from the repository root:
+    python benchmarks/bench_frame_stream.py --size 1024 --frames 50
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from astropy.io import fits
+from twisted.internet import protocol, reactor, threads
+
+import evora.common.frame_ring as frame_ring
+import evora.common.frame_stream as frame_stream
+from evora.server.frame_push import FramePushFactory
+
+
+def summary(latencies, frameBytes):
+    latencies = np.array(latencies)
+    return (np.median(latencies) * 1e3, np.percentile(latencies, 95) * 1e3,
+            frameBytes / np.mean(latencies) / 1e6)
+
+
+def runDisk(frame, frames):
+    server, client = tempfile.mkdtemp(), tempfile.mkdtemp()
+    latencies = []
+    try:
+        for i in range(frames):
+            start = time.time()
+            filename = os.path.join(server, "real_%03d.fits" % i)
+            fits.PrimaryHDU(frame, do_not_scale_image_data=True, uint=True).writeto(filename)
+            copy = os.path.join(client, "real_%03d.fits" % i)
+            shutil.copyfile(filename, copy)
+            fits.getdata(copy)
+            latencies.append(time.time() - start)
+    finally:
+        shutil.rmtree(server)
+        shutil.rmtree(client)
+    return latencies
+
+
+class Receiver(frame_stream.FrameReceiver):
+    def connectionMade(self):
+        frame_stream.FrameReceiver.connectionMade(self)
+        self.ring = None
+        if self.factory.shm:
+            self.setMode('shm')
+        self.factory.connected.set()
+
+    def frameReceived(self, meta, image):
+        if meta['kind'] == frame_stream.RING:
+            if self.ring is None:
+                self.ring = frame_ring.FrameRingReader(self.factory.shm)
+            meta, image = self.ring.read(meta['number'])
+        self.factory.received.append(time.time())
+        self.factory.arrived.set()
+
+
+def connect(shm):
+    """
+    Starts a frame stream server and a Receiver connected to it, in shm mode when shm names a ring.
+    """
+    ring = frame_ring.FrameRingWriter(shm) if shm else None
+    stream = FramePushFactory(ring=ring)
+    port = reactor.listenTCP(0, stream, interface="127.0.0.1")
+    client = protocol.ClientFactory()
+    client.protocol = Receiver
+    client.shm = shm
+    client.connected, client.arrived, client.received = threading.Event(), threading.Event(), []
+    reactor.connectTCP("127.0.0.1", port.getHost().port, client)
+    return stream, client
+
+
+def publish(stream, client, frame, frames):
+    """
+    Runs in a thread: publishes one frame at a time and waits for it to arrive.
+    """
+    client.connected.wait()
+    while not stream.clients or stream.clients[0].mode != ('shm' if client.shm else 'full'):
+        time.sleep(0.001)
+    latencies = []
+    for i in range(1, frames + 1):
+        client.arrived.clear()
+        start = time.time()
+        stream.publish(i, start, 0.0, "object", 1, frame)
+        client.arrived.wait()
+        latencies.append(client.received[-1] - start)
+    return latencies
+
+
+def runStreams(frame, frames, shm):
+    """
+    Returns the latencies over the socket and through the ring; the reactor only runs once per process.
+    """
+    results = []
+
+    def run():
+        for name, path in (("stream", None), ("ring", shm)):
+            stream, client = threads.blockingCallFromThread(reactor, connect, path)
+            results.append((name, publish(stream, client, frame, frames)))
+            if stream.ring is not None:
+                stream.ring.unlink()
+        reactor.callFromThread(reactor.stop)
+
+    threading.Thread(target=run).start()
+    reactor.run()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024, help="frame width and height in pixels")
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    frame = np.random.RandomState(0).poisson(800, (args.size, args.size)).astype(np.uint16)
+    print("%dx%d frame, %d frames" % (args.size, args.size, args.frames))
+    print("%-8s %14s %14s %10s" % ("", "median (ms)", "p95 (ms)", "MB/s"))
+    shm = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "bench_frames")
+    results = [("disk", runDisk(frame, args.frames))] + runStreams(frame, args.frames, shm)
+    for name, latencies in results:
+        print("%-8s %14.2f %14.2f %10.1f" % ((name,) + summary(latencies, frame.nbytes)))
+
+
+if __name__ == "__main__":
+    main()
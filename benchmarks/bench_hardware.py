@@ -0,0 +1,180 @@
+#!/usr/bin/env python2
+"""
+Camera commands during a long exposure: how many threads are inside the SDK, how long queries take and how long an
+abort takes to end the exposure.
+
+A 30 s exposure is started on the simulated camera, --queries "temp" commands arrive every --spacing seconds while it
+runs, and an abort arrives after --abort-after seconds.  Every SDK call takes --call-time seconds, standing in for
+the USB round trip, and the number of threads inside the driver at once is counted.
+
+"before" runs every command on a thread of its own as deferToThread did (a pool of 30): the queries and the abort
+call the driver while the exposure thread is waiting in it.  "after" is the server now: a HardwareExecutor owns the
+driver, a TelemetrySampler (sampling every 0.2 s) answers the queries, inline while its snapshot is fresh and from
+the telemetry lane otherwise, and the abort wakes the waiter and runs AbortAcquisition in the abort lane.
+
+The table shows the most SDK calls in flight at once, the SDK calls made, the distribution of the query replies and
+the time from the abort arriving to the exposure returning.  After, the only second call in flight is the abort's
+CancelWait next to the exposure's WaitForAcquisitionTimeOut.
+
+Run from the repository root:
+    python benchmarks/bench_hardware.py --mode before
+    python benchmarks/bench_hardware.py --mode after
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import evora.server.acquisition_wait as acq_wait
+from evora.server import hardware, telemetry
+from evora.server.simulator import AndorSimulator
+
+
+class CountingDriver(object):
+    """
+    The simulator with a delay on every call, counting the calls in flight.
+    """
+    def __init__(self, driver, callTime):
+        self._driver = driver
+        self._callTime = callTime
+        self._lock = threading.Lock()
+        self.inside = 0
+        self.maxInside = 0
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._driver, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args):
+            with self._lock:
+                self.inside += 1
+                self.calls += 1
+                self.maxInside = max(self.maxInside, self.inside)
+            try:
+                time.sleep(self._callTime)
+                return attr(*args)
+            finally:
+                with self._lock:
+                    self.inside -= 1
+        return call
+
+
+class ImmediateReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+def percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def run(mode, queries, spacing, abortAfter, callTime):
+    driver = CountingDriver(AndorSimulator(width=64, height=64, readoutTime=0.01), callTime)
+    waiter = acq_wait.createWaiter(driver)
+    started = threading.Event()
+    exposureDone = []
+
+    def exposure():
+        driver.SetAcquisitionMode(1)
+        driver.SetExposureTime(30)
+        waiter.arm()
+        driver.StartAcquisition()
+        started.set()
+        status = waiter.wait()
+        while status[1] == driver.DRV_ACQUIRING:
+            waiter.waitForFrame()
+            status = driver.GetStatus()
+        exposureDone.append(time.time())
+
+    replies = []
+
+    def reply(begin):
+        replies.append(time.time() - begin)
+
+    if mode == "before":
+        pool = ThreadPool(30)
+        sampler = telemetry.TelemetrySampler(driver, maxAge=0)  # every temp read the driver
+
+        def temp(begin):
+            telemetry.line('temp', sampler.get())
+            reply(begin)
+
+        def abort():
+            driver.AbortAcquisition()
+            waiter.abort()
+
+        pool.apply_async(exposure)
+        started.wait()
+        driver.calls = 0
+        abortAt = None
+        for i in range(queries):
+            if abortAt is None and i * spacing >= abortAfter:
+                abortAt = time.time()
+                pool.apply_async(abort)
+            pool.apply_async(temp, (time.time(),))
+            time.sleep(spacing)
+        pool.close()
+        pool.join()
+    else:
+        executor = hardware.HardwareExecutor(driver=ImmediateReactor())
+        waiter.between = executor.service
+        sampler = telemetry.TelemetrySampler(driver, interval=0.2, maxAge=1.0,
+                                             call=lambda f, *args: executor.call(hardware.TELEMETRY, f, *args))
+        executor.start()
+        sampler.start()
+
+        def temp():
+            return telemetry.line('temp', sampler.get())
+
+        executor.submit(hardware.CONTROL, exposure)
+        started.wait()
+        driver.calls = 0
+        abortAt = None
+        for i in range(queries):
+            if abortAt is None and i * spacing >= abortAfter:
+                abortAt = time.time()
+                waiter.abort()
+                executor.submit(hardware.ABORT, driver.AbortAcquisition)
+            begin = time.time()
+            snapshot = sampler.current()
+            if snapshot is not None:
+                telemetry.line('temp', snapshot)
+                reply(begin)
+            else:
+                executor.submit(hardware.TELEMETRY, temp).addCallback(lambda line, begin=begin: reply(begin))
+            time.sleep(spacing)
+        sampler.stop()
+        executor.stop()
+
+    replies.sort()
+    return {'maxInside': driver.maxInside,
+            'calls': driver.calls,
+            'median': percentile(replies, 50),
+            'p95': percentile(replies, 95),
+            'max': replies[-1],
+            'abort': exposureDone[0] - abortAt}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mode", choices=("before", "after"), default="after")
+    parser.add_argument("--queries", type=int, default=400, help="temp commands sent during the exposure")
+    parser.add_argument("--spacing", type=float, default=0.005, help="seconds between temp commands")
+    parser.add_argument("--abort-after", type=float, default=1.5, help="seconds into the queries to abort")
+    parser.add_argument("--call-time", type=float, default=0.002, help="seconds every SDK call takes")
+    args = parser.parse_args()
+
+    result = run(args.mode, args.queries, args.spacing, args.abort_after, args.call_time)
+    print("%-7s %12s %9s %12s %12s %12s %11s" % ("mode", "SDK in flight", "SDK calls", "temp p50 ms", "temp p95 ms",
+                                                 "temp max ms", "abort ms"))
+    print("%-7s %12d %9d %12.2f %12.2f %12.2f %11.1f" % (args.mode, result['maxInside'], result['calls'],
+                                                         result['median'] * 1e3, result['p95'] * 1e3,
+                                                         result['max'] * 1e3, result['abort'] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python2
+"""
+Header position lookup: per-frame full reparse of the heimdall log (Evora.heimdallParseLogFile) against the indexed
+tcc_logs.PositionLogStore, on a synthetic 24 h log sampled every --interval seconds.
+
+Run from the repository root:
+    python benchmarks/bench_position_logs.py
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import calendar
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from evora.server.server import Evora
+from evora.server.tcc_logs import PositionLogStore, heimdallLogName
+
+
+def writeLog(path, start, samples, interval):
+    rng = np.random.RandomState(0)
+    with open(path, 'w') as f:
+        for i in range(samples):
+            stamp = time.strftime("%Y%m%dT%H:%M:%S", time.gmtime(start + i * interval))
+            ra, dec, lst, za = rng.uniform(0, 24), rng.uniform(-30, 80), rng.uniform(0, 24), rng.uniform(0, 80)
+            f.write("%s %.5f %.5f 2000.0 %.5f %.4f\n" % (stamp, ra, dec, lst, za))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between log samples")
+    parser.add_argument("--frames", type=int, default=1000, help="lookups to time on the index")
+    parser.add_argument("--legacy-frames", type=int, default=3, help="lookups to time on the full reparse")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        day = calendar.timegm((2020, 7, 22, 0, 0, 0))
+        samples = int(86400 / args.interval)
+        obsTime = time.gmtime(day + 43200.5)
+        path = os.path.join(directory, heimdallLogName(obsTime))
+        writeLog(path, day, samples, args.interval)
+        print("log: %d lines, %.1f MB" % (samples, os.path.getsize(path) / 1e6))
+
+        evora = Evora()
+        start = time.time()
+        for i in range(args.legacy_frames):
+            legacy = evora.heimdallParseLogFile(path, obsTime)
+        legacyTime = (time.time() - start) / args.legacy_frames
+
+        store = PositionLogStore(directory)
+        start = time.time()
+        indexed = store.lookup(obsTime)
+        firstTime = time.time() - start
+
+        start = time.time()
+        for i in range(args.frames):
+            store.lookup(time.gmtime(day + 60 * (i % 1440)))
+        lookupTime = (time.time() - start) / args.frames
+
+        with open(path, 'a') as f:
+            f.write("%s 1.0 2.0 2000.0 3.0 4.0\n" % time.strftime("%Y%m%dT%H:%M:%S", time.gmtime(day + 86399)))
+        start = time.time()
+        store.lookup(obsTime)
+        appendTime = time.time() - start
+
+        assert np.allclose(legacy, indexed), (legacy, indexed)
+        print("full reparse per frame:   %10.1f ms" % (legacyTime * 1e3))
+        print("index build (first use):  %10.1f ms" % (firstTime * 1e3))
+        print("indexed lookup per frame: %10.1f us" % (lookupTime * 1e6))
+        print("lookup after append:      %10.1f us" % (appendTime * 1e6))
+        print("speedup per frame:        %10.0fx" % (legacyTime / lookupTime))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python2
+"""
+Real time preview cost: time to build a preview on the server and the bytes it puts on the wire.
+
+For each preview size and decimation method the frame is turned into a preview --repeats times with
+preview.makePreview() and packed with frame_stream.pack(), as FramePushFactory.publish() does.  "link fps" is the
+frame rate the packet size allows on a --link-mbit network, "cpu fps" the rate the server could build previews at.
+The "full" row is the uint16 frame as it was sent before.
+
+Run from the repository root:
+    python benchmarks/bench_preview.py --size 2048 --link-mbit 100
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import time
+
+import numpy as np
+
+import evora.common.frame_stream as frame_stream
+import evora.server.preview as preview
+
+
+def timeIt(func, repeats):
+    start = time.time()
+    for i in range(repeats):
+        result = func()
+    return (time.time() - start) / repeats, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048, help="frame width and height in pixels")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--link-mbit", type=float, default=100, help="network bandwidth in Mbit/s")
+    args = parser.parse_args()
+
+    frame = np.random.RandomState(0).poisson(800, (args.size, args.size)).astype(np.uint16)
+    linkBytes = args.link_mbit * 1e6 / 8
+
+    print("%dx%d frame, %g Mbit/s link" % (args.size, args.size, args.link_mbit))
+    print("%-14s %12s %12s %10s %10s" % ("", "build (ms)", "packet (kB)", "cpu fps", "link fps"))
+    seconds, packet = timeIt(lambda: frame_stream.pack(0, 0, 0, "object", 1, frame), args.repeats)
+    size = sum(len(part) for part in packet)
+    print("%-14s %12.2f %12.0f %10.0f %10.1f" % ("full", seconds * 1e3, size / 1e3, 1 / seconds, linkBytes / size))
+
+    for previewSize in (1024, 512, 256):
+        for method in preview.METHODS:
+            def build():
+                pixels, factor, low, high = preview.makePreview(frame, previewSize, method)
+                return frame_stream.pack(0, 0, 0, "object", 1, pixels, frame_stream.PREVIEW, factor, low, high)
+            seconds, packet = timeIt(build, args.repeats)
+            size = sum(len(part) for part in packet)
+            print("%-14s %12.2f %12.0f %10.0f %10.1f" % ("%d %s" % (previewSize, method), seconds * 1e3, size / 1e3,
+                                                         1 / seconds, linkBytes / size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+"""
+Real time display rate: frames per second the image panel can render.
+
+"before" repeats what DrawImage did for every frame: clear the axes, imshow a new image, tight_layout and draw the
+whole canvas.  "after" is ImagePlot, which keeps the image and only blits it after the first frame.  Both render
+into a Matplotlib Agg canvas of the image window's size (650x550 at 100 dpi), so the wx bitmap copy of a real
+window is not included.  "artists" is the number of images left in the axes at the end.
+
+Run from the repository root:
+    python benchmarks/bench_render.py --size 1024 --frames 50
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import time
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from evora.client.gui.image_plot import ImagePlot
+
+
+def makeFigure():
+    figure = Figure(figsize=(6.5, 5.5), dpi=100)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot(111)
+    axes.get_yaxis().set_visible(False)
+    axes.get_xaxis().set_visible(False)
+    axes.invert_xaxis()
+    return figure, axes, canvas
+
+
+def before(frames):
+    figure, axes, canvas = makeFigure()
+    start = time.time()
+    for frame in frames:
+        axes.clear()
+        plot = axes.imshow(frame, vmin=700, vmax=900, origin='lower')
+        plot.set_clim(vmin=700, vmax=900)
+        plot.set_cmap('gray')
+        figure.tight_layout()
+        canvas.draw()
+    return len(frames) / (time.time() - start), len(axes.images)
+
+
+def after(frames):
+    figure, axes, canvas = makeFigure()
+    plot = ImagePlot(figure, axes, canvas)
+    start = time.time()
+    for frame in frames:
+        plot.show(frame, 700, 900, 'gray')
+        plot.draw()
+    return len(frames) / (time.time() - start), len(axes.images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1024, help="frame width and height in pixels")
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    random = np.random.RandomState(0)
+    frames = [random.poisson(800, (args.size, args.size)).astype(np.uint16) for i in range(4)]
+    frames = [frames[i % len(frames)] for i in range(args.frames)]
+    print("%dx%d frames, %d frames" % (args.size, args.size, args.frames))
+    print("%-8s %10s %10s" % ("", "fps", "artists"))
+    for name, run in (("before", before), ("after", after)):
+        print("%-8s %10.1f %10d" % ((name,) + run(frames)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python2
+"""
+Display statistics cost: min, max, mean, median and MAD of a uint16 frame.
+
+"old" is what the client did for every image before: fits_utils.calcstats with Python's min()/max() over data.flat
+and np.median, then the MAD in DrawImage.plotImage.  "numpy" is the same with the NumPy reductions.  "histogram" is
+stats_utils.image_stats, exact, and "fast" the same from a sample of the pixels.
+
+Run from the repository root:
+    python benchmarks/bench_stats.py --size 2048
+"""
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import time
+
+import numpy as np
+
+import evora.common.utils.stats as stats_utils
+
+
+def old(data):
+    median = np.median(data.flat)
+    return [min(data.flat), max(data.flat), np.mean(data.flat), median, np.median(np.abs(data.ravel() - median))]
+
+
+def vectorized(data):
+    median = np.median(data)
+    return [data.min(), data.max(), data.mean(), median, np.median(np.abs(data.ravel() - median))]
+
+
+def timeIt(func, data, repeats):
+    start = time.time()
+    for i in range(repeats):
+        func(data)
+    return (time.time() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=2048, help="frame width and height in pixels")
+    parser.add_argument("--repeats", type=int, default=10)
+    args = parser.parse_args()
+
+    frame = np.random.RandomState(0).poisson(800, (args.size, args.size)).astype(np.uint16)
+    print("%dx%d frame" % (args.size, args.size))
+    print("%-10s %12s" % ("", "time (ms)"))
+    for name, func, repeats in (("old", old, 1),
+                                ("numpy", vectorized, args.repeats),
+                                ("histogram", stats_utils.image_stats, args.repeats),
+                                ("fast", lambda data: stats_utils.image_stats(data, fast=True), args.repeats)):
+        print("%-10s %12.1f" % (name, timeIt(func, frame, repeats) * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -12,7 +12,6 @@ import wx
 
 matplotlib.use("WXAgg")
 import matplotlib.pyplot as plt
-import numpy as np
 from astropy.io import fits
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg as FigureCanvas
 from twisted.internet import wxreactor
@@ -27,13 +26,19 @@ from twisted.protocols import basic
 from twisted.protocols.ftp import FTPClient
 
 import evora.client.gui.gui_elements as gui
+from evora.client.gui.image_plot import ImagePlot
 # GUI element imports
 import evora.common.classes.acquisition as ac
 import evora.common.classes.logs as lc
 import evora.common.classes.scripting as sc
+import evora.common.command_protocol as command_protocol
+import evora.common.frame_ring as frame_ring
+import evora.common.frame_stream as frame_stream
+import evora.common.messages as messages
 import evora.common.logging.my_logger as my_logger
 import evora.common.utils.fits as fits_utils
 import evora.common.utils.logs as log_utils
+import evora.common.utils.stats as stats_utils
 from evora.common import netconsts
 
 """
@@ -50,6 +55,7 @@ app = None  # reference to Evora app
 port_dict = {}  # dictionary storing different connections that may be open.
 ftpClientProc = None
 logger = my_logger.myLogger("photoAcquisitionGUI.py", "client")
+PREVIEW_SIZE = 1024  # longest side of the real time previews asked from the server
 
 # Getting to parents (i.e. different classes)
 # Three parents will get to the Evora class and out of the notebook
@@ -328,6 +334,7 @@ class Evora(wx.Frame):
 
         # port_dict[str(netconsts.FTP_TRANSFER_PORT)] = reactor.connectTCP(netconsts.HEIMDALL_IP, netconsts.FTP_TRANSFER_PORT, FileClientFactory(app.frame1))
         port_dict[str(netconsts.FTP_GET_PORT)] = reactor.connectTCP('localhost', netconsts.FTP_GET_PORT, TransferClient(app.frame1))
+        port_dict[str(netconsts.FRAME_STREAM_PORT)] = reactor.connectTCP(netconsts.HEIMDALL_IP, netconsts.FRAME_STREAM_PORT, FrameStreamClient(app.frame1))
 
     def onConnectCallback(self, msg):
         """
@@ -338,11 +345,13 @@ class Evora(wx.Frame):
         # msg = args[0]
         # thread = args[1]
 
-        logger.debug(msg + " Startup callback entered")
+        logger.debug(msg.value + " Startup callback entered")
         self.connected = True
 
         # get the number of clients
-        status = int(msg.split(",")[0])
+        status = msg['result']
+        # a server that sends the temperature with the status pushes its changes as telemetry lines
+        self.takeImage.tempInstance.pushed = msg.get('temperature') is not None
 
         self.logFunction = self.logMain
         logString = log_utils.get_log_str('status ' + str(status), 'post')
@@ -375,7 +384,7 @@ class Evora(wx.Frame):
         When connect is sent to the server and is done this will set the state of the GUI.
         """
         self.logFunction = self.logMain
-        logString = log_utils.get_log_str('connect ' + msg, 'post')
+        logString = log_utils.get_log_str(msg.text, 'post')
         self.logMethod(self.logFunction, logString)
 
         self.connected = True  # boolean to tell if connected to server
@@ -405,6 +414,7 @@ class Evora(wx.Frame):
         self.connection.disconnect()  # this is the acutal disconnection from the server'
         ftp = port_dict['5505']
         ftp.disconnect()
+        port_dict.pop(str(netconsts.FRAME_STREAM_PORT)).disconnect()
 
         self.connected = False
         self.enableConnections(True, False, False)
@@ -443,7 +453,7 @@ class Evora(wx.Frame):
         When the camera sends it has shutdown successfully then this runs and locks down the GUI.
         """
         self.logFunction = self.logMain
-        logString = log_utils.get_log_str("shutdown " + msg, 'post')
+        logString = log_utils.get_log_str(msg.text, 'post')
         self.logMethod(self.logFunction, logString)
 
         self.takeImage.tempInstance.isConnected = False
@@ -709,6 +719,7 @@ class DrawImage(wx.Panel):
         self.axes.get_xaxis().set_visible(False)
         self.axes.invert_xaxis()
         self.canvas = FigureCanvas(self, -1, self.figure)
+        self.imagePlot = ImagePlot(self.figure, self.axes, self.canvas)  # keeps one image artist, blits redraws
 
         # If one wants to add the toolbar uncomment
         # self.toolbar = Toolbar(self.canvas)
@@ -733,32 +744,29 @@ class DrawImage(wx.Panel):
 
     def plotImage(self, data, scale, cmap):
         """
-        Should call updatePassedStats first before calling this. Creates new plot to be drawn.
+        Should call updatePassedStats first before calling this. Puts the image in the plot to be drawn, reusing the
+        image of the last plot.
         """
-        self.mad = np.median(np.abs(data.ravel() - self.median))  # median absolute deviation
+        if self.mad is None:  # median absolute deviation not passed in
+            self.mad = stats_utils.image_stats(data)['mad']
         deviation = scale * self.mad
         self.upper = self.median + deviation
         self.lower = self.median - deviation
 
-        self.plot = self.axes.imshow(data, vmin=self.lower, vmax=self.upper, origin='lower')
-        # self.axes.invert_xaxis()
-
-        self.plot.set_clim(vmin=self.lower, vmax=self.upper)
-        self.plot.set_cmap(cmap)
-        self.figure.tight_layout()
+        self.imagePlot.show(data, self.lower, self.upper, cmap)
 
     def refresh(self):
         """
-        Draws image onto figure.  Call after using plotImage.
+        Draws image onto figure.  Call after using plotImage.  Only the image is redrawn unless the layout changed.
         """
-        self.canvas.draw()
-        self.canvas.Refresh()
+        if self.imagePlot.draw():
+            self.canvas.Refresh()
 
     def clear(self):
         """
         Clear the current figure to be redrawn.
         """
-        self.axes.clear()
+        self.imagePlot.clear()
 
     # Replaced with similar method in AddLinearSpacer
     def getData(self, image):
@@ -785,7 +793,7 @@ class DrawImage(wx.Panel):
             self.parent.imageName.SetLabel("")
             self.parent.Layout()
 
-    def updatePassedStats(self, stats_list):  # list needs to be [min, max, mean, median]
+    def updatePassedStats(self, stats_list):  # list needs to be [min, max, mean, median] or [..., median, mad]
         """
         Updates the global stats from passed in stat list.
         """
@@ -793,27 +801,25 @@ class DrawImage(wx.Panel):
         self.max = stats_list[1]
         self.mean = stats_list[2]
         self.median = stats_list[3]
+        self.mad = stats_list[4] if len(stats_list) > 4 else None
 
     def updateStats(self, data):
         """
         # Deprecated for a similar method in AddLinearSpacer.py
         """
-        self.min = np.min(data.flat)
-        self.max = np.max(data.flat)
-        self.mean = np.mean(data.flat)
-        self.median = np.median(data.flat)
+        self.updatePassedStats(fits_utils.calcstats(data))
 
     def updateLims(self, min, max):
         """
         Update the figure contrast
         """
-        self.plot.set_clim(vmin=min, vmax=max)
+        self.imagePlot.setClim(min, max)
 
     def updateCmap(self, cmap):
         """
         Update the color map of the figure to the passed in one.
         """
-        self.plot.set_cmap(cmap)
+        self.imagePlot.setCmap(cmap)
 
     def closeFig(self):
         """
@@ -944,17 +950,26 @@ class Scripting(wx.Panel):  # Code for widgets is in scriptingClasses.py
 # Classes for twisted
 class EvoraForwarder(basic.LineReceiver):
     """
-    Sends and receives data from Evora server.
+    Sends and receives data from Evora server.  Commands are tagged with a request ID (see command_protocol) so
+    their replies can not be confused with the replies to other commands, or to other clients.  The replies are
+    decoded once into messages.Message records, which is what the callbacks get; the connection asks for the JSON
+    encoding as soon as it is made.
     """
+    MAX_LENGTH = 65536  # a history reply of telemetry.MAX_POINTS points is longer than the default
+
     def __init__(self):
         self.output = None
-        self._deferreds = {}
+        self._deferreds = {}  # key -> deferred waiting for the next untagged line with that key
+        self._requests = {}  # request ID -> (deferred, progress) of the commands in flight
+        self._listeners = {}  # key -> callbacks of every untagged line with that key, e.g. telemetry
+        self._nextRequest = 1
 
-    def dataReceived(self, data):
+    def lineReceived(self, line):
         """
-        Handles incoming data and starts the proper call back chain based on the key received from the server.
+        Handles incoming data and starts the proper call back chain based on the request ID or the key received
+        from the server.
         """
-        logger.debug("Received from E. server: " + data)
+        logger.debug("Received from E. server: " + line)
 
         # Get GUI instance
         gui = self.factory.gui
@@ -966,23 +981,34 @@ class EvoraForwarder(basic.LineReceiver):
         gui.takeImage.filterInstance.protocol = self
         gui.scripting.scriptCommands.protocol = self
 
-        # With a multi-threaded server one is not guarenteed to receive one line at a time.
-        # This code take into account receiving multiple lines.
-        sep_data = data.rsplit()  # split for multiple lines
-        size = len(sep_data)  # size of sep_data will always be even (key followed by data pair)
-        for i in range(0, size, 2):
-            singular_sep_data = [sep_data[i], sep_data[i + 1]]
-
-            if singular_sep_data[0] in self._deferreds:
-                self._deferreds.pop(singular_sep_data[0]).callback(singular_sep_data[1])
-
-    def sendCommand(self, data):
-        """
-        Wrapper method for sending lines to the Evora server.
-        """
-        logger.debug("Sent to E. server: " + data)
-        self.sendLine(data)
-        d = self._deferreds[data.split(" ")[0]] = defer.Deferred()
+        message = messages.decodeLine(line)
+        if message.requestId in self._requests:
+            d, progress = self._requests[message.requestId]
+            if not message.event:
+                del self._requests[message.requestId]
+                d.callback(message)
+                return
+            if progress is not None:
+                progress(message)
+                return
+        if message.key in self._deferreds:
+            self._deferreds.pop(message.key).callback(message)
+        for callback in self._listeners.get(message.key, ()):
+            callback(message)
+
+    def sendCommand(self, data, progress=None):
+        """
+        Wrapper method for sending lines to the Evora server.  Returns a deferred fired with the Message of the
+        reply.  progress, if given, is called with the Message of every event of the command (e.g. seriesSent3 of
+        a series); otherwise events go to the deferreds of addDeferred.
+        """
+        requestId = str(self._nextRequest)
+        self._nextRequest += 1
+        line = command_protocol.tagRequest(requestId, data)
+        logger.debug("Sent to E. server: " + line)
+        self.sendLine(line)
+        d = defer.Deferred()
+        self._requests[requestId] = (d, progress)
         return d
 
     def connectionMade(self):
@@ -998,6 +1024,18 @@ class EvoraForwarder(basic.LineReceiver):
         d = defer.Deferred()
         d.addCallback(gui.onConnectCallback)
         self._deferreds["status"] = d
+        self.listen("telemetry", gui.takeImage.tempInstance.callbackTelemetry)
+
+        d = self.sendCommand("protocol json %d" % messages.VERSION)
+        d.addCallback(lambda message: logger.info("E. server messages in %s, version %d" %
+                                                  (message['encoding'], message['version'])))
+
+    def listen(self, key, callback):
+        """
+        Calls callback with the Message of every line with key the server sends on its own, unlike addDeferred
+        which waits for one.
+        """
+        self._listeners.setdefault(key, []).append(callback)
 
     def addDeferred(self, string):
         """
@@ -1273,6 +1311,64 @@ class TransferClient(protocol.ClientFactory):
         logger.warning("connection failed on port 5503")
 
 
+class FrameStreamForwarder(frame_stream.FrameReceiver):
+    """
+    Receives the real time frames the server pushes and hands them to the exposure panel.  When the GUI runs on the
+    server's machine the frames are read in place from the shared memory ring instead.
+    """
+    def connectionMade(self):
+        super(FrameStreamForwarder, self).connectionMade()
+        self.ring = None
+        self.setMode('preview', PREVIEW_SIZE)  # the plot only needs a screen sized view
+        if frame_stream.isLocal(self.transport):
+            self.setMode('shm')  # the server keeps us on previews if it has no ring
+        self.factory.gui.takeImage.exposureInstance.frameStream = self
+        logger.info("Connection made to frame stream on port 5506")
+
+    def frameReceived(self, meta, image):
+        if meta['kind'] == frame_stream.RING:
+            frame = self.readRing(meta['number'])
+            if frame is None:
+                return
+            meta, image = frame
+        self.factory.gui.takeImage.exposureInstance.displayFrame(meta, image)
+
+    def readRing(self, number):
+        """
+        Returns (meta, image) of frame number copied out of the shared memory ring, or None if it was overwritten.
+        The frame may wait in the display queue while the camera goes round the ring, so it is not kept as a view.
+        """
+        if self.ring is None:
+            try:
+                self.ring = frame_ring.FrameRingReader(netconsts.FRAME_RING_PATH)
+            except (IOError, OSError) as e:
+                logger.warning("cannot map the frame ring (%s), asking for previews" % e)
+                self.setMode('preview', PREVIEW_SIZE)
+                return None
+        return self.ring.readCopy(number)
+
+    def connectionLost(self, reason):
+        """
+        Real time frames go back to being fetched from the HTTP file service.
+        """
+        self.factory.gui.takeImage.exposureInstance.frameStream = None
+
+
+class FrameStreamClient(protocol.ClientFactory):
+    """
+    Makes the frame stream client instance.
+    """
+    def __init__(self, gui):
+        self.gui = gui
+        self.protocol = FrameStreamForwarder
+
+    def clientConnectionLost(self, transport, reason):
+        logger.info("connection to frame stream lost normally on port 5506")
+
+    def clientConnectionFailed(self, transport, reason):
+        logger.warning("connection to frame stream failed on port 5506, real time frames will use the HTTP file service")
+
+
 class FileClient(FTPClient, object):
 
     def __init__(self, factory, username, password, passive):
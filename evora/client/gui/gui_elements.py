@@ -1,18 +1,17 @@
 #!/usr/bin/python2
 from __future__ import division, print_function
 
-import shutil
 # Imports
 # Core Imports
 import threading
 import time
-from io import BytesIO
 
 # Third-party imports
 import wx
-from twisted.internet import protocol
+from twisted.internet import error, protocol
 
 import evora.common.logging.my_logger as my_logger
+import evora.common.utils.files as file_utils
 
 __author__ = "Tristan J. Hillis"
 
@@ -75,26 +74,31 @@ class FileWriter(protocol.Protocol):
 
 
 class FileBuffer(protocol.Protocol):
-    def __init__(self, directory, fileName):
+    def __init__(self, directory, fileName, size=None, md5=None):
         """
-        Pass full directory in for the file to be saved with just the fileName
+        Pass full directory in for the file to be saved with just the fileName.  The data is written to a partial
+        file as it arrives and renamed to the file name only when the connection closes cleanly and, if given, the
+        size and md5 digest match (see file_utils.PartialFile).
         """
-        self.time = 0 - time.clock()
-        self.fileName = directory + fileName
-        self.buffer = BytesIO()
+        self.time = 0 - time.time()
+        self.size = size
+        self.md5 = md5
+        self.file = file_utils.PartialFile(directory + fileName, size)
 
     def dataReceived(self, data):
-        # print("Byte size", len(data))
-        self.buffer.write(data)
+        self.file.write(data)
 
     def connectionLost(self, reason):
-        print("Writing closed and done")
-        # save buffer
-        self.buffer.seek(0)
-        with open(self.fileName, 'wb') as f:
-            shutil.copyfileobj(self.buffer, f, length=131072)
-
-        self.time += time.clock()
+        self.time += time.time()
+        if not reason.check(error.ConnectionDone):
+            print("Transfer of", self.file.filename, "failed:", reason.getErrorMessage())
+            self.file.discard()
+            return
+        try:
+            self.file.commit(self.size, self.md5)
+        except IOError as e:
+            print(e)
+            return
         print("TIME TO GET:", self.time)
 
 
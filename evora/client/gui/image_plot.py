@@ -0,0 +1,98 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import time
+from collections import deque
+
+"""
+Draws images into a Matplotlib axes the way a real time display needs.
+
+The image artist is made once and every new frame of the same shape only replaces its pixels, limits and color map
+(set_data/set_clim/set_cmap) instead of clearing the axes and calling imshow again, which rebuilt the scene and left
+old artists behind.  The layout (tight_layout) and a full canvas draw only happen when something changes the
+geometry: the first image, a different image shape or a resize of the canvas.  Otherwise the axes' background is
+restored from the copy taken after the last full draw and only the image is drawn and blitted.
+
+It does not depend on the GUI toolkit, DrawImage in gui.py wraps it for the wx canvas.
+"""
+
+FPS_FRAMES = 30  # draws the frame rate is measured over
+
+
+class ImagePlot(object):
+    def __init__(self, figure, axes, canvas):
+        self.figure = figure
+        self.axes = axes
+        self.canvas = canvas
+        self.image = None
+        self._background = None
+        self._stale = True  # the next draw has to lay out and draw everything
+        self._draws = deque(maxlen=FPS_FRAMES)
+        self.fullDraws = 0
+        self.blits = 0
+        canvas.mpl_connect('draw_event', self._onDraw)
+        canvas.mpl_connect('resize_event', self._onResize)
+
+    def _onDraw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.axes.bbox)
+
+    def _onResize(self, event):
+        self._stale = True
+
+    def show(self, data, vmin, vmax, cmap):
+        """
+        Puts data in the image with the given limits and color map.  Call draw() to get it on screen.
+        """
+        if self.image is not None and self.image.get_array().shape == data.shape:
+            self.image.set_data(data)
+            self.image.set_clim(vmin, vmax)
+            self.image.set_cmap(cmap)
+            return
+        self.clear()
+        self.image = self.axes.imshow(data, vmin=vmin, vmax=vmax, cmap=cmap, origin='lower')
+        self._stale = True
+
+    def setClim(self, vmin, vmax):
+        if self.image is not None:
+            self.image.set_clim(vmin, vmax)
+
+    def setCmap(self, cmap):
+        if self.image is not None:
+            self.image.set_cmap(cmap)
+
+    def clear(self):
+        """
+        Removes the image, the next one lays the axes out again.
+        """
+        if self.image is not None:
+            self.image.remove()
+            self.image = None
+        self._stale = True
+
+    def draw(self):
+        """
+        Returns True when the whole figure was drawn, False when only the image was blitted.
+        """
+        self._draws.append(time.time())
+        if self._stale or self._background is None or self.image is None:
+            self.figure.tight_layout()
+            self.canvas.draw()  # takes the new background in _onDraw
+            self._stale = False
+            self.fullDraws += 1
+            return True
+        self.canvas.restore_region(self._background)
+        self.axes.draw_artist(self.image)
+        self.canvas.blit(self.axes.bbox)
+        self.blits += 1
+        return False
+
+    def fps(self):
+        """
+        Returns the rate of the recent draws in frames per second.
+        """
+        if len(self._draws) < 2 or self._draws[-1] == self._draws[0]:
+            return 0.0
+        return (len(self._draws) - 1) / (self._draws[-1] - self._draws[0])
+
+    def resetFps(self):
+        self._draws.clear()
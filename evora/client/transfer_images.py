@@ -1,24 +1,274 @@
 #!/usr/bin/env python2
 from __future__ import absolute_import, division, print_function
 
+import base64
+import errno
+import httplib
+import os
+import posixpath
+import socket
 import threading
 import time
+import urllib
+from collections import deque
 
-from Queue import Queue
 from twisted.internet import protocol, reactor
 from twisted.protocols import basic
-# FTP Client Things
-from twisted.protocols.ftp import FTPClient
 
-# GUI element imports
-import evora.client.gui.gui_elements as gui
 import evora.common.netconsts as netconsts
+import evora.common.utils.files as file_utils
 
-# Global variables
-ftp = None
-numberOfTransfers = 0
-imageQueue = Queue()
-imageGet = threading.Event()
+"""
+Relays image requests from the GUI to the server's HTTP file service.
+
+Transfers run on a pool of worker threads, each with its own kept-alive connection, so a series does not wait for
+one image at a time over a slow link.  Waiting transfers sit in priority lanes (LANES, highest first): a real time
+frame is fetched before any science frame still queued, and a newer real time frame replaces one that has not
+started yet, since only the latest is worth displaying.  A transfer that breaks off is retried and resumes from the
+bytes already on disk, with If-Range making sure they are of the same file.
+
+Files are written to a partial file and renamed into place once complete (file_utils.PartialFile), so the GUI never
+opens half an image.  With VERIFY the server's MD5 of each file is checked before the rename.
+"""
+
+LANES = ('real', 'science')  # highest priority first
+REAL, SCIENCE = 0, 1
+WORKERS = 3  # parallel transfers
+RETRIES = 3  # further attempts after a transfer breaks off
+RETRY_DELAY = 0.5  # seconds, times the attempt number
+HISTORY = 100  # finished transfers kept for the throughput statistics
+VERIFY = False  # check every file against the server's MD5, costs reading each file once more on both ends
+
+
+class Transfer(object):
+    """
+    One file to fetch and how the fetch went.
+    """
+    def __init__(self, parser, name, savePath, saveName, lane):
+        self.parser = parser
+        self.name = name  # relative to the image directory on the server
+        self.savePath = savePath
+        self.saveName = saveName
+        self.lane = lane
+        self.offset = 0  # bytes already in the partial file
+        self.etag = None  # of the file the saved bytes came from
+        self.bytes = 0  # bytes received over all attempts
+        self.attempts = 0
+        self.queued = time.time()
+        self.started = None
+        self.finished = None
+
+    def filename(self):
+        return self.savePath + self.saveName
+
+    def seconds(self):
+        return self.finished - self.started
+
+    def rate(self):
+        """
+        Returns the throughput in MB/s from the first attempt to the end of the last.
+        """
+        return self.bytes / max(self.seconds(), 1e-6) / 1e6
+
+
+class FileService(object):
+    """
+    Fetches images from the server's HTTP file service (evora/server/file_server.py) over one kept-alive connection.
+    """
+    def __init__(self, host, port, chunk=1024 * 1024, verify=VERIFY):
+        self.host = host
+        self.port = port
+        self.chunk = chunk
+        self.verify = verify
+        self.connection = None
+
+    def request(self, url, headers={}):
+        """
+        Returns the response to GET url, reconnecting once if the server closed the idle connection.
+        """
+        for attempt in range(2):
+            try:
+                if self.connection is None:
+                    self.connection = httplib.HTTPConnection(self.host, self.port, timeout=30)
+                self.connection.request("GET", url, headers=headers)
+                return self.connection.getresponse()
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                if attempt == 1:
+                    raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def retrieve(self, transfer):
+        """
+        Pre: transfer.offset bytes of transfer.etag's file are already in its partial file.
+        Post: The rest of the file is written to the partial file, which is then renamed to transfer.filename(), with
+        transfer.offset, etag and bytes kept up to date as it arrives.  Raises IOError when the server does not have
+        the file or it cannot be saved or verified, and socket.error or httplib.HTTPException when the transfer
+        breaks off, keeping the partial file.
+        """
+        if not os.path.exists(file_utils.part_name(transfer.filename())):
+            transfer.offset = 0
+        headers = {'Want-Digest': "md5"} if self.verify else {}
+        if transfer.offset:
+            headers.update({'Range': "bytes=%d-" % transfer.offset, 'If-Range': transfer.etag})
+        try:
+            response = self.request("/files/" + urllib.quote(transfer.name), headers)
+            if response.status == httplib.REQUESTED_RANGE_NOT_SATISFIABLE and transfer.offset:
+                response.read()
+                if response.getheader("Content-Range") == "bytes */%d" % transfer.offset:
+                    # everything had arrived before the connection broke
+                    file_utils.PartialFile(transfer.filename(), offset=transfer.offset).commit(transfer.offset)
+                    return
+                transfer.offset = 0  # the file shrank, start over
+                return self.retrieve(transfer)
+            if response.status not in (httplib.OK, httplib.PARTIAL_CONTENT):
+                response.read()
+                error = errno.ENOENT if response.status == httplib.NOT_FOUND else None
+                raise IOError(error, "%s: HTTP %d %s" % (transfer.name, response.status, response.reason))
+
+            if response.status == httplib.OK:
+                transfer.offset = 0
+            transfer.etag = response.getheader("ETag")
+            length = int(response.getheader("Content-Length"))
+            size = transfer.offset + length
+            digest = response.getheader("Digest", "")
+            md5 = base64.b64decode(digest[4:]) if digest.startswith("md5=") else None
+
+            partial = file_utils.PartialFile(transfer.filename(), size, transfer.offset)
+            try:
+                while length > 0:
+                    data = response.read(min(self.chunk, length))
+                    if not data:
+                        raise httplib.IncompleteRead(b"", length)
+                    partial.write(data)
+                    transfer.offset += len(data)
+                    transfer.bytes += len(data)
+                    length -= len(data)
+            except BaseException:
+                partial.close()
+                raise
+            partial.commit(size, md5)
+        except (httplib.HTTPException, socket.error):
+            self.close()  # the connection is in an unknown state
+            raise
+
+
+class TransferScheduler(object):
+    """
+    Queues transfers in their lanes and runs them on workers worker threads (QueueWatcher).  Results are handed to
+    the transfer's parser through dispatch, which puts them on the reactor thread.
+    """
+    def __init__(self, host, port, workers=WORKERS, retries=RETRIES, retryDelay=RETRY_DELAY, verify=VERIFY,
+                 dispatch=reactor.callFromThread):
+        self.retries = retries
+        self.retryDelay = retryDelay
+        self.dispatch = dispatch
+        self.directory = ""  # the relay's working directory on the server, see cwd()
+        self.history = deque(maxlen=HISTORY)
+        self._lanes = [deque() for lane in LANES]
+        self._condition = threading.Condition()
+        self._active = 0
+        self.submitted = self.done = self.failed = self.superseded = self.retried = 0
+        self._watchers = [QueueWatcher(self, FileService(host, port, verify=verify)) for i in range(workers)]
+
+    def start(self):
+        for watcher in self._watchers:
+            watcher.start()
+
+    def cwd(self, path):
+        """
+        Names submitted from now on are relative to path (relative to the current directory).
+        """
+        directory = posixpath.normpath(posixpath.join(self.directory, path))
+        self.directory = "" if directory == "." else directory
+
+    def cdup(self):
+        self.directory = posixpath.dirname(self.directory)
+
+    def submit(self, parser, name, savePath, saveName, lane=SCIENCE):
+        """
+        Pre: name is relative to the current directory and lane one of REAL and SCIENCE.
+        Post: Returns the queued Transfer.  A REAL transfer replaces the REAL ones still waiting.
+        """
+        transfer = Transfer(parser, posixpath.join(self.directory, name), savePath, saveName, lane)
+        with self._condition:
+            if lane == REAL:
+                self.superseded += len(self._lanes[REAL])
+                self._lanes[REAL].clear()
+            self._lanes[lane].append(transfer)
+            self.submitted += 1
+            self._condition.notify()
+        return transfer
+
+    def next(self):
+        """
+        Blocks until a transfer is waiting and returns the one with the highest priority.
+        """
+        with self._condition:
+            while not any(self._lanes):
+                self._condition.wait()
+            self._active += 1
+            return next(lane for lane in self._lanes if lane).popleft()
+
+    def run(self, service, transfer):
+        """
+        Fetches transfer with service, retrying and resuming when it breaks off, and reports the result.
+        """
+        transfer.started = time.time()
+        error = None
+        while True:
+            transfer.attempts += 1
+            try:
+                service.retrieve(transfer)
+                break
+            except (httplib.HTTPException, socket.error) as e:  # socket.error first, it is an IOError
+                if transfer.attempts > self.retries:
+                    error = e
+                    break
+                with self._condition:
+                    self.retried += 1
+                time.sleep(self.retryDelay * transfer.attempts)
+            except IOError as e:  # not there or cannot be saved, trying again will not help
+                error = e
+                break
+        transfer.finished = time.time()
+        if error is not None and os.path.exists(file_utils.part_name(transfer.filename())):
+            os.remove(file_utils.part_name(transfer.filename()))
+
+        with self._condition:
+            self._active -= 1
+            self.history.append(transfer)
+            if error is None:
+                self.done += 1
+            else:
+                self.failed += 1
+        if error is None:
+            print("Transferred %s: %d bytes in %.3f s (%.1f MB/s, %d attempts, waited %.3f s)" %
+                  (transfer.name, transfer.bytes, transfer.seconds(), transfer.rate(), transfer.attempts,
+                   transfer.started - transfer.queued))
+            self.dispatch(transfer.parser.transferDone, None, file=transfer.filename())
+        else:
+            self.dispatch(transfer.parser.transferFail, error)
+
+    def stats(self):
+        """
+        Returns the counters and the mean and latest throughput (MB/s) of the recent transfers.
+        """
+        with self._condition:
+            rates = [transfer.rate() for transfer in self.history if transfer.bytes]
+            return {'queued': sum(len(lane) for lane in self._lanes),
+                    'active': self._active,
+                    'submitted': self.submitted,
+                    'done': self.done,
+                    'failed': self.failed,
+                    'superseded': self.superseded,
+                    'retried': self.retried,
+                    'meanRate': sum(rates) / len(rates) if rates else 0.0,
+                    'lastRate': rates[-1] if rates else 0.0}
 
 
 class FileServer(basic.LineReceiver):
@@ -106,117 +356,73 @@ class Parser(object):
         Receive an input and splitps it up and based on the first argument will execute the right method
         (e.g. input=connect will run the Evora startup routine).
         """
-        global ftp, numberOfTransfers
         input = input.split()
         if input[0] == 'get':
             """
-            Retrieve file.
-            >>> get fileName saveDirectory saveName
+            Retrieve file.  Real time frames go in the REAL lane.
+            >>> get fileName saveDirectory saveName [type]
             """
             serverImageName = input[1]
             savePath = input[2]
             saveName = input[3]
-            inputs = (self, serverImageName, savePath, saveName)
-            imageQueue.put(inputs)
-            # type = input[4]
-            # print(serverImageName, savePath, saveName)
-            # d = ftp.retrieveFile(serverImageName, gui.FileBuffer(savePath, saveName), offset=0)
-            # d.addCallback(self.transferDone, file=savePath+saveName)
-            # d.addErrback(self.transferFail)
-            # print("Transfers:", numberOfTransfers)
+            lane = REAL if len(input) > 4 and input[4] == 'real' else SCIENCE
+            transfers.submit(self, serverImageName, savePath, saveName, lane)
             return None
 
         if input[0] == 'cwd':
-            ftp.cwd(input[1]).addCallback(self.done)
+            transfers.cwd(input[1])
             return "cwd None"
 
         if input[0] == 'cdup':
-            ftp.cdup().addCallback(self.done)
+            transfers.cdup()
             return 'cdup None'
 
+        if input[0] == 'transferStats':
+            """
+            >>> transferStats
+            """
+            stats = transfers.stats()
+            return "transferStats %d,%d,%d,%d,%d,%d,%d,%.1f,%.1f" % (
+                stats['queued'], stats['active'], stats['submitted'], stats['done'], stats['failed'],
+                stats['superseded'], stats['retried'], stats['meanRate'], stats['lastRate'])
+
         if input[0] == 'test':
-            ftp.pwd().addCallback(self.done)
+            self.done(transfers.directory)
 
     def done(self, msg):
         print(msg)
 
     def transferDone(self, msg, file):
-        global numberOfTransfers
-        numberOfTransfers -= 1
         self.protocol.sendData("get %s" % file)
-        imageGet.set()
-        imageGet.clear()
 
     def transferFail(self, msg):
-        imageGet.set()
-        imageGet.clear()
-
-        pass
-
-
-class FileClient(FTPClient, object):
-
-    def __init__(self, factory, username, password, passive):
-        super(FileClient, self).__init__(username=username, password=password, passive=passive)
-        # Set to not be passive ftp protocol, ie 1.
-        self.factory = factory
-
-    def connectionMade(self):
-        global ftp
-        ftp = self
-        # Pass the protocol to the gui when connection is made to FTP Sever
-        # self.factory.protocol = self
-        # Main wx.Frame
-
-        print("CONNECTION MADE")
-
-
-class FileClientFactory(protocol.ClientFactory):
-    def __init__(self):
-        self.protocol = None
-        # self.protocol = None
-        # self.protocol = self.buildProtocol('localhost')
-
-    def buildProtocol(self, addr):
-        # The username and passwd are meaningless but needed
-        user = 'anonymous'
-        passwd = 'mro@uw.edu'  # again this is meaningless
-        self.protocol = FileClient(self, username=user, password=passwd, passive=1)
-        return self.protocol
-
-    def clientConnectionLost(self, transport, reason):
-        print("Connection to FTP server lost normally:", reason)
-
-    def clientConnectionFailed(self, transport, reason):
-        print("Connection failed:", reason)
+        print("Transfer failed:", msg)
 
 
 class QueueWatcher(threading.Thread):
-
-    def __init__(self):
+    """
+    One of the scheduler's workers, running its transfers over its own connection.
+    """
+    def __init__(self, scheduler, service):
         threading.Thread.__init__(self)
+        self.daemon = True
+        self.scheduler = scheduler
+        self.service = service
 
     def run(self):
         while True:
-            # get from queue
-            while imageQueue.qsize() > 0:
-                parser, serverImName, savePath, saveName = imageQueue.get()
-                d = ftp.retrieveFile(serverImName, gui.FileBuffer(savePath, saveName), offset=0)
-                d.addCallback(parser.transferDone, file=savePath + saveName)
-                d.addErrback(parser.transferFail)
-                imageGet.wait()
-            time.sleep(0.01)
+            self.scheduler.run(self.service, self.scheduler.next())
 
 
-if __name__ == "__main__":
-    ftpFactory = FileClientFactory()
+# Global variables
+transfers = TransferScheduler(netconsts.HEIMDALL_IP, netconsts.FILE_HTTP_PORT)
+
 
+if __name__ == "__main__":
     fileServerFactory = FileServerClient()
 
-    t = QueueWatcher()
-    t.start()
+    transfers.start()
 
-    reactor.connectTCP(netconsts.HEIMDALL_IP, netconsts.FTP_TRANSFER_PORT, ftpFactory)
     reactor.listenTCP(netconsts.FTP_GET_PORT, fileServerFactory)
 
     reactor.run()
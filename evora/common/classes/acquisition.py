@@ -10,11 +10,14 @@ import gui_elements as gui  # get useful methods
 import pandas as pd
 import thread
 import wx  # get wxPython
-from Queue import Queue
+from twisted.internet import defer, reactor, threads
 
+import evora.common.frame_stream as frame_stream
+from evora.common.display_queue import DisplayQueue
 import evora.common.logging.my_logger as my_logger
 import evora.common.utils.fits as fits_utils
 import evora.common.utils.logs as log_utils
+import evora.common.utils.stats as stats_utils
 
 __author__ = "Tristan J. Hillis"
 
@@ -28,24 +31,15 @@ This set of classes handles everything in the imaging tab.
 
 # Global Variables
 logger = my_logger.myLogger("acquisitionClasses.py", "client")
-
-
-class EventQueue(Queue, object):
-    def __init__(self, event):
-        super(EventQueue, self).__init__()
-        self.event = event
-
-    def addItem(self, item):
-        self.put(item)
-        self.event.set()
-        self.event.clear()
+FETCH_TIMEOUT = 60  # seconds to wait for the file relay to fetch an image
 
 
 # Thread Image Queue Watcher
 class ImageQueueWatcher(threading.Thread, object):
     """
-    This class will watch the image queue in the class Exposure and retrieve the image files via
-    the ftp server as they come into the Queue.  This makes it so the ftp is not saturated by requests.
+    This class will watch the image queue (a DisplayQueue) in the class Exposure and display its images one at a time,
+    fetching the image files via the file relay first.  The next image is only taken once the last one is on screen,
+    so real time frames that come faster than they can be shown coalesce in the queue rather than pile up.
     """
     def __init__(self, exposeClass):
         threading.Thread.__init__(self)
@@ -53,30 +47,41 @@ class ImageQueueWatcher(threading.Thread, object):
 
     def run(self):
         while True:
-            if self.exposeClass.imageQueue.qsize() == 0:
-                self.exposeClass.imageAddedEvent.wait()
-                pass
-            while self.exposeClass.imageQueue.qsize() > 0:
-                line = str(self.exposeClass.imageQueue.get()).split(";")
-                # image_path = line[0]
-                image_name = line[1]
-                image_type = line[2]
-                logString = line[3]
-                if logString == "None":
-                    logString = None
-
-                if image_type != 'real':
-                    self.exposeClass.ftpLayer.sendCommand("get %s %s %s %s" % (image_name, self.exposeClass.saveDir,
-                                                                               self.exposeClass.currentImage + ".fits",
-                                                                               image_type)).addCallback(self.transferCallback, logString=logString)
+            item, queued = self.exposeClass.imageQueue.get()
+            try:
+                if isinstance(item, tuple):  # a frame from the frame stream
+                    self.exposeClass.showFrame(*item)
                 else:
-                    self.exposeClass.ftpLayer.sendCommand("get %s %s %s %s" %
-                                                          (image_name, "/tmp/", image_name, image_type)) \
-                        .addCallback(self.transferCallback, logString=logString)
-                time.sleep(0.01)
+                    self.fetch(item)
+            except (defer.TimeoutError, IOError) as e:
+                logger.warning("Could not display %s: %s" % (item if isinstance(item, str) else "frame", e))
+            self.exposeClass.imageQueue.finished(queued)
+
+    def fetch(self, line):
+        line = str(line).split(";")
+        # image_path = line[0]
+        image_name = line[1]
+        image_type = line[2]
+        logString = line[3]
+        if logString == "None":
+            logString = None
+        stats_list = stats_utils.parse_record(line[4].split(",")) if len(line) > 4 else None
+
+        if image_type != 'real':
+            command = "get %s %s %s %s" % (image_name, self.exposeClass.saveDir, self.exposeClass.currentImage + ".fits",
+                                           image_type)
+        else:
+            command = "get tmp/%s %s %s %s" % (image_name, "/tmp/", image_name, image_type)
+        savedImage = threads.blockingCallFromThread(reactor, self.request, command)
+        self.exposeClass.display(savedImage, logString, stats_list)
 
-    def transferCallback(self, msg, logString):
-        self.exposeClass.display(msg, logString)
+    def request(self, command):
+        """
+        Sends command to the file relay from the reactor thread, returning the deferred of its reply.
+        """
+        d = self.exposeClass.ftpLayer.sendCommand(command)
+        d.addTimeout(FETCH_TIMEOUT, reactor)
+        return d
 
 
 class ProgressTimer(object):
@@ -217,6 +222,7 @@ class Exposure(wx.Panel):
         self.protocol = None  # gives access to the Evora client protocol
         self.ftp = None  # Gives access to FTP client protocol
         self.ftpLayer = None
+        self.frameStream = None  # frame stream protocol; real time frames come through it instead of FTP when connected
         self.parent = parent  # gives access to the higher classes
 
         self.saveDir = "/home/mro/data/"  # Default directory to save images to.
@@ -227,6 +233,7 @@ class Exposure(wx.Panel):
         self.logFunction = None  # keeps an instance of the function that will be used to log the status
 
         self.realSentCount = 0
+        self.realFromFiles = True  # whether the running real time exposure fetches its frames from the file service
 
         self.timer = ProgressTimer(self)
 
@@ -297,8 +304,7 @@ class Exposure(wx.Panel):
         self.vertSizer.Fit(self)
 
         # Setup work for Image Queue
-        self.imageAddedEvent = threading.Event()
-        self.imageQueue = EventQueue(self.imageAddedEvent)
+        self.imageQueue = DisplayQueue()
         self.imageThread = ImageQueueWatcher(self)
         self.imageThread.daemon = True
         self.imageThread.start()
@@ -390,15 +396,15 @@ class Exposure(wx.Panel):
                 self.abort = True
                 line = " ".join(line[1:])
 
-                # start callback that looks for a path leading to a real image
-                d = self.protocol.addDeferred("realSent")
-                d.addCallback(self.displayRealImage)
-
                 command = "real " + line
                 logString = log_utils.get_log_str(command, 'pre')
                 self.log(self.logFunction, logString)
 
-                self.ftpLayer.sendCommand("cwd tmp/").addCallback(self.startRealTime, command=command, itime=itime)
+                self.realFromFiles = self.frameStream is None
+                self.imageQueue.resetStats()
+                if self.parent.parent.parent.imageOpen:
+                    self.parent.parent.parent.window.panel.imagePlot.resetFps()
+                self.startRealTime(None, command=command, itime=itime)
 
             if imType == 3:  # series exposure
                 dialog = wx.TextEntryDialog(None, "How many exposure?", "Entry", "1", wx.OK | wx.CANCEL)
@@ -427,16 +433,11 @@ class Exposure(wx.Panel):
                             self.stopExp.Enable(True)
                             self.abort = True
 
-                            # set up all callbacks for series
-                            for i in range(int(self.seriesImageNumber)):
-                                d = self.protocol.addDeferred("seriesSent" + str(i + 1))
-                                d.addCallback(self.displaySeriesImage)
-
                             command = "series " + str(line)
                             logString = log_utils.get_log_str(command, 'pre')
                             self.log(self.logFunction, logString)
 
-                            d = self.protocol.sendCommand(command)
+                            d = self.protocol.sendCommand(command, progress=self.seriesProgress)
                             d.addCallback(self.seriesCallback)
 
                             # start timer
@@ -451,8 +452,8 @@ class Exposure(wx.Panel):
                         dialog.Destroy()
 
     def startRealTime(self, msg, command, itime):
-        # send command to start realtime exposure
-        d = self.protocol.sendCommand(command)
+        # send command to start realtime exposure; every realSent event goes to displayRealImage
+        d = self.protocol.sendCommand(command, progress=self.realProgress)
         d.addCallback(self.realCallback)  # this will clear the image path queue
 
         # start timer
@@ -468,7 +469,6 @@ class Exposure(wx.Panel):
         and if the image was successfully taken then it plots it.
         """
         # May need to thread to a different method if to slow
-        results = msg.split(",")
 
         # immediatly reset button
         self.abort = False
@@ -482,37 +482,65 @@ class Exposure(wx.Panel):
         self.timer.stop()
 
         # get success;
-        success = int(results[0])  # 1 for true 0 for false
+        success = msg['success']  # 1 for true 0 for false
 
         logger.debug(str(self.parent.parent.parent.imageOpen))
         logger.info("opened window from exposeCallback method")
 
         if success == 1:
             # get name of image and path
-            filePath = results[1].split("/")
+            filePath = msg['filename'].split("/")
             name = filePath[-1].rstrip()
             path = ""
             for i in filePath[:-1]:
                 path += i + "/"
 
             # get time sent to server
-            # time = float(results[2])
+            # time = msg['itime']
 
             logger.debug(path + name)
 
             # log the status
             self.logFunction = self.logExposure
-            logString = log_utils.get_log_str("expose " + msg + "," + self.currentImage, 'post')
+            logString = log_utils.get_log_str(msg.text + "," + self.currentImage, 'post')
 
-            line = "%s;%s;single;%s" % (path, name, logString)
-            self.imageQueue.addItem(line)
+            stats_list = self.passStats(msg.stats(), self.currentImage + ".fits")
+            line = "%s;%s;single;%s;%s" % (path, name, logString, self.recordField(stats_list))
+            self.imageQueue.put(line)
 
         else:
             logger.info("Successfully Aborted")
 
-    def display(self, savedImage, logString):
+    def passStats(self, stats_list, imageName):
+        """
+        Pre: stats_list is Message.stats() of an expose or seriesSent message, None when the server sent none.
+        Post: Shows the server's statistics of the image in the status bar, if the image window is open, before the
+        image is fetched, and returns stats_list.
+        """
+        if stats_list is not None and self.parent.parent.parent.imageOpen:
+            wx.CallAfter(self.showStats, stats_list, imageName)
+        return stats_list
+
+    def showStats(self, stats_list, imageName):
+        if self.parent.parent.parent.imageOpen:
+            panel = self.parent.parent.parent.window.panel
+            panel.updatePassedStats(stats_list)
+            panel.updateScreenStats(imageName)
+
+    def recordField(self, stats_list):
+        """
+        Returns stats_list as the statistics field of an image queue line.
+        """
+        return str(None) if stats_list is None else ",".join(repr(value) for value in stats_list)
+
+    def display(self, savedImage, logString, stats_list=None):
+        """
+        Called by the ImageQueueWatcher thread with each fetched image; returns once it is plotted.  stats_list is the
+        statistics the server sent with the image, they are only computed here when it sent none.
+        """
         data = fits_utils.getdata(savedImage)
-        stats_list = fits_utils.calcstats(data)
+        if stats_list is None:
+            stats_list = fits_utils.calcstats(data)
 
         imageName = None
         if "/tmp/" not in savedImage:
@@ -520,97 +548,121 @@ class Exposure(wx.Panel):
 
         # change the gui with thread safety
         # plots the image
-        wx.CallAfter(self.safePlot, data, stats_list, imageName)
+        self.plotAndWait(data, stats_list, imageName)
 
         if logString is not None:
             self.log(self.logFunction, logString)
 
-    def safePlot(self, data, stats_list, imageName):
+    def displayFrame(self, meta, data):
+        """
+        Called by the frame stream protocol with each real time frame while a real time exposure runs.  The frame
+        replaces the one still waiting to be shown, if any.
+        """
+        if not self.abort:  # real time exposure is over
+            return
+        self.imageQueue.put((meta, data), coalesce=True)
+
+    def showFrame(self, meta, data):
+        """
+        Called by the ImageQueueWatcher thread with a frame from the frame stream; returns once it is plotted.
+        """
+        stats_list = fits_utils.calcstats(data)  # from the raw pixels, which can be histogrammed
+        if meta['kind'] == frame_stream.PREVIEW:  # previews come as 8 bits, the stats scale with the pixels
+            scale = (meta['high'] - meta['low']) / 255
+            stats_list = [value * scale + meta['low'] for value in stats_list[:4]] + [stats_list[4] * scale]
+        data = frame_stream.dequantize(meta, data)
+        self.plotAndWait(data, stats_list, None)
+
+    def plotAndWait(self, data, stats_list, imageName):
+        """
+        Plots from the main thread with safePlot and waits until it is done.
+        """
+        plotted = threading.Event()
+        wx.CallAfter(self.safePlot, data, stats_list, imageName, plotted)
+        plotted.wait()
+
+    def safePlot(self, data, stats_list, imageName, plotted=None):
         """
         Used in conjunction with wx.CallAfter to update the embedded Matplotlib in the image window.
         If the image window is closed it will open it and then plot, otherwise it is simply plotted.
+        plotted, if given, is set when done.
         """
-        if not self.parent.parent.parent.imageOpen:  # Open image window if closed.
-            # create new window
-            self.parent.parent.parent.openImage("manual open")
-
-        else:  # If image window open then clear the axis of the previous image
-            self.parent.parent.parent.window.panel.clear()
+        try:
+            if not self.parent.parent.parent.imageOpen:  # Open image window if closed.
+                # create new window
+                self.parent.parent.parent.openImage("manual open")
 
-        plotInstance = self.parent.parent.parent.window
-        sliderVal = plotInstance.currSliderValue / 10
+            plotInstance = self.parent.parent.parent.window
+            sliderVal = plotInstance.currSliderValue / 10
 
-        plotInstance.panel.updatePassedStats(stats_list)
-        plotInstance.panel.plotImage(data, sliderVal, plotInstance.currMap)
-        plotInstance.panel.updateScreenStats(imageName)
-        plotInstance.panel.refresh()
+            plotInstance.panel.updatePassedStats(stats_list)
+            plotInstance.panel.plotImage(data, sliderVal, plotInstance.currMap)
+            plotInstance.panel.updateScreenStats(imageName)
+            plotInstance.panel.refresh()
+        finally:
+            if plotted is not None:
+                plotted.set()
 
     def displayRealImage(self, msg):
         """
-        Called when client recieves that there is an image to be displayed from real time series.
+        Called when client recieves that there is an image to be displayed from real time series.  The frame field
+        of the realSent message is the path of the saved frame, or only the frame number when it came through the
+        frame stream.
         """
-        path = msg
+        path = msg['frame']
 
         # no abort then display the image
         if self.abort:  # means that abort can be called.
-            # add a new deffered object to set up for another incoming image
-            d = self.protocol.addDeferred("realSent")
-            d.addCallback(self.displayRealImage)
+            if self.realFromFiles and not path.isdigit():  # a saved frame that did not come through the stream
+                path = path.split("/")
+                name = path[-1]
+                path = "/".join(path[:-1]) + "/"
 
-            # get stats
-            path = path.split("/")
-            name = path[-1]
-            path = "/".join(path[:-1]) + "/"
-
-            line = "%s;%s;real;%s" % (path, name, str(None))
-            self.imageQueue.addItem(line)
+                line = "%s;%s;real;%s;%s" % (path, name, str(None), self.recordField(msg.stats()))
+                self.imageQueue.put(line, coalesce=True)
 
             if float(self.timeToSend) >= 2.5:
                 self.timer.stop()
                 self.timer.start(self.timeToSend)
 
+    def realProgress(self, msg):
+        """
+        Called with each event of the real time exposure command.
+        """
+        if msg.key == "realSent":
+            self.displayRealImage(msg)
+
     def realCallback(self, msg):
         """
         Called when the camera has been aborted during a real time series exposure.
         """
-        self.protocol.removeDeferred("realSent")  # Remove floating deffered object
-
-        # release ImageQueueWatcher if it is stuck waiting for an image to display and empty Queue
-        self.imageQueue.empty()
+        # a frame still waiting to be shown is stale now
+        self.imageQueue.discardLatest()
 
         self.timer.stop()
 
         self.logFunction = self.logExposure
-        logString = log_utils.get_log_str("real " + msg, 'post')
+        logString = log_utils.get_log_str(msg.text, 'post')
         self.log(self.logFunction, logString)
 
-        logger.debug("Completed real time series with exit: " + msg)
-
-        d = self.ftpLayer.sendCommand("cdup")
-        d.addCallback(self.done)
+        logger.debug("Completed real time series with exit: " + msg.value)
+        stats = self.imageQueue.stats()
+        fps = self.parent.parent.parent.window.panel.imagePlot.fps() if self.parent.parent.parent.imageOpen else 0.0
+        logger.info("Real time display: %d frames shown, %d skipped, lag %.3f s mean, %.3f s max, %.1f fps rendered" %
+                    (stats['displayed'], stats['dropped'], stats['meanLag'], stats['maxLag'], fps))
 
     def done(self, msg):
         print(msg)
 
-    def displaySeriesImage_thread(self, msg):
-        """
-        Executes displaySeriesImage in anther thread when the callback is executed via the main thread.
-        """
-        logger.debug("From series image callback thread: " + repr(msg))
-        msg = msg.rstrip()
-        thread.start_new_thread(self.displaySeriesImage, (msg,))
-
     def displaySeriesImage(self, msg):
         """
         Called when the server sends that an image is ready to display.
         """
-        print("ENTERED DISPLAY SERIES IMAGE", msg)
-        msg = msg.split(",")
+        print("ENTERED DISPLAY SERIES IMAGE", msg.text)
 
-        imNum = int(msg[0])
-        logger.debug(str(type(imNum)))
-        time = float(msg[1])
-        path = msg[2]
+        imNum = msg['number']
+        time = msg['itime']
+        path = msg['filename']
 
         fullPath = path.split("/")
         name = fullPath[-1].rstrip()
@@ -635,11 +687,11 @@ class Exposure(wx.Panel):
                     self.iterateImageCounter(self.currentImage)
 
             self.logFunction = self.logExposure
-            dataMsg = ",".join(msg)
-            logString = log_utils.get_log_str("seriesSent " + dataMsg + "," + self.currentImage, 'post')
+            logString = log_utils.get_log_str("seriesSent " + msg.value + "," + self.currentImage, 'post')
 
-            line = "%s;%s;series;%s" % (path, name, logString)
-            self.imageQueue.addItem(line)
+            stats_list = self.passStats(msg.stats(), self.currentImage + ".fits")
+            line = "%s;%s;series;%s;%s" % (path, name, logString, self.recordField(stats_list))
+            self.imageQueue.put(line)
 
             if self.seriesImageNumber is not None:
                 print("MAKES IT THIS FAR")
@@ -650,37 +702,33 @@ class Exposure(wx.Panel):
                         self.timer.stop()
                         self.timer.start(time)
 
-    def seriesCallback(self, msg):
-        msg = msg.split(",")
-        exitNumber = int(msg[1])  # server will send which count the series loop ended on
-        if exitNumber <= int(self.seriesImageNumber):
-            for i in range(exitNumber, int(self.seriesImageNumber) + 1):
-                key = "seriesSent" + str(i)
-                self.protocol.removeDeferred(key)
-
-        # reset series image number
-        logger.debug(str(self.protocol._deferreds))
+    def seriesProgress(self, msg):
+        """
+        Called with each event of a series command, seriesSent<n> once image n is saved.
+        """
+        if msg.key.startswith("seriesSent"):
+            self.displaySeriesImage(msg)
 
+    def seriesCallback(self, msg):
         self.abort = False
         self.expButton.Enable(True)
         if self.stopExp.IsEnabled():
             self.stopExp.Enable(False)
 
         self.timer.stop()
-        self.imageQueue.empty()
+        self.imageQueue.discardLatest()
 
-        dataMsg = ",".join(msg)
         self.logFunction = self.logExposure
-        logString = log_utils.get_log_str("series " + dataMsg, 'post')
+        logString = log_utils.get_log_str(msg.text, 'post')
         self.log(self.logFunction, logString)
-        logger.debug("Completed real time series with exit: " + str(msg))
+        logger.debug("Completed real time series with exit: " + msg.value)
 
     def abort_callback(self, msg):
         # self.parent.parent.parent.expGauge.SetValue(0)  # redundancy to clear the exposure gauge
         self.logFunction = self.logExposure
-        logString = log_utils.get_log_str("abort " + msg, 'post')
+        logString = log_utils.get_log_str(msg.text, 'post')
         self.log(self.logFunction, logString)
-        logger.debug("Aborted " + msg)
+        logger.debug("Aborted " + msg.value)
 
     def getAttributesToSend(self):
         """
@@ -809,7 +857,7 @@ class Exposure(wx.Panel):
         d.addCallback(self.abort_callback)
 
         self.timer.stop()
-        self.imageQueue.empty()
+        self.imageQueue.discardLatest()
 
         self.expButton.Enable(True)
         self.stopExp.Enable(False)
@@ -913,6 +961,7 @@ class TempControl(wx.Panel):
         self.protocol = None
         self.parent = parent
         self.isConnected = False
+        self.pushed = False  # whether the server pushes telemetry lines, so watchTemp need not poll
         self.logFunction = None
         self.currTemp = None
         self.prevMode = None
@@ -1027,9 +1076,9 @@ class TempControl(wx.Panel):
         Executes when the camera TEC temperature has been set.
         """
         self.logFunction = self.logTemp
-        logString = log_utils.get_log_str("setTEC " + msg, 'post')
+        logString = log_utils.get_log_str(msg.text, 'post')
         self.log(self.logFunction, logString)
-        logger.debug("Cooling to: " + msg)
+        logger.debug("Cooling to: " + msg.value)
 
     def onStopCooling(self, event):
         """
@@ -1048,23 +1097,34 @@ class TempControl(wx.Panel):
         Called when the server has completed its warmup routine.
         """
         self.logFunction = self.logTemp
-        logString = log_utils.get_log_str("warmup " + msg, 'post')
+        logString = log_utils.get_log_str(msg.text, 'post')
         self.log(self.logFunction, logString)
 
-        logger.info("Warmed with exit: " + msg)
+        logger.info("Warmed with exit: " + msg.value)
 
     def watchTemp(self):
         """
         Run as a demon thread in the background when the GUI connects to the camera.
-        Asks server for temperature every 10 seconds and sets a callback function.
+        Asks server for temperature every 10 seconds and sets a callback function, or only once if the server
+        pushes the changes itself (see callbackTelemetry).
         """
         # create an infinite while loop
         while self.isConnected:
             d = self.protocol.sendCommand("temp")
             d.addCallback(self.callbackTemp)
+            if self.pushed:
+                return
             #  put thread to sleep; on wake up repeats
             time.sleep(10)
 
+    def callbackTelemetry(self, msg):
+        """
+        Executes when the server pushes a change of the cooler or camera status.  The telemetry line has the
+        fields of the temp reply, so it goes through callbackTemp.
+        """
+        if self.isConnected:
+            self.callbackTemp(msg)
+
     def callbackTemp(self, msg):
         """
         Executes when the server sends the temperature back upon request.
@@ -1072,11 +1132,10 @@ class TempControl(wx.Panel):
         """
         # print msg
         # print threading.current_thread().name
-        temp = msg.split(",")[2]  # parser sends stats on temperture where I grab that temp
-        self.currTemp = float(temp)
-        temp = str(int(round(float(temp))))
-        mode = int(msg.split(",")[0])
-        targetTemp = msg.split(",")[3]
+        self.currTemp = msg['temperature']  # parser sends stats on temperture where I grab that temp
+        temp = str(int(round(self.currTemp)))
+        mode = msg['mode']
+        targetTemp = msg['target']
         # if self.current_mode is not None:
         #     self.current_mode = mode
 
@@ -165,10 +165,8 @@ class ScriptCommands(wx.Panel):
                         dialog.Destroy()
 
                     if overwrite is not None or overwrite == wx.ID_OK:
-                        d = self.protocol.addDeferred("seriesSent")
-                        d.addCallback(exposeClass.displaySeriesImage_thread)
-
-                        d = self.protocol.sendCommand(sendCommand + " " + imtype + " " + number + " 0 " + str(self.parent.parent.parent.binning))
+                        d = self.protocol.sendCommand(sendCommand + " " + imtype + " " + number + " 0 " + str(self.parent.parent.parent.binning),
+                                                      progress=exposeClass.seriesProgress)
                         d.addCallback(exposeClass.seriesCallback)
 
                         # start timer
@@ -190,11 +188,8 @@ class ScriptCommands(wx.Panel):
                         dialog.Destroy()
 
                     if overwrite is not None or overwrite == wx.ID_OK:
-                        for i in range(int(number)):
-                            d = self.protocol.addDeferred("seriesSent" + str(i + 1))
-                            d.addCallback(exposeClass.displaySeriesImage_thread)
-
-                        d = self.protocol.sendCommand(sendCommand + " " + imtype + " " + number + " " + itime + " " + str(self.parent.parent.parent.binning))
+                        d = self.protocol.sendCommand(sendCommand + " " + imtype + " " + number + " " + itime + " " + str(self.parent.parent.parent.binning),
+                                                      progress=exposeClass.seriesProgress)
                         d.addCallback(exposeClass.seriesCallback)
                         # start timer
                         thread.start_new_thread(exposeClass.exposeTimer, (float(itime),))
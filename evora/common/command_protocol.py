@@ -0,0 +1,64 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+from collections import namedtuple
+
+"""
+Line format of the camera command protocol (netconsts.CAMERA_PORT).
+
+Every message is one line.  The original format is still understood and still answered the same way:
+    temp                         a command, its arguments separated by spaces
+    temp -80,-80,0,20034         the reply or event: a key, one space and the value
+A client can tag a command with a request ID of its own choosing (any word without spaces, GUIs use a counter):
+    @17 temp
+The reply to it then carries the same tag, and the events the command produces while it runs (seriesSent<n>,
+realSent) carry the tag with a "+":
+    @17+ seriesSent3 3,0.5,/data/image.fits,...
+    @17 series 1,11
+so a client can have many commands in flight, even several of the same kind, and tell every reply apart.  Only the
+client that sent a tagged command gets the tagged lines; the other clients are sent the same messages untagged, as
+before.
+"""
+
+TAG = "@"
+EVENT = "+"
+
+Reply = namedtuple('Reply', 'requestId event key value')  # requestId is None for untagged lines
+
+
+def tagRequest(requestId, command):
+    return "%s%s %s" % (TAG, requestId, command)
+
+
+def splitRequest(line):
+    """
+    Returns (request ID, command) of a command line; the ID is None when the line has no tag.
+    """
+    if not line.startswith(TAG):
+        return None, line
+    tag, _, command = line.partition(" ")
+    if len(tag) == len(TAG):  # a lone "@" is not a tag
+        return None, line
+    return tag[len(TAG):], command.lstrip(" ")
+
+
+def tagReply(requestId, message, event=False):
+    """
+    Returns the line that answers request requestId with message, an event of it when event is True.
+    """
+    return "%s%s%s %s" % (TAG, requestId, EVENT if event else "", message)
+
+
+def parseReply(line):
+    """
+    Pre: line is one line from the server, without its line ending.
+    Post: Returns a Reply.  The value is "" for a line that is only a key.
+    """
+    requestId, event = None, False
+    if line.startswith(TAG):
+        tag, _, line = line.partition(" ")
+        requestId = tag[len(TAG):]
+        if requestId.endswith(EVENT):
+            requestId, event = requestId[:-len(EVENT)], True
+    key, _, value = line.strip().partition(" ")
+    return Reply(requestId, event, key, value)
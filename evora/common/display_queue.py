@@ -0,0 +1,96 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+from collections import deque
+
+"""
+Images waiting to be displayed by the client.
+
+Single and series images are kept and displayed in the order they came.  Real time frames coalesce: a new one
+replaces the one still waiting, so when plotting is slower than the camera the display skips frames instead of
+falling further and further behind.  The lag of an image is the time from put() to finished(), i.e. until it is on
+screen.
+"""
+
+LAGS = 100  # recent lags kept for the statistics
+
+
+class DisplayQueue(object):
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._kept = deque()
+        self._latest = None  # (item, time queued) of the waiting real time frame
+        self._lags = deque(maxlen=LAGS)
+        self.displayed = 0
+        self.dropped = 0
+
+    def put(self, item, coalesce=False):
+        """
+        Queues item; with coalesce it replaces the coalescing item still waiting, which counts as dropped.
+        """
+        with self._condition:
+            if coalesce:
+                if self._latest is not None:
+                    self.dropped += 1
+                self._latest = (item, time.time())
+            else:
+                self._kept.append((item, time.time()))
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Blocks until an item is waiting and returns (item, time queued), kept items first, or None after timeout
+        seconds.  Pass the time queued to finished() once the item is displayed.
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._condition:
+            while not self._kept and self._latest is None:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._condition.wait(remaining)
+            if self._kept:
+                return self._kept.popleft()
+            latest, self._latest = self._latest, None
+            return latest
+
+    def finished(self, queued):
+        """
+        Records that the item queued at queued is on screen.
+        """
+        with self._condition:
+            self.displayed += 1
+            self._lags.append(time.time() - queued)
+
+    def discardLatest(self):
+        """
+        Drops the waiting real time frame, e.g. when the real time exposure has stopped.
+        """
+        with self._condition:
+            if self._latest is not None:
+                self.dropped += 1
+                self._latest = None
+
+    def pending(self):
+        with self._condition:
+            return len(self._kept) + (self._latest is not None)
+
+    def resetStats(self):
+        with self._condition:
+            self.displayed = self.dropped = 0
+            self._lags.clear()
+
+    def stats(self):
+        """
+        Returns the counters and the latest, mean and largest display lag in seconds of the recent images.
+        """
+        with self._condition:
+            lags = list(self._lags)
+            return {'displayed': self.displayed,
+                    'dropped': self.dropped,
+                    'pending': len(self._kept) + (self._latest is not None),
+                    'lastLag': lags[-1] if lags else 0.0,
+                    'meanLag': sum(lags) / len(lags) if lags else 0.0,
+                    'maxLag': max(lags) if lags else 0.0}
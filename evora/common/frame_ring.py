@@ -0,0 +1,193 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import mmap
+import os
+import struct
+
+import numpy as np
+
+import evora.common.frame_stream as frame_stream
+
+"""
+Shared memory ring of real time frames for a GUI running on the server's machine.
+
+The server writes every frame into one of a fixed number of slots of a file under /dev/shm (netconsts.FRAME_RING_PATH)
+and only sends the frame number over the frame stream; the client maps the same file and reads the pixels in place.
+
+Layout, all integers in network order:
+    file header   RING_HEADER: magic, version, number of slots, pixel bytes per slot, last frame number written
+    slots         each holding the frame number it has (0 while being written), a frame_stream.HEADER
+                  record, padding to PIXEL_ALIGN, then the pixels as little-endian uint16
+
+A slot's frame number is cleared before it is rewritten and set again after, so a reader that sees the number it
+expects before and after using the pixels knows they were not overwritten in between (valid()).  A frame survives
+for as many frames as there are slots.
+
+When a larger frame comes (binning changed) the writer replaces the file with a bigger one; readers notice the
+new inode on their next miss and map it again.
+"""
+
+MAGIC = b'EVRING'
+VERSION = 1
+RING_HEADER = struct.Struct('!6sBxIIQ')
+HEAD_OFFSET = RING_HEADER.size - 8
+SEQUENCE = struct.Struct('!Q')
+PIXEL_ALIGN = 64
+
+
+def align(size):
+    return (size + PIXEL_ALIGN - 1) // PIXEL_ALIGN * PIXEL_ALIGN
+
+
+def pixelOffset():
+    """
+    Offset of the pixels from the start of a slot.
+    """
+    return align(SEQUENCE.size + frame_stream.HEADER.size)
+
+
+def slotOffset(index, slotBytes):
+    """
+    Offset of slot index in a ring with slotBytes of pixels per slot.
+    """
+    return align(RING_HEADER.size) + index * (pixelOffset() + align(slotBytes))
+
+
+class FrameRingWriter(object):
+    """
+    The server's side.  Nothing is created until the first write().
+    """
+    def __init__(self, path, slots=8):
+        self.path = path
+        self.slots = slots
+        self.slotBytes = 0
+        self._map = None
+
+    def _create(self, slotBytes):
+        self.close()
+        size = slotOffset(self.slots, slotBytes)
+        temp = self.path + ".new"
+        fd = os.open(temp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        RING_HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.slots, slotBytes, 0)
+        os.rename(temp, self.path)  # readers only ever see a complete ring
+        self.slotBytes = slotBytes
+
+    def write(self, number, obsTime, itime, imType, binning, image):
+        """
+        Pre: number > 0 and image a 2D uint16 array.
+        Post: The frame is in slot number % slots and the ring's last frame number is number.
+        """
+        if image.nbytes > self.slotBytes:
+            self._create(image.nbytes)
+        height, width = image.shape
+        offset = slotOffset(number % self.slots, self.slotBytes)
+        SEQUENCE.pack_into(self._map, offset, 0)
+        frame_stream.HEADER.pack_into(self._map, offset + SEQUENCE.size, frame_stream.VERSION, number, obsTime, itime,
+                                      width, height, binning, imType[:8], frame_stream.FULL, 1, 0.0, 0.0)
+        pixels = np.frombuffer(self._map, dtype=frame_stream.PIXEL_TYPES[frame_stream.FULL], count=image.size,
+                               offset=offset + pixelOffset()).reshape(image.shape)
+        pixels[...] = image
+        SEQUENCE.pack_into(self._map, offset, number)
+        SEQUENCE.pack_into(self._map, HEAD_OFFSET, number)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def unlink(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class FrameRingReader(object):
+    """
+    The client's side.  Raises OSError when the ring does not exist (yet) and IOError when the file is not a ring.
+    Do not close() it while images read from it are still in use.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._map = None
+        self._open()
+
+    def _open(self):
+        # the old map is dropped, not closed: images read from it keep it mapped until they are gone
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            self._inode = os.fstat(fd).st_ino
+            self._map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        magic, version, self.slots, self.slotBytes, head = RING_HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise IOError("%s is not a version %d frame ring" % (self.path, VERSION))
+
+    def _sequence(self, number):
+        return SEQUENCE.unpack_from(self._map, slotOffset(number % self.slots, self.slotBytes))[0]
+
+    def head(self):
+        """
+        Returns the number of the last frame written, 0 before the first.
+        """
+        return SEQUENCE.unpack_from(self._map, HEAD_OFFSET)[0]
+
+    def read(self, number):
+        """
+        Post: Returns (metadata dict, image) for frame number, the image a read only view of the shared memory, or
+        None when the frame has already been overwritten.  Check valid(number) after using the image, or use
+        readCopy() to keep it.
+        """
+        if self._sequence(number) != number:
+            if os.stat(self.path).st_ino == self._inode:
+                return None
+            self._open()  # the server replaced the ring
+            if self._sequence(number) != number:
+                return None
+        offset = slotOffset(number % self.slots, self.slotBytes)
+        fields = frame_stream.HEADER.unpack_from(self._map, offset + SEQUENCE.size)
+        version, number, obsTime, itime, width, height, binning, imType, kind, factor, low, high = fields
+        image = np.frombuffer(self._map, dtype=frame_stream.PIXEL_TYPES[kind], count=width * height,
+                              offset=offset + pixelOffset()).reshape(height, width)
+        meta = {'number': number,
+                'obsTime': obsTime,
+                'itime': itime,
+                'imType': imType.rstrip(b'\0'),
+                'binning': binning,
+                'kind': kind,
+                'factor': factor,
+                'low': low,
+                'high': high}
+        if not self.valid(number):
+            return None
+        return meta, image
+
+    def readCopy(self, number):
+        """
+        Like read(), but the image is a copy of the slot, or None when the frame was overwritten while it was copied.
+        """
+        frame = self.read(number)
+        if frame is None:
+            return None
+        meta, image = frame
+        image = image.copy()
+        if not self.valid(number):
+            return None
+        return meta, image
+
+    def valid(self, number):
+        """
+        Returns whether frame number is still in its slot.
+        """
+        return self._sequence(number) == number
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
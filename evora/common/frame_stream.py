@@ -0,0 +1,150 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import struct
+
+import numpy as np
+from twisted.protocols import basic
+
+"""
+Wire format of the real time frame stream (netconsts.FRAME_STREAM_PORT).
+
+Every frame is one length-prefixed packet:
+    length   4 bytes, network order, size of everything after it
+    header   HEADER below: version, frame number, readout time (unix seconds), integration time, width, height,
+             binning, image type, kind, decimation factor and the low and high values of a preview's stretch
+    pixels   width * height pixels, row major: little-endian uint16 for FULL frames, uint8 for PREVIEW frames and
+             none for RING notices, whose pixels are in the shared memory ring (see frame_ring)
+
+The server pushes packets to every connected client as each real time frame is read out, so the preview never goes
+through a file.  A client picks what it gets by sending a line on the same connection:
+    mode full             full frames only (the default)
+    mode preview <size>   previews whose longer side is at most size pixels
+    mode both <size>      the preview, followed by the full frame
+    mode shm              RING notices only; accepted from clients on the server's own machine when the server has
+                          a frame ring, otherwise the mode is left as it was
+    latest                the full frame of the most recent readout, once
+FrameReceiver is the client side; subclasses implement frameReceived().
+"""
+
+VERSION = 2
+PREFIX = struct.Struct('!I')
+HEADER = struct.Struct('!BIdfHHB8sBBff')
+FULL, PREVIEW, RING = 0, 1, 2
+PIXEL_TYPES = {FULL: np.dtype('<u2'), PREVIEW: np.dtype('u1')}
+MODES = ('full', 'preview', 'both', 'shm')
+MAX_PACKET = 64 * 1024 * 1024  # a 4096x4096 frame is 32 MB
+
+
+def pack(number, obsTime, itime, imType, binning, image, kind=FULL, factor=1, low=0.0, high=0.0):
+    """
+    Pre: image is a 2D uint16 array for FULL frames, or the uint8 pixels of a PREVIEW with its decimation factor and
+    stretch.  It is copied, so its buffer can be reused as soon as this returns.
+    Post: Returns the packet as a list of strings for transport.writeSequence(), so the pixels are not copied a
+    second time to join them to the header.
+    """
+    height, width = image.shape
+    pixels = np.ascontiguousarray(image, dtype=PIXEL_TYPES[kind]).tostring()
+    header = HEADER.pack(VERSION, number, obsTime, itime, width, height, binning, imType[:8], kind, factor, low, high)
+    return [PREFIX.pack(HEADER.size + len(pixels)) + header, pixels]
+
+
+def packNotice(number, obsTime, itime, imType, binning, shape):
+    """
+    Returns the RING notice telling a client frame number of the given shape is in the shared memory ring.
+    """
+    height, width = shape
+    header = HEADER.pack(VERSION, number, obsTime, itime, width, height, binning, imType[:8], RING, 1, 0.0, 0.0)
+    return [PREFIX.pack(HEADER.size) + header]
+
+
+def unpack(packet):
+    """
+    Pre: packet is one packet without its length prefix.
+    Post: Returns (metadata dict, image).  The image is a read only view of packet, or None for a RING notice.
+    Raises ValueError when the packet does not match its header.
+    """
+    version, number, obsTime, itime, width, height, binning, imType, kind, factor, low, high = \
+        HEADER.unpack_from(packet)
+    if version != VERSION:
+        raise ValueError("unsupported frame stream version %d" % version)
+    if kind not in PIXEL_TYPES and kind != RING:
+        raise ValueError("frame %d has unknown kind %d" % (number, kind))
+    pixelBytes = width * height * PIXEL_TYPES[kind].itemsize if kind != RING else 0
+    if len(packet) != HEADER.size + pixelBytes:
+        raise ValueError("frame %d is %d bytes, expected %dx%d pixels" % (number, len(packet), width, height))
+    image = None
+    if kind != RING:
+        image = np.frombuffer(packet, dtype=PIXEL_TYPES[kind], offset=HEADER.size).reshape(height, width)
+    meta = {'number': number,
+            'obsTime': obsTime,
+            'itime': itime,
+            'imType': imType.rstrip(b'\0'),
+            'binning': binning,
+            'kind': kind,
+            'factor': factor,
+            'low': low,
+            'high': high}
+    return meta, image
+
+
+def isLocal(transport):
+    """
+    Returns whether the other end of transport is on this machine.
+    """
+    peer = transport.getPeer().host
+    return peer in ('127.0.0.1', '::1') or peer == transport.getHost().host
+
+
+def dequantize(meta, image):
+    """
+    Returns a PREVIEW's pixels back in ADU (as float32) using its stretch, or a FULL frame unchanged.
+    """
+    if meta['kind'] == FULL:
+        return image
+    return image * np.float32((meta['high'] - meta['low']) / 255) + np.float32(meta['low'])
+
+
+class FrameReceiver(basic.LineOnlyReceiver):
+    """
+    Splits the stream into packets.  Twisted's IntNStringReceiver rebuilds its buffer string on every read, which is
+    quadratic in the packet size for megabyte frames, so the bytes are gathered in a bytearray instead.  Requests to
+    the server go out as lines.
+    """
+    def connectionMade(self):
+        self._buffer = bytearray()
+
+    def dataReceived(self, data):
+        self._buffer += data
+        while len(self._buffer) >= PREFIX.size:
+            length, = PREFIX.unpack_from(self._buffer)
+            if length > MAX_PACKET:
+                self.transport.loseConnection()
+                return
+            end = PREFIX.size + length
+            if len(self._buffer) < end:
+                return
+            packet = bytes(self._buffer[PREFIX.size:end])
+            del self._buffer[:end]
+            meta, image = unpack(packet)
+            self.frameReceived(meta, image)
+
+    def setMode(self, mode, size=None):
+        """
+        Asks for full frames, previews of at most size pixels, both, or ring notices (see MODES).
+        """
+        if mode not in MODES:
+            raise ValueError("unknown frame stream mode %s, expected one of %s" % (mode, MODES))
+        self.sendLine("mode %s %d" % (mode, size) if size else "mode %s" % mode)
+
+    def requestLatest(self):
+        """
+        Asks for the full frame of the most recent readout.
+        """
+        self.sendLine("latest")
+
+    def frameReceived(self, meta, image):
+        """
+        Called with each frame's metadata and pixels.
+        """
+        raise NotImplementedError
@@ -0,0 +1,198 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import json
+import re
+
+import evora.common.command_protocol as command_protocol
+
+"""
+Typed records for the camera server's replies and events.
+
+The server's messages are "key value" lines whose value is a comma separated list, e.g. "temp 20036,20002,-60.2,-60"
+or "seriesSent3 3,0.5,/data/image_003.fits,...".  SCHEMAS names and types those fields for every key, so a message
+is turned into a Message with typed fields once, instead of every callback splitting the string again.
+
+A connection starts in the 'text' encoding, the lines above.  A client that sends
+    protocol json <version>
+is answered "protocol json,<version in use>" and from then on gets every message as one line of compact JSON:
+    {"v":1,"key":"temp","fields":{"mode":20036,"result":20002,"temperature":-60.2,"target":-60}}
+with "id" and "event" added for the replies to its tagged commands (see command_protocol), and "extra" for values
+past the end of the schema.  The server converts and encodes each message once for all JSON clients.  Clients that
+never ask, e.g. telnet, keep getting text; decodeLine() reads both.
+"""
+
+VERSION = 1
+ENCODINGS = ('text', 'json')
+
+STATS = (('min', float), ('max', float), ('mean', float), ('median', float), ('mad', float))
+TEMPERATURE = (('mode', int), ('tempResult', int), ('temperature', float), ('target', float), ('ambient', float),
+               ('coolerVolts', float))  # the fields of the telemetry snapshot after the status
+SCHEMAS = {
+    'status': (('result', int), ('status', int)) + TEMPERATURE,
+    'telemetry': (('result', int), ('status', int)) + TEMPERATURE,
+    'connect': (('result', int),),
+    'protocol': (('encoding', str), ('version', int)),
+    'temp': (('mode', int), ('result', int), ('temperature', float), ('target', float), ('ambient', float),
+             ('coolerVolts', float)),
+    'getTEC': (('mode', int), ('temperature', float)),
+    'setTEC': (('setPoint', int),),
+    'tempRange': (('result', int), ('min', int), ('max', int)),
+    'warmup': (('success', int),),
+    'shutdown': (('success', int),),
+    'abort': (('success', int),),
+    'expose': (('success', int), ('filename', str), ('itime', float)) + STATS,
+    'real': (('success', int),),
+    'realSent': (('frame', str),) + STATS,
+    'series': (('success', int), ('count', int)),
+    'seriesSent': (('number', int), ('itime', float), ('filename', str)) + STATS,
+    'writerStats': (('depth', int), ('maxDepth', int), ('submitted', int), ('written', int), ('dropped', int),
+                    ('blocked', int), ('meanLatency', float), ('maxLatency', float)),
+    'poolStats': (('capacity', int), ('allocated', int), ('leased', int), ('highWater', int), ('leaks', int)),
+    'sessionStats': (('sent', int), ('skipped', int), ('savedTime', float), ('lastSavedTime', float)),
+    'streamStats': (('subscribers', int), ('published', int), ('sent', int), ('dropped', int)),
+    'history': (('series', str), ('start', float), ('count', int)),
+    'executorStats': tuple((lane + name, kind) for lane in ('abort', 'control', 'telemetry')
+                           for name, kind in (('Queued', int), ('Run', int), ('Median', float), ('P95', float),
+                                              ('Max', float))),
+}
+
+_NUMBERED = re.compile(r'\d+$')  # seriesSent3 uses the seriesSent schema
+
+
+def schema(key):
+    """
+    Returns the fields of messages with key, or () for keys without a schema.
+    """
+    return SCHEMAS.get(key, SCHEMAS.get(_NUMBERED.sub('', key), ()))
+
+
+def _convert(kind, text):
+    try:
+        return kind(text)
+    except ValueError:
+        return text  # e.g. "None" for the file name of a failed exposure
+
+
+def _format(value):
+    if isinstance(value, float):
+        return "%.6g" % value
+    return str(value)
+
+
+class Message(object):
+    """
+    One reply or event: its key, the typed fields of its schema and any values past the schema's end.  requestId
+    and event are those of command_protocol.
+    """
+    def __init__(self, key, fields, extra=(), requestId=None, event=False, value=None):
+        self.key = key
+        self.fields = fields
+        self.extra = list(extra)
+        self.requestId = requestId
+        self.event = event
+        self._value = value
+
+    @classmethod
+    def fromText(cls, key, value, requestId=None, event=False):
+        """
+        Types the comma separated fields of value by the schema of key.
+        """
+        fields = {}
+        parts = value.split(",") if value else []
+        names = schema(key)
+        for (name, kind), text in zip(names, parts):
+            fields[name] = _convert(kind, text)
+        return cls(key, fields, parts[len(names):], requestId, event, value)
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+    @property
+    def value(self):
+        """
+        The fields as the comma separated value of the text line.
+        """
+        if self._value is None:
+            names = [name for name, kind in schema(self.key) if name in self.fields]
+            self._value = ",".join([_format(self.fields[name]) for name in names] + self.extra)
+        return self._value
+
+    @property
+    def text(self):
+        """
+        The message as a text line without its tag, e.g. to log.
+        """
+        return self.key + " " + self.value if self.value else self.key
+
+    def stats(self):
+        """
+        Returns the server's statistics of the frame as [min, max, mean, median, mad], the order of
+        fits_utils.calcstats, or None when the message has none.
+        """
+        if any(not isinstance(self.fields.get(name), float) for name, kind in STATS):
+            return None
+        return [self.fields[name] for name, kind in STATS]
+
+    def toJson(self):
+        record = {'v': VERSION, 'key': self.key, 'fields': self.fields}
+        if self.extra:
+            record['extra'] = self.extra
+        if self.requestId is not None:
+            record['id'] = self.requestId
+            record['event'] = self.event
+        return json.dumps(record, separators=(',', ':'))
+
+
+def historyPoints(message):
+    """
+    Returns the points of a history reply as a list of (time in seconds since the epoch, value).
+    """
+    extra = message.extra
+    return [(message['start'] + float(offset), float(value)) for offset, value in zip(extra[0::2], extra[1::2])]
+
+
+def decodeLine(line):
+    """
+    Pre: line is one line from the server in either encoding, without its line ending.
+    Post: Returns its Message.
+    """
+    if line.startswith("{"):
+        record = json.loads(line)
+        return Message(str(record['key']), record['fields'], record.get('extra', ()), record.get('id'),
+                       record.get('event', False))
+    reply = command_protocol.parseReply(line)
+    return Message.fromText(reply.key, reply.value, reply.requestId, reply.event)
+
+
+class Outgoing(object):
+    """
+    A message the server sends: text is its text line, sender and requestId the connection and ID of the tagged
+    command it answers, if any.  lineFor() gives the line for each client, built once per encoding.
+    """
+    def __init__(self, text, sender=None, requestId=None, event=False):
+        self.text = text
+        self.sender = sender
+        self.requestId = requestId
+        self.event = event
+        self._lines = {}
+
+    def lineFor(self, client):
+        encoding = getattr(client, 'encoding', 'text')
+        tagged = self.requestId is not None and client is self.sender
+        line = self._lines.get((encoding, tagged))
+        if line is None:
+            line = self._lines[(encoding, tagged)] = self._render(encoding, tagged)
+        return line
+
+    def _render(self, encoding, tagged):
+        requestId = self.requestId if tagged else None
+        if encoding == 'json':
+            key, _, value = self.text.partition(" ")
+            return Message.fromText(key, value, requestId, self.event).toJson()
+        if requestId is None:
+            return self.text
+        return command_protocol.tagReply(requestId, self.text, self.event)
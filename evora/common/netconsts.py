@@ -6,4 +6,7 @@ FILTER_PI_IP = "telescopepi.mro.cwu.edu"
 CAMERA_PORT = 5502
 FTP_TRANSFER_PORT = 5504
 FTP_GET_PORT = 5505
+FRAME_STREAM_PORT = 5506
+FILE_HTTP_PORT = 5507
+FRAME_RING_PATH = "/dev/shm/evora_frames"  # shared memory frames for a GUI on the server's machine
 FILTER_PORT = 5503
@@ -0,0 +1,95 @@
+import ctypes
+import ctypes.util
+import hashlib
+import os
+
+import evora.common.logging.my_logger as my_logger
+
+logger = my_logger.myLogger("file_utils.py", "client")
+
+"""
+Downloads are written to a hidden partial file next to their destination and only renamed into place once they are
+complete, so nothing that looks for the destination (e.g. Exposure.display) can see half a file.  The rename is atomic
+because both names are in the same directory.
+"""
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+_fallocate = getattr(_libc, 'posix_fallocate', None)
+if _fallocate is not None:
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_long, ctypes.c_long]
+    _fallocate.restype = ctypes.c_int
+
+
+def part_name(filename):
+    """
+    Returns the name a download to filename is written under until it is complete.
+    """
+    directory, name = os.path.split(filename)
+    return os.path.join(directory, "." + name + ".part")
+
+
+def preallocate(f, size):
+    """
+    Reserves size bytes of disk for the open file f, so the download does not fragment it or run out of space
+    halfway.  Falls back to a (sparse) truncate where posix_fallocate is not available.
+    """
+    if _fallocate is not None and _fallocate(f.fileno(), 0, size) == 0:
+        return
+    if os.fstat(f.fileno()).st_size < size:
+        f.truncate(size)
+
+
+def md5sum(filename, chunk=1024 * 1024):
+    digest = hashlib.md5()
+    with open(filename, 'rb') as f:
+        for data in iter(lambda: f.read(chunk), b""):
+            digest.update(data)
+    return digest.digest()
+
+
+class PartialFile(object):
+    """
+    A download in progress to filename.  With offset the partial file of an earlier attempt is kept up to offset and
+    written on from there.
+    """
+    def __init__(self, filename, size=None, offset=0):
+        self.filename = filename
+        self.temp = part_name(filename)
+        self.f = open(self.temp, 'r+b' if offset and os.path.exists(self.temp) else 'wb')
+        self.f.seek(offset)
+        self.f.truncate()
+        if size:
+            preallocate(self.f, size)
+        self.written = offset
+
+    def write(self, data):
+        self.f.write(data)
+        self.written += len(data)
+
+    def commit(self, size=None, md5=None):
+        """
+        Pre: size and md5 (the binary digest), when given, are what the complete file should have.
+        Post: The file is renamed into place, replacing any older copy.  Raises IOError, keeping nothing, when it
+        does not match size or md5.
+        """
+        self.f.truncate(self.written)  # drop what was preallocated and not used
+        self.f.close()
+        if size is not None and self.written != size:
+            self.discard()
+            raise IOError("%s: got %d of %d bytes" % (self.filename, self.written, size))
+        if md5 is not None and md5sum(self.temp) != md5:
+            self.discard()
+            raise IOError("%s: checksum does not match" % self.filename)
+        os.rename(self.temp, self.filename)
+
+    def close(self):
+        """
+        Stops writing, keeping the partial file to resume from.
+        """
+        self.f.truncate(self.written)
+        self.f.close()
+
+    def discard(self):
+        self.f.close()
+        if os.path.exists(self.temp):
+            os.remove(self.temp)
@@ -1,10 +1,10 @@
 import datetime
 import os
 
-import numpy as np
 from astropy.io import fits
 
 import evora.common.logging.my_logger as my_logger
+import evora.common.utils.stats as stats_utils
 
 logger = my_logger.myLogger("fits_utils.py", "client")
 
@@ -16,18 +16,15 @@ def getdata(path):
     return fits.getdata(path)
 
 
-def calcstats(data):
+def calcstats(data, fast=False):
     """
     This function calculates the standard statistics of a FITS image of min,
-    max, mean, and median. A list of these stats is returned so that these
-    stats can then be displayed at the bottom of the image GUI window.
+    max, mean, median and the median absolute deviation. A list of these stats
+    is returned so that these stats can then be displayed at the bottom of the
+    image GUI window.  See stats_utils.image_stats for fast.
     """
-    stats_list = []
-    stats_list.append(min(data.flat))
-    stats_list.append(max(data.flat))
-    stats_list.append(np.mean(data.flat))
-    stats_list.append(np.median(data.flat))
-    return stats_list
+    stats = stats_utils.image_stats(data, fast)
+    return [stats['min'], stats['max'], stats['mean'], stats['median'], stats['mad']]
 
 
 def check_for_file(path):
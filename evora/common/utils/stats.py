@@ -0,0 +1,127 @@
+from __future__ import division
+
+import math
+
+import numpy as np
+
+"""
+Image statistics from one histogram.
+
+Camera frames are uint16, so a single np.bincount over the pixels (at most 65536 bins) holds everything needed for
+the min, max, mean, median, median absolute deviation and any percentile, exactly and without sorting the frame.
+The results match np.min, np.max, np.mean, np.median and np.percentile (linear interpolation).
+
+With fast=True every statistic comes from a regular sample of about SAMPLE pixels instead, which is plenty for a
+display stretch, but the min and max are those of the sample and can miss a hot pixel.
+
+Anything that is not unsigned integer data of at most 16 bits (e.g. dequantized float previews) falls back to the
+equivalent NumPy calls.
+"""
+
+SAMPLE = 262144  # pixels used with fast=True
+
+
+def sample(data, size=SAMPLE):
+    """
+    Returns a regular sample of about size pixels of the 2D array data (data itself when it is small).
+    """
+    step = max(1, int(math.sqrt(data.size / size)))
+    return data[::step, ::step] if data.ndim == 2 else data.ravel()[::step * step]
+
+
+def _histogrammable(data):
+    return data.dtype.kind == 'u' and data.dtype.itemsize <= 2
+
+
+def _value(cdf, k):
+    """
+    Returns the value (bin) of the kth smallest pixel, counting from 0, given the cumulative histogram.
+    """
+    return int(np.searchsorted(cdf, k + 1))
+
+
+def _median(cdf, n):
+    return (_value(cdf, (n - 1) // 2) + _value(cdf, n // 2)) / 2
+
+
+def _percentile(cdf, n, q):
+    position = q / 100 * (n - 1)
+    below = int(math.floor(position))
+    low = _value(cdf, below)
+    if below == position:
+        return float(low)
+    return low + (_value(cdf, below + 1) - low) * (position - below)
+
+
+def image_stats(data, fast=False, percentiles=()):
+    """
+    Pre: data is a non-empty image array; percentiles is a sequence of numbers between 0 and 100.
+    Post: Returns a dict with 'min', 'max', 'mean', 'median', 'mad' (median absolute deviation from the median)
+    and 'percentiles', a list of the values at the given percentiles.
+    """
+    data = np.asarray(data)
+    counted = sample(data) if fast else data
+    if not _histogrammable(data):
+        counted = counted.astype(np.float64).ravel()
+        median = np.median(counted)
+        return {'min': counted.min(),
+                'max': counted.max(),
+                'mean': counted.mean(),
+                'median': median,
+                'mad': np.median(np.abs(counted - median)),
+                'percentiles': [np.percentile(counted, q) for q in percentiles]}
+
+    counts = np.bincount(counted.ravel())
+    n = counted.size
+    cdf = np.cumsum(counts)
+    values = np.arange(len(counts))
+    median = _median(cdf, n)
+
+    # deviations from the median, doubled so they stay whole numbers when the median is halfway between two values
+    doubled = np.abs(2 * values - int(2 * median))
+    deviationCdf = np.cumsum(np.bincount(doubled, weights=counts))
+
+    nonzero = np.flatnonzero(counts)
+    return {'min': nonzero[0],
+            'max': nonzero[-1],
+            'mean': np.dot(counts, values) / n,
+            'median': median,
+            'mad': _median(deviationCdf, n) / 2,
+            'percentiles': [_percentile(cdf, n, q) for q in percentiles]}
+
+
+# The per-frame record the server sends with expose, seriesSent and realSent and writes into the FITS header.
+RECORD = ('min', 'max', 'mean', 'median', 'mad')
+RECORD_CARDS = (('DATAMIN', 'minimum pixel value'),
+                ('DATAMAX', 'maximum pixel value'),
+                ('DATAMEAN', 'mean pixel value'),
+                ('DATAMED', 'median pixel value'),
+                ('DATAMAD', 'median absolute deviation from the median'))
+
+
+def format_record(stats):
+    """
+    Returns the record of an image_stats() dict as the comma separated fields of a protocol message.
+    """
+    return ",".join("%.6g" % stats[key] for key in RECORD)
+
+
+def parse_record(fields):
+    """
+    Pre: fields is a sequence of strings, e.g. message.split(",")[i:i + len(RECORD)].
+    Post: Returns [min, max, mean, median, mad] as floats, the order of fits_utils.calcstats, or None when the fields
+    are missing or not numbers (e.g. a message from a server that sends no statistics).
+    """
+    if len(fields) < len(RECORD):
+        return None
+    try:
+        return [float(field) for field in fields[:len(RECORD)]]
+    except ValueError:
+        return None
+
+
+def header_cards(stats):
+    """
+    Returns the record of an image_stats() dict as (keyword, value, comment) FITS header cards.
+    """
+    return [(keyword, float(stats[key]), comment) for key, (keyword, comment) in zip(RECORD, RECORD_CARDS)]
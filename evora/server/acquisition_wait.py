@@ -0,0 +1,173 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+"""
+Strategies for waiting on the camera while it integrates and reads out.
+
+The acquisition paths in server.py used to spin on andor.GetStatus() until the camera left DRV_ACQUIRING, which keeps
+a full core busy for the length of every exposure.  A waiter instead sleeps until the driver reports an acquisition
+event, and can be woken from another thread by an abort.
+
+SDKWaiter   -- blocks inside WaitForAcquisitionTimeOut, woken early by CancelWait.
+PollingWaiter -- for drivers without the wait primitives; polls with a growing sleep between checks.
+
+Use createWaiter(andor) to get the best waiter for a driver module.  Set a waiter's between to have the waiting thread
+run other work before and between its waits (hardware.HardwareExecutor.service).  It is also run once more when an
+abort ends the wait, so work queued before abort() (the AbortAcquisition job) has run when the wait returns.
+"""
+
+
+class AcquisitionWaiter(object):
+    """
+    Base class for the acquisition waiters.  One waiter is shared by every Evora instance so that an abort issued on
+    one connection wakes an acquisition running on another.
+    """
+    def __init__(self, driver):
+        self.driver = driver
+        self.between = None  # called by the waiting thread before each wait and after every slice or poll
+        self._aborted = threading.Event()
+
+    def arm(self):
+        """
+        Call right before StartAcquisition to clear a previous abort.
+        """
+        self._aborted.clear()
+
+    def abort(self):
+        """
+        Wakes any thread blocked in wait or waitForFrame.  Safe to call from any thread.
+        """
+        self._aborted.set()
+
+    def isAborted(self):
+        return self._aborted.is_set()
+
+    def acquiring(self):
+        return self.driver.GetStatus()[1] == self.driver.DRV_ACQUIRING
+
+    def _between(self):
+        if self.between is not None:
+            self.between()
+
+    def waitForFrame(self, timeout=None):
+        """
+        Pre: An acquisition was started.
+        Post: Blocks until a new frame may be available, the acquisition ended, the wait was aborted or timeout
+        seconds passed.  Returns True when a frame event was seen and False otherwise.
+        """
+        raise NotImplementedError
+
+    def wait(self, timeout=None):
+        """
+        Pre: An acquisition was started.
+        Post: Blocks until the camera leaves DRV_ACQUIRING, the wait was aborted or timeout seconds passed.  Returns
+        the last [result, status] from andor.GetStatus().
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        status = self.driver.GetStatus()
+        while status[1] == self.driver.DRV_ACQUIRING and not self.isAborted():
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            self.waitForFrame(remaining)
+            status = self.driver.GetStatus()
+        if status[1] == self.driver.DRV_ACQUIRING and self.isAborted():
+            self._between()  # the work queued with the abort
+            status = self.driver.GetStatus()
+        return status
+
+
+class SDKWaiter(AcquisitionWaiter):
+    """
+    Sleeps in the driver with WaitForAcquisitionTimeOut.  The wait is done in slices of sliceMs so that a stalled
+    driver can never hold the thread forever, and CancelWait is used on abort to end the current slice at once.
+    """
+    def __init__(self, driver, sliceMs=1000):
+        super(SDKWaiter, self).__init__(driver)
+        self.sliceMs = sliceMs
+
+    def abort(self):
+        """
+        Also ends the current WaitForAcquisitionTimeOut.  CancelWait is called from the aborting thread (the reactor
+        in the server): it is the one SDK call made off the hardware thread on purpose, since the SDK provides it
+        to interrupt a wait in another thread.
+        """
+        super(SDKWaiter, self).abort()
+        self.driver.CancelWait()
+
+    def waitForFrame(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        self._between()
+        while not self.isAborted():
+            sliceMs = self.sliceMs
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                sliceMs = max(1, min(sliceMs, int(remaining * 1000)))
+
+            if self.driver.WaitForAcquisitionTimeOut(sliceMs) == self.driver.DRV_SUCCESS:
+                return True
+            self._between()
+            # DRV_NO_NEW_DATA is a timed out slice or a CancelWait; only keep waiting while still acquiring.
+            if not self.acquiring():
+                return False
+        self._between()  # the work queued with the abort
+        return False
+
+
+class PollingWaiter(AcquisitionWaiter):
+    """
+    Polls GetAcquisitionProgress, doubling the sleep between polls from minInterval up to maxInterval.  The sleep is
+    an Event wait so abort still wakes it immediately.
+    """
+    def __init__(self, driver, minInterval=0.001, maxInterval=0.05):
+        super(PollingWaiter, self).__init__(driver)
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self._lastFrame = 0
+
+    def arm(self):
+        super(PollingWaiter, self).arm()
+        self._lastFrame = 0
+
+    def waitForFrame(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        interval = self.minInterval
+        self._between()
+        while not self.isAborted():
+            frame = self.driver.GetAcquisitionProgress()[2]
+            if frame != self._lastFrame:
+                self._lastFrame = frame
+                return True
+            if not self.acquiring():
+                return False
+
+            sleep = interval
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                sleep = min(sleep, remaining)
+            self._aborted.wait(sleep)
+            self._between()
+            interval = min(interval * 2, self.maxInterval)
+        self._between()  # the work queued with the abort
+        return False
+
+
+def createWaiter(driver, mode=None):
+    """
+    Pre: Pass the andor driver module (or anything with its interface) and optionally mode, 'sdk' or 'poll'.
+    Post: Returns an SDKWaiter when the driver has the SDK wait primitives (or mode is 'sdk') and a PollingWaiter
+    otherwise.
+    """
+    if mode is None:
+        hasWait = hasattr(driver, "WaitForAcquisitionTimeOut") and hasattr(driver, "CancelWait")
+        mode = "sdk" if hasWait else "poll"
+    if mode == "sdk":
+        return SDKWaiter(driver)
+    return PollingWaiter(driver)
@@ -33,6 +33,9 @@
 %apply float *OUTPUT {int *index, float *speed}; // For GetFastestRecommendedVSSpeed()
 %apply int *OUTPUT {int *channels}; // For GetNumberADChannels()
 %apply int *OUTPUT {int *mintemp, int *maxtemp}; // For GetTemperatureRange()
+%apply int *OUTPUT {long *first, long *last}; // For GetNumberNewImages()
+%apply int *OUTPUT {long *validfirst, long *validlast}; // For GetImages16()
+%apply int *OUTPUT {long *index}; // For GetSizeOfCircularBuffer() and GetTotalNumberImagesAcquired()
 
 
 
@@ -0,0 +1,177 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+from collections import deque
+
+from twisted.internet import interfaces, reactor
+from twisted.python import threadable
+from zope.interface import implementer
+
+from evora.common.logging import my_logger
+
+"""
+Fan-out of the camera server's replies and notifications to every connected client.
+
+Every message goes through BroadcastHub.broadcast(), which may be called from any thread: from a worker thread (the
+parser, the acquisition loops, the FITS writer threads) the message is handed to the reactor with callFromThread, so
+the transports are only ever written to by the reactor thread, and in the order the messages were broadcast.
+
+Each client has a ClientQueue registered as a streaming producer on its transport.  While the transport's buffer
+drains the lines are written straight through; when it backs up Twisted pauses the producer and the client's lines
+wait in its queue instead, to be written when the transport resumes it.  A client that falls more than maxQueue
+lines behind is handled by the policy, without holding back anyone else:
+    'disconnect' -- the connection is aborted (counted in stats()['disconnected']); the client can reconnect and ask
+                    for the status again.
+    'drop'       -- its oldest waiting lines are discarded (counted in stats()['dropped']).
+"""
+
+logger = my_logger.myLogger("broadcast.py", "server")
+
+POLICIES = ('disconnect', 'drop')
+
+
+@implementer(interfaces.IPushProducer)
+class ClientQueue(object):
+    """
+    The lines waiting for one client while its transport is paused.
+    """
+    def __init__(self, hub, client):
+        self.hub = hub
+        self.client = client
+        self.pending = deque()
+        self.paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.hub._drain(self)
+
+    def stopProducing(self):
+        self.paused = True
+
+
+class BroadcastHub(object):
+    """
+    Keeps the connected clients (LineReceivers) and writes every broadcast line to each of them.  maxQueue is the
+    number of lines a paused client may have waiting, policy one of POLICIES.  driver is the reactor, replaceable for
+    tests.
+    """
+    def __init__(self, maxQueue=1000, policy='disconnect', driver=reactor):
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of %s" % (POLICIES,))
+        self.maxQueue = maxQueue
+        self.policy = policy
+        self.reactor = driver
+        self.queues = []  # only touched in the reactor thread
+        self._lock = threading.Lock()
+        self.resetStats()
+
+    def resetStats(self):
+        with self._lock:
+            self._broadcast = 0
+            self._sent = 0
+            self._queued = 0
+            self._maxPending = 0
+            self._dropped = 0
+            self._disconnected = 0
+
+    def add(self, client):
+        """
+        Called from the client's connectionMade.
+        """
+        queue = ClientQueue(self, client)
+        client.transport.registerProducer(queue, True)
+        self.queues.append(queue)
+
+    def remove(self, client):
+        """
+        Called from the client's connectionLost; the lines still waiting for it are thrown away.
+        """
+        for queue in self.queues:
+            if queue.client is client:
+                self.queues.remove(queue)
+                queue.pending.clear()
+                return
+
+    def clients(self):
+        return [queue.client for queue in self.queues]
+
+    def broadcast(self, message):
+        """
+        Sends message to every connected client.  message is the line itself, or an object whose lineFor(client)
+        gives each client its line (messages.Outgoing: tagged for the client that asked, in the client's encoding).
+        Safe to call from any thread.
+        """
+        self._call(self._send, message, None)
+
+    def send(self, client, message):
+        """
+        Sends message, as for broadcast(), to client only, in order with the lines broadcast to it.
+        """
+        self._call(self._send, message, client)
+
+    def _call(self, f, *args):
+        if threadable.isInIOThread():
+            f(*args)
+        else:
+            self.reactor.callFromThread(f, *args)
+
+    def _send(self, message, only):
+        sent, queued = 0, 0
+        for queue in list(self.queues):
+            if only is not None and queue.client is not only:
+                continue
+            line = message.lineFor(queue.client) if hasattr(message, 'lineFor') else message
+            if not queue.paused and not queue.pending:
+                queue.client.sendLine(line)
+                sent += 1
+                continue
+            queue.pending.append(line)
+            queued += 1
+            if len(queue.pending) > self.maxQueue:
+                self._overflow(queue)
+        with self._lock:
+            self._broadcast += 1
+            self._sent += sent
+            self._queued += queued
+            for queue in self.queues:
+                self._maxPending = max(self._maxPending, len(queue.pending))
+
+    def _overflow(self, queue):
+        peer = queue.client.transport.getPeer()
+        if self.policy == 'drop':
+            queue.pending.popleft()
+            with self._lock:
+                self._dropped += 1
+            logger.warning("client %s is %d lines behind, dropped its oldest line" % (peer, self.maxQueue))
+            return
+        self.remove(queue.client)
+        with self._lock:
+            self._disconnected += 1
+        logger.warning("client %s is more than %d lines behind, disconnecting it" % (peer, self.maxQueue))
+        queue.client.transport.abortConnection()
+
+    def _drain(self, queue):
+        sent = 0
+        while queue.pending and not queue.paused:  # writing can pause the producer again
+            queue.client.sendLine(queue.pending.popleft())
+            sent += 1
+        with self._lock:
+            self._sent += sent
+
+    def stats(self):
+        """
+        Returns a dict of the number of clients, lines broadcast, lines written to a client straight away or after
+        waiting, the longest queue seen and the lines dropped and clients disconnected by the policy.
+        """
+        with self._lock:
+            return {'clients': len(self.queues),
+                    'broadcast': self._broadcast,
+                    'sent': self._sent,
+                    'queued': self._queued,
+                    'maxPending': self._maxPending,
+                    'dropped': self._dropped,
+                    'disconnected': self._disconnected}
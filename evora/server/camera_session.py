@@ -0,0 +1,112 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+from evora.common.logging import my_logger
+
+"""
+Long-lived camera state shared by every parser.
+
+The server builds a new EvoraParser and Evora for every line it receives, so nothing about the camera is remembered
+between commands, and every exposure used to resend the whole acquisition setup.  CameraSession remembers the detector
+geometry and the arguments of the last successful call to each SDK setter, and apply() only sends a call when its
+arguments differ from what the camera already has.
+
+Each setter's duration is measured whenever it is actually sent; a skipped call is credited with that duration, so
+report() gives the setup time saved for the current exposure.  Call invalidate() whenever the camera may have lost
+its state (Initialize, ShutDown).
+"""
+
+logger = my_logger.myLogger("camera_session.py", "server")
+
+
+class CameraSession(object):
+    """
+    Caches the applied configuration of one camera.  driver is the andor module.
+    """
+    def __init__(self, driver):
+        self.driver = driver
+        self._lock = threading.Lock()
+        self._detector = None
+        self._applied = {}  # SDK setter name -> arguments of its last successful call
+        self._cost = {}  # SDK setter name -> seconds the last sent call took
+
+        self.sent = 0
+        self.skipped = 0
+        self.savedTime = 0.0
+        self.begin()
+
+    def invalidate(self):
+        """
+        Forgets the detector and everything applied, so the next setup is sent in full.
+        """
+        with self._lock:
+            self._detector = None
+            self._applied = {}
+
+    def begin(self):
+        """
+        Starts the per-exposure counters returned by report().
+        """
+        with self._lock:
+            self._current = {'sent': 0, 'skipped': 0, 'setupTime': 0.0, 'savedTime': 0.0}
+
+    def report(self):
+        """
+        Returns the counters since begin(): SDK calls sent and skipped, seconds spent on setup and seconds saved.
+        """
+        with self._lock:
+            return dict(self._current)
+
+    def detector(self):
+        """
+        Returns [result, width, height] like andor.GetDetector(), asking the driver only until it succeeds once.
+        """
+        with self._lock:
+            if self._detector is not None:
+                return [self.driver.DRV_SUCCESS] + list(self._detector)
+        result = self.driver.GetDetector()
+        if result[0] == self.driver.DRV_SUCCESS:
+            with self._lock:
+                self._detector = (result[1], result[2])
+        return result
+
+    def apply(self, name, *args):
+        """
+        Pre: name is an andor setter, e.g. 'SetExposureTime', and args its arguments.
+        Post: Sends the call unless the last successful call to name had the same arguments.  Returns the SDK
+        result, or DRV_SUCCESS when the call was skipped.
+        """
+        with self._lock:
+            if self._applied.get(name) == args:
+                saved = self._cost.get(name, 0.0)
+                self.skipped += 1
+                self.savedTime += saved
+                self._current['skipped'] += 1
+                self._current['savedTime'] += saved
+                return self.driver.DRV_SUCCESS
+
+        start = time.time()
+        result = getattr(self.driver, name)(*args)
+        elapsed = time.time() - start
+
+        with self._lock:
+            if result == self.driver.DRV_SUCCESS:
+                self._applied[name] = args
+            else:
+                self._applied.pop(name, None)  # the camera state is unknown now
+                logger.warning("%s%s returned %s" % (name, args, result))
+            self._cost[name] = elapsed
+            self.sent += 1
+            self._current['sent'] += 1
+            self._current['setupTime'] += elapsed
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'sent': self.sent,
+                    'skipped': self.skipped,
+                    'savedTime': self.savedTime,
+                    'lastSavedTime': self._current['savedTime']}
@@ -0,0 +1,292 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import base64
+import BaseHTTPServer
+import ConfigParser
+import ctypes
+import ctypes.util
+import email.utils
+import errno
+import hashlib
+import json
+import os
+import re
+import SocketServer
+import threading
+import urllib
+from os.path import isdir
+
+from evora.common import netconsts
+from evora.common.logging import my_logger
+
+"""
+HTTP/1.1 file service for the image directory, replacing the anonymous FTP server.
+
+    GET/HEAD /files/<path>   the file, with Accept-Ranges, a single "Range: bytes=" range (206) and an ETag; a
+                             matching If-None-Match gets 304, and If-Range falls back to the whole file when the
+                             file changed
+    GET/HEAD /list/<path>    the directory as JSON: [{"name", "size", "mtime", "dir", "etag"}, ...], also with an
+                             ETag so an unchanged listing costs a 304
+
+Connections are kept alive, so a client fetches any number of files over one TCP connection instead of opening an
+FTP data connection per file.  File bodies go out with the kernel's sendfile() (pysendfile when installed, else libc
+through ctypes), so the pixels are never copied through Python; without either a plain read/write loop is used.
+Every connection gets its own thread.
+
+A request with "Want-Digest: md5" also gets the whole file's MD5 in a "Digest: md5=<base64>" header (RFC 3230), so
+the client can check what it saved; digests are remembered by ETag, so each file is only read for it once.
+"""
+
+logger = my_logger.myLogger("file_server.py", "server")
+
+config_path = 'config/config.ini'
+section = 'server'
+config = ConfigParser.ConfigParser()
+config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), config_path))
+
+# Does not exist on non-observatory computers
+data_path = config.get(section, 'data_path')
+
+CHUNK = 1024 * 1024
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+DIGESTS = 256  # file digests remembered
+
+try:
+    from sendfile import sendfile
+except ImportError:
+    sendfile = None
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if hasattr(_libc, 'sendfile'):
+        _libc.sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_long), ctypes.c_size_t]
+        _libc.sendfile.restype = ctypes.c_ssize_t
+
+        def sendfile(outFd, inFd, offset, count):
+            """
+            sendfile(2) with pysendfile's signature: returns the bytes sent.
+            """
+            position = ctypes.c_long(offset)
+            sent = _libc.sendfile(outFd, inFd, ctypes.byref(position), count)
+            if sent < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, os.strerror(error))
+            return sent
+
+
+def fileETag(stat):
+    """
+    A strong validator that changes whenever the file is replaced or rewritten.
+    """
+    return '"%x-%x-%x"' % (stat.st_ino, stat.st_size, int(stat.st_mtime * 1e6))
+
+
+def matches(header, etag):
+    """
+    Returns whether an If-None-Match header lists etag.
+    """
+    return header is not None and (header.strip() == '*' or etag in [tag.strip() for tag in header.split(',')])
+
+
+def md5Digest(f):
+    """
+    Returns the base64 MD5 of the open file f, for a Digest header.
+    """
+    digest = hashlib.md5()
+    f.seek(0)
+    for data in iter(lambda: f.read(CHUNK), b""):
+        digest.update(data)
+    return base64.b64encode(digest.digest())
+
+
+def parseRange(header, size):
+    """
+    Pre: header is a Range header value and size the file size.
+    Post: Returns (start, end) with end inclusive, None when the whole file should be sent (no header, several
+    ranges or a unit other than bytes), or False when the range cannot be satisfied.
+    """
+    match = RANGE.match(header.strip()) if header else None
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # the last n bytes
+        length = int(last)
+        return (max(0, size - length), size - 1) if length > 0 and size > 0 else False
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+class FileRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "EvoraFiles/1.0"
+
+    def do_GET(self):
+        self.serve(True)
+
+    def do_HEAD(self):
+        self.serve(False)
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s" % (self.address_string(), format % args))
+
+    def serve(self, body):
+        path = urllib.unquote(self.path.split('?', 1)[0])
+        if path.startswith('/files/'):
+            self.serveFile(self.server.resolve(path[len('/files/'):]), body)
+        elif path == '/list' or path.startswith('/list/'):
+            self.serveListing(self.server.resolve(path[len('/list/'):]), body)
+        else:
+            self.reply(404, body=body)
+
+    def reply(self, code, headers=(), content="", body=True):
+        """
+        Sends a complete response with a Content-Length, so the connection stays usable.
+        """
+        self.send_response(code)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if body and content:
+            self.wfile.write(content)
+
+    def serveListing(self, directory, body):
+        if directory is None or not os.path.isdir(directory):
+            self.reply(404, body=body)
+            return
+        entries = []
+        for name in sorted(os.listdir(directory)):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:  # removed while listing
+                continue
+            isDirectory = os.path.isdir(os.path.join(directory, name))
+            entries.append({'name': name,
+                            'size': stat.st_size,
+                            'mtime': stat.st_mtime,
+                            'dir': isDirectory,
+                            'etag': None if isDirectory else fileETag(stat)})
+        content = json.dumps(entries)
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if matches(self.headers.get('If-None-Match'), etag):
+            self.reply(304, [("ETag", etag)], body=False)
+            return
+        self.reply(200, [("Content-Type", "application/json"), ("ETag", etag), ("Cache-Control", "no-cache")],
+                   content, body)
+
+    def serveFile(self, filename, body):
+        try:
+            f = open(filename, 'rb') if filename is not None else None
+        except IOError:
+            f = None
+        if f is None or os.path.isdir(filename):
+            self.reply(404, body=body)
+            return
+        with f:
+            stat = os.fstat(f.fileno())
+            size = stat.st_size
+            etag = fileETag(stat)
+            common = [("ETag", etag),
+                      ("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True)),
+                      ("Accept-Ranges", "bytes")]
+            if matches(self.headers.get('If-None-Match'), etag):
+                self.reply(304, common, body=False)
+                return
+
+            span = parseRange(self.headers.get('Range'), size)
+            ifRange = self.headers.get('If-Range')
+            if ifRange is not None and ifRange.strip() != etag:
+                span = None  # the client's partial copy is of an older file
+            if span is False:
+                self.reply(416, common + [("Content-Range", "bytes */%d" % size)], body=body)
+                return
+
+            if span is None:
+                start, end = 0, size - 1
+                self.send_response(200)
+            else:
+                start, end = span
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+            for name, value in common:
+                self.send_header(name, value)
+            if 'md5' in self.headers.get('Want-Digest', '').lower():
+                self.send_header("Digest", "md5=" + self.server.digest(f, etag))
+            self.send_header("Content-Type", "application/fits")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+            if body:
+                self.sendBody(f, start, end - start + 1)
+
+    def sendBody(self, f, offset, count):
+        self.wfile.flush()
+        if sendfile is not None:
+            out, source = self.connection.fileno(), f.fileno()
+            while count > 0:
+                try:
+                    sent = sendfile(out, source, offset, count)
+                except OSError as e:
+                    if e.errno in (errno.EAGAIN, errno.EINTR):
+                        continue
+                    raise
+                if sent == 0:
+                    break
+                offset += sent
+                count -= sent
+            return
+        f.seek(offset)
+        while count > 0:
+            data = f.read(min(CHUNK, count))
+            if not data:
+                break
+            self.wfile.write(data)
+            count -= len(data)
+
+
+class FileServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves the files under root on address, a (host, port) pair.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, root, address=('', netconsts.FILE_HTTP_PORT)):
+        self.root = os.path.realpath(root)
+        self._digests = {}
+        self._digestLock = threading.Lock()
+        BaseHTTPServer.HTTPServer.__init__(self, address, FileRequestHandler)
+
+    def digest(self, f, etag):
+        """
+        Returns the base64 MD5 of the open file f whose ETag is etag.
+        """
+        with self._digestLock:
+            if etag in self._digests:
+                return self._digests[etag]
+        digest = md5Digest(f)
+        with self._digestLock:
+            if len(self._digests) >= DIGESTS:
+                self._digests.clear()
+            self._digests[etag] = digest
+        return digest
+
+    def resolve(self, relative):
+        """
+        Returns the absolute path of relative under root, or None when it points outside of root.
+        """
+        path = os.path.realpath(os.path.join(self.root, relative.lstrip('/')))
+        if path != self.root and not path.startswith(self.root + os.sep):
+            return None
+        return path
+
+
+if __name__ == "__main__":
+    if isdir(data_path):
+        FileServer(data_path).serve_forever()
+    else:
+        print("[file_server.py] Directory at '" + data_path + "' does not exist, exiting...")
+        quit()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+from Queue import Queue
+
+import numpy as np
+from astropy.io import fits
+from astropy.time import Time
+
+from evora.common.logging import my_logger
+
+"""
+FITS header construction for the acquisition paths.
+
+Most of a header is the same for every frame of an acquisition: the observatory, instrument, site, image type,
+binning, exposure and readout time.  HeaderFactory.session() builds those cards once into a template and caches it;
+HeaderSession.build() copies the template and fills in only the per-frame cards (DATE-OBS, UT, TEMP and the telescope
+position from the TCC logs).
+
+For series, HeaderSession.prepare() builds a frame's header on a background thread as soon as its exposure starts,
+so it is ready by the time the frame is read out and the writer thread asks for it.
+"""
+
+logger = my_logger.myLogger("fits_headers.py", "server")
+
+
+class PendingHeader(object):
+    """
+    A header being built in the background.  get() waits for it and re-raises any error from the build.
+    """
+    def __init__(self, session, obsTime):
+        self.session = session
+        self.obsTime = obsTime
+        self._ready = threading.Event()
+        self._header = None
+        self._error = None
+
+    def _build(self):
+        try:
+            self._header = self.session.build(self.obsTime)
+        except Exception as e:
+            logger.error("failed to build header: " + str(e))
+            self._error = e
+        self._ready.set()
+
+    def ready(self):
+        return self._ready.is_set()
+
+    def get(self, timeout=None):
+        if not self._ready.wait(timeout):
+            raise RuntimeError("header for %s not ready" % time.strftime("%H:%M:%S", self.obsTime))
+        if self._error is not None:
+            raise self._error
+        return self._header
+
+
+class HeaderSession(object):
+    """
+    Headers for one acquisition.  The template must not be modified; build() works on a copy.
+    """
+    def __init__(self, factory, template, tcc):
+        self.factory = factory
+        self.template = template
+        self.tcc = tcc
+
+    def build(self, obsTime=None):
+        """
+        Pre: obsTime is the time.gmtime() of the start of the exposure and defaults to now.
+        Post: Returns a new AstroPy header for the frame.
+        """
+        if obsTime is None:
+            obsTime = time.gmtime()
+        dateObs = time.strftime("%Y-%m-%dT%H:%M:%S", obsTime)
+
+        header = self.template.copy()
+        header["DATE-OBS"] = dateObs
+        header["UT"] = time.strftime("%H:%M:%S", obsTime)
+        header["TEMP"] = self.factory.ccdTemperature()
+        header.extend(self.factory.positionCards(self.tcc, obsTime, dateObs))
+        return header
+
+    def prepare(self, obsTime=None):
+        """
+        Starts building the header for an exposure that started at obsTime in the background.  Returns a
+        PendingHeader; its get method can be used directly as a WriteJob headerFunc.
+        """
+        if obsTime is None:
+            obsTime = time.gmtime()
+        pending = PendingHeader(self, obsTime)
+        self.factory.schedule(pending)
+        return pending
+
+
+class HeaderFactory(object):
+    """
+    Builds and caches header templates.  driver is the andor module; positionLogs and gtccLogs are the
+    tcc_logs stores used for the telescope position cards.  temperature, if given, returns the CCD temperature for
+    the TEMP card (or None when it has none), so the header and writer threads never call the driver, which only the
+    hardware thread may use; without it the temperature is read from the driver, for scripts that own it.
+    """
+    MAX_TEMPLATES = 32
+
+    def __init__(self, driver, latitude, longitude, positionLogs, gtccLogs, temperature=None):
+        self.driver = driver
+        self.temperature = temperature
+        self.latitude = latitude
+        self.longitude = longitude
+        self.positionLogs = positionLogs
+        self.gtccLogs = gtccLogs
+
+        self._templates = {}
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        self._worker = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def ccdTemperature(self):
+        """
+        Returns the CCD temperature for the TEMP card, None (a blank card) when temperature has none yet.
+        """
+        if self.temperature is None:
+            return self.driver.GetTemperatureStatus()[1]
+        return self.temperature()
+
+    def session(self, attributes, tcc):
+        """
+        Pre: attributes is [imType, binning, itime, filter] and tcc is either 'gtcc' or 'heimdall'.  Call once the
+        camera is configured so the readout time is current.
+        Post: Returns a HeaderSession using the cached template for these settings.
+        """
+        imType, binning, itime, filter = attributes[0], attributes[1], attributes[2], attributes[3]
+        readTime = self.driver.GetAcquisitionTimings()[3] - itime
+        key = (imType, binning, itime, filter, readTime)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                self.misses += 1
+                if len(self._templates) >= self.MAX_TEMPLATES:
+                    self._templates.clear()
+                template = self._templates[key] = self.template(imType, binning, itime, filter, readTime)
+            else:
+                self.hits += 1
+        return HeaderSession(self, template, tcc)
+
+    def template(self, imType, binning, itime, filter, readTime):
+        """
+        Returns the cards shared by every frame, with placeholders for DATE-OBS, UT and TEMP so the card order is
+        the same as it always was.
+        """
+        header = fits.Header()
+        header.append(card=("DATE-OBS", "", "Time at start of exposure"))
+        header.append(card=("UT", "", "UT time at start of exposure"))
+        header.append(card=("OBSERVAT", "mro", "per the iraf list"))
+        header.append(card=("IMAGETYP", imType))
+        header.append(card=("FILTER", filter))
+        header.append(card=("BINX", binning, "Horizontal Binning"))
+        header.append(card=("BINY", binning, "Vertical Binning"))
+        header.append(card=("EXPTIME", itime, "Total exposure time"))
+        header.append(card=("ACQMODE", "Single Scan", "Acquisition mode"))
+        header.append(card=("READMODE", "Image", "Readout mode"))
+        header.append(card=("INSTRUME", "evora",
+                            "Instrument used for imaging"))
+        header.append(card=("LONGITUD", self.longitude,
+                            "Decimal degrees of MRO latitude"))
+        header.append(card=("LATITUDE", self.latitude,
+                            "Decimal degress of MRO longitude"))
+        header.append(card=("TEMP", 0, "Temperature"))
+        header.append(card=("READTIME", readTime, "Pixel readout time"))
+        return header
+
+    def positionCards(self, tcc, obsTime, dateObs):
+        """
+        Returns the telescope position cards for an exposure started at obsTime, or an empty list when the TCC
+        logs have nothing for it.
+        """
+        # NEEDED header keywords
+        # Done RA / Right Ascension
+        # Done DEC / Declination
+        # Done EPOCH / Epoch for RA and Dec (years)
+        # Done ST / local sidereal time (hours)
+        # Done HA / Hour Angle
+        # Done ZD / Zenith Angle
+        # AIRMASS
+        # UTMIDDLE
+        # JD
+        # HJD
+        # LJD
+        if tcc == "heimdall":
+            results = self.positionLogs.lookup(obsTime)
+        else:  # gtcc
+            results = self.gtccLogs.lookup(obsTime)
+        if results is None:
+            return []
+        logger.debug("position from " + tcc + " logs: " + str(results))
+
+        ra, dec, epoch, lst, ha, za = results
+        cards = [("RA", ra, "Right Ascension"),
+                 ("DEC", dec, "Declination"),
+                 ("EPOCH", epoch, "Epoch for RA and Dec (years)"),
+                 ("ST", lst, "local sidereal time (hours)"),
+                 ("HA", ha, "Hour Angle"),
+                 ("ZD", za, "Zenith Angle")]
+        if tcc == "heimdall":
+            airmass = 1.0 / np.cos(np.radians(za))
+            # airmass = 1.0 / np.sin(np.radians((90-za) + 244/(165+47*(90-za)**1.1)))
+            astroTime = Time(dateObs, scale='utc')
+            cards += [("AIRMASS", airmass, "Airmass (X = sec z)"),
+                      ("JD", str(astroTime.jd), "Julian Date"),
+                      ("MJD", str(astroTime.mjd), "Modified Julian Date")]
+        return cards
+
+    def schedule(self, pending):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="HeaderFactory")
+                self._worker.daemon = True
+                self._worker.start()
+        self._queue.put(pending)
+
+    def _run(self):
+        while True:
+            self._queue.get()._build()
+
+    def stats(self):
+        with self._lock:
+            return {'templates': len(self._templates), 'hits': self.hits, 'misses': self.misses}
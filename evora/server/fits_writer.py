@@ -0,0 +1,317 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import multiprocessing
+import threading
+import time
+from Queue import Full, Queue
+
+from astropy.io import fits
+
+import evora.common.utils.stats as stats_utils
+from evora.common.logging import my_logger
+
+"""
+Background FITS writing for the acquisition paths.
+
+The acquisition loop hands each frame to FitsWriter.submit() and goes straight back to the camera; a small pool of
+writer threads builds the header, writes the file and sends the client notification.  Notifications are released in
+the order frames were submitted, even with several writer threads, so clients still see seriesSent1, 2, 3...
+
+When the queue is full the policy decides what happens to a new frame:
+    'block' -- the acquisition thread waits for room (counted in stats()['blocked']); no frame is ever lost.
+    'drop'  -- the new frame is discarded (counted in stats()['dropped']) so acquisition never waits.
+
+Frames can also be written tile-compressed (fpack-compatible, lossless Rice or gzip) into a ".fz" file.  Compression
+runs in a pool of worker processes so it does not hold the GIL the acquisition and network threads need; the writer
+thread only pickles the frame across and waits.
+
+A job can also ask for the frame's statistics record (stats_utils.image_stats): the writer thread computes it, writes
+it into the header as DATAMIN, DATAMAX... cards and passes it to notify, so it costs the acquisition loop nothing.
+A job without a filename only computes the record, for a real time frame that is streamed but not saved.
+"""
+
+logger = my_logger.myLogger("fits_writer.py", "server")
+
+POLICIES = ('block', 'drop')
+COMPRESSION_TYPES = {'none': None, 'rice': 'RICE_1', 'gzip': 'GZIP_2'}  # protocol name -> astropy compression_type
+
+
+def compressionType(name):
+    """
+    Pre: name is a key of COMPRESSION_TYPES (e.g. from "compress=rice" on the protocol line) or None.
+    Post: Returns the astropy compression_type, or None for uncompressed.  Raises ValueError for unknown names.
+    """
+    if name is None:
+        return None
+    try:
+        return COMPRESSION_TYPES[name.lower()]
+    except KeyError:
+        raise ValueError("unknown compression %s, expected one of %s" % (name, sorted(COMPRESSION_TYPES)))
+
+
+def outputName(filename, compress):
+    """
+    Returns the file name to write a frame to: fpack's ".fz" is appended for compressed frames.
+    """
+    return filename + ".fz" if compress else filename
+
+
+def writeCompressed(data, headerString, filename, compress):
+    """
+    Writes data as a tile-compressed image extension behind an empty primary HDU.  Runs in the worker processes, so
+    the header comes as a string.
+    """
+    hdu = fits.CompImageHDU(data, compression_type=compress, uint=True)
+    if headerString:
+        hdu.header.extend(fits.Header.fromstring(headerString))
+    hdu.writeto(filename, clobber=True)
+
+
+class WriteJob(object):
+    """
+    One frame waiting to be written.  Either header or headerFunc (called on the writer thread) gives the header;
+    notify, if given, is called with the filename after the write.  done, if given, is called once the writer no
+    longer needs data (after the write, a failed write or a drop), e.g. to give a pooled buffer back.  compress is an
+    astropy compression_type from compressionType(), or None to write an uncompressed primary HDU.  With stats the
+    statistics record is computed before the write, from a sample of the frame with fast, added to the header and
+    notify is called with (filename, stats).  A filename of None writes nothing and only computes the statistics.
+    """
+    def __init__(self, data, filename, header=None, headerFunc=None, notify=None, done=None, compress=None,
+                 stats=False, fast=False):
+        self.data = data
+        self.filename = filename
+        self.header = header
+        self.headerFunc = headerFunc
+        self.notify = notify
+        self.done = done
+        self.compress = compress
+        self.stats = stats
+        self.fast = fast
+        self.record = None  # the image_stats() dict once computed
+        self.sequence = None
+        self.submitted = None
+
+
+class FitsWriter(object):
+    """
+    Bounded producer/consumer writer.  Threads are started on the first submit.  processes is the size of the
+    compression process pool; with 0 compression runs on the writer threads.
+    """
+    def __init__(self, threads=2, maxQueue=8, policy='block', processes=0):
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of %s" % (POLICIES,))
+        self.threads = threads
+        self.policy = policy
+        self.processes = processes
+        self.queue = Queue(maxQueue)
+
+        self._workers = []
+        self._pool = None
+        self._poolLock = threading.Lock()
+        self._lock = threading.Lock()
+        self._notifyLock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+        self._nextSequence = 0
+        self._nextNotify = 0
+        self._finished = {}  # sequence -> finished job waiting for its turn to notify
+        self._outstanding = 0
+
+        self.resetStats()
+
+    def resetStats(self):
+        with self._lock:
+            self._submitted = 0
+            self._written = 0
+            self._failed = 0
+            self._dropped = 0
+            self._blocked = 0
+            self._blockedTime = 0.0
+            self._maxDepth = 0
+            self._latencyTotal = 0.0
+            self._latencyMax = 0.0
+
+    def _start(self):
+        while len(self._workers) < self.threads:
+            worker = threading.Thread(target=self._run, name="FitsWriter-%d" % len(self._workers))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def startProcesses(self):
+        """
+        Starts the compression processes.  Call early, before the server starts its threads, so the workers are
+        forked from a quiet process; otherwise they are started on the first compressed write.
+        """
+        with self._poolLock:
+            if self._pool is None and self.processes > 0:
+                self._pool = multiprocessing.Pool(self.processes)
+            return self._pool
+
+    def close(self, timeout=None):
+        """
+        Waits up to timeout seconds for the submitted frames to be written, then stops the compression processes,
+        killing them if the frames were not all written in time.  Call when the server shuts down.
+        """
+        flushed = self.flush(timeout)
+        with self._poolLock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            if flushed:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+        return flushed
+
+    def write(self, data, filename, header=None, compress=None):
+        """
+        Writes one frame now, on the calling thread, compressing in the process pool if asked to.
+        """
+        if compress is None:
+            hdu = fits.PrimaryHDU(data, do_not_scale_image_data=True, uint=True, header=header)
+            hdu.writeto(filename, clobber=True)
+        else:
+            headerString = header.tostring() if header is not None else None
+            pool = self._pool or self.startProcesses()
+            if pool is None:
+                writeCompressed(data, headerString, filename, compress)
+            else:
+                pool.apply(writeCompressed, (data, headerString, filename, compress))
+        logger.debug("wrote: {}".format(filename))
+
+    def submit(self, job, policy=None):
+        """
+        Pre: Pass a WriteJob whose data will not be touched again by the caller.  policy, one of POLICIES, overrides
+        the writer's for this job.
+        Post: Queues the job and returns True, or returns False if it was dropped by the 'drop' policy.
+        """
+        if policy is None:
+            policy = self.policy
+        if not self._workers:
+            self._start()
+
+        with self._lock:
+            job.sequence = self._nextSequence
+            self._nextSequence += 1
+            self._outstanding += 1
+        job.submitted = time.time()
+
+        try:
+            self.queue.put_nowait(job)
+        except Full:
+            if policy == 'drop':
+                logger.warning("writer queue full, dropped %s" % job.filename)
+                with self._lock:
+                    self._dropped += 1
+                self._release(job)
+                self._finish(job, None)
+                return False
+            start = time.time()
+            self.queue.put(job)
+            with self._lock:
+                self._blocked += 1
+                self._blockedTime += time.time() - start
+
+        with self._lock:
+            self._submitted += 1
+            self._maxDepth = max(self._maxDepth, self.queue.qsize())
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Blocks until every submitted frame has been written and notified.  Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._idle:
+            while self._outstanding > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stats(self):
+        """
+        Returns a dict of the queue depth, counters and per-frame write latency (submit to file on disk) in seconds.
+        """
+        with self._lock:
+            done = self._written + self._failed
+            return {'depth': self.queue.qsize(),
+                    'maxDepth': self._maxDepth,
+                    'submitted': self._submitted,
+                    'written': self._written,
+                    'failed': self._failed,
+                    'dropped': self._dropped,
+                    'blocked': self._blocked,
+                    'blockedTime': self._blockedTime,
+                    'meanLatency': self._latencyTotal / done if done else 0.0,
+                    'maxLatency': self._latencyMax}
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                try:
+                    self._write(job)
+                finally:
+                    self._release(job)
+                latency = time.time() - job.submitted
+                with self._lock:
+                    self._written += 1
+                    self._latencyTotal += latency
+                    self._latencyMax = max(self._latencyMax, latency)
+                self._finish(job, job.notify)
+            except Exception as e:
+                logger.error("failed to write %s: %s" % (job.filename, e))
+                with self._lock:
+                    self._failed += 1
+                self._finish(job, None)
+
+    def _write(self, job):
+        if job.stats:
+            job.record = stats_utils.image_stats(job.data, fast=job.fast)
+        if job.filename is None:
+            return
+        header = job.header
+        if header is None and job.headerFunc is not None:
+            header = job.headerFunc()
+        if job.stats:
+            if header is None:
+                header = fits.Header()
+            for card in stats_utils.header_cards(job.record):
+                header[card[0]] = card[1:]
+        self.write(job.data, job.filename, header, job.compress)
+
+    def _release(self, job):
+        if job.done is not None:
+            job.done()
+        job.data = None
+
+    def _finish(self, job, notify):
+        """
+        Records that a job is done and runs the notifications that are now in order.
+        """
+        with self._notifyLock:  # held while notifying so two threads can not send their runs out of order
+            with self._lock:
+                self._finished[job.sequence] = (job, notify)
+                ready = []
+                while self._nextNotify in self._finished:
+                    ready.append(self._finished.pop(self._nextNotify))
+                    self._nextNotify += 1
+
+            for doneJob, doneNotify in ready:
+                if doneNotify is not None:
+                    try:
+                        if doneJob.stats:
+                            doneNotify(doneJob.filename, doneJob.record)
+                        else:
+                            doneNotify(doneJob.filename)
+                    except Exception as e:
+                        logger.error("notify failed for %s: %s" % (doneJob.filename, e))
+
+        with self._idle:
+            self._outstanding -= len(ready)
+            if self._outstanding == 0:
+                self._idle.notify_all()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+import numpy as np
+
+from evora.common.logging import my_logger
+
+"""
+Reusable uint16 frame buffers for the acquisition paths.
+
+Allocating and zero-filling a full frame for every image fragments memory over a long run-till-abort session, so the
+server keeps a fixed set of buffers sized for the current detector geometry and binning.  A buffer is leased for the
+driver call and given back once the frame has been written and the clients told about it.  Buffers are created on
+first use, up to the pool capacity; when all of them are out, lease() waits for one to come back, which also acts as
+back-pressure on the acquisition loop.
+
+The buffers are the rows of one array (its pages are only touched when a row is first used), so leaseRun() can hand
+out consecutive frames that contiguous() joins into a single buffer for a bulk read such as andor.GetImages16.
+"""
+
+logger = my_logger.myLogger("frame_pool.py", "server")
+
+
+class Frame(object):
+    """
+    A leased buffer.  data is the flat array handed to the driver; image is the same memory shaped as the frame.
+    """
+    def __init__(self, pool, generation, slab, index, shape):
+        self.pool = pool
+        self.generation = generation
+        self.slab = slab
+        self.index = index
+        self.data = slab[index]
+        self.image = self.data.reshape(shape)
+        self.leasedAt = None
+        self.owner = None
+
+    def release(self):
+        self.pool.release(self)
+
+
+def contiguous(frames):
+    """
+    Pre: frames is a run from FramePool.leaseRun().
+    Post: Returns one flat array over the memory of all the frames, in order.
+    """
+    return frames[0].slab[frames[0].index:frames[-1].index + 1].reshape(-1)
+
+
+class FramePool(object):
+    """
+    Pool of at most capacity frames of one geometry.  Call configure() before every acquisition.
+    """
+    def __init__(self, capacity=12):
+        self.capacity = capacity
+        self.shape = None
+
+        self._lock = threading.Condition()
+        self._generation = 0
+        self._slab = None
+        self._frames = []  # index -> Frame, None until first used
+        self._isFree = []
+        self._leased = set()
+        self._allocated = 0
+
+        self.highWater = 0  # most frames leased at one time
+        self.leaks = 0  # frames that were never released and had to be reclaimed
+        self.waits = 0  # leases that had to wait for a free frame
+
+    def configure(self, width, height, binning=1):
+        """
+        Pre: Pass the detector size from andor.GetDetector() and the binning.
+        Post: Sizes the pool for that geometry.  Buffers are kept when the geometry did not change; otherwise they are
+        dropped and frames still leased from the old geometry are discarded when released.
+        """
+        shape = (width // binning, height // binning)
+        with self._lock:
+            if shape == self.shape:
+                return
+            logger.debug("frame pool resized to " + str(shape))
+            self.shape = shape
+            self._generation += 1
+            self._slab = None
+            self._frames = [None] * self.capacity
+            self._isFree = [True] * self.capacity
+            self._leased = set()
+            self._allocated = 0
+            self._lock.notify_all()
+
+    def lease(self, owner=None, timeout=None):
+        """
+        Pre: configure() was called.  owner is a label used when reporting leaks.
+        Post: Returns a Frame, waiting up to timeout seconds for one to be released when all are out.  Returns None
+        on timeout.
+        """
+        frames = self.leaseRun(1, owner, timeout)
+        return frames[0] if frames else None
+
+    def leaseRun(self, count, owner=None, timeout=None):
+        """
+        Pre: configure() was called.
+        Post: Returns a list of between 1 and count frames that are consecutive in memory, waiting up to timeout
+        seconds for a frame to be released when all are out.  Returns an empty list on timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._lock:
+            waited = False
+            while True not in self._isFree:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return []
+                waited = True
+                self._lock.wait(remaining)
+            if waited:
+                self.waits += 1
+
+            start, length = self._findRun(count)
+            if self._slab is None:
+                self._slab = np.empty((self.capacity, self.shape[0] * self.shape[1]), dtype=np.uint16)
+
+            frames = []
+            now = time.time()
+            for index in range(start, start + length):
+                frame = self._frames[index]
+                if frame is None:
+                    frame = self._frames[index] = Frame(self, self._generation, self._slab, index, self.shape)
+                    self._allocated += 1
+                frame.leasedAt = now
+                frame.owner = owner
+                self._isFree[index] = False
+                self._leased.add(frame)
+                frames.append(frame)
+            self.highWater = max(self.highWater, len(self._leased))
+            return frames
+
+    def _findRun(self, count):
+        """
+        Returns (start, length) of the first run of free frames at least count long, or else of the longest run.
+        """
+        best = (0, 0)
+        index = 0
+        while index < self.capacity:
+            if not self._isFree[index]:
+                index += 1
+                continue
+            start = index
+            while index < self.capacity and self._isFree[index] and index - start < count:
+                index += 1
+            length = index - start
+            if length == count:
+                return start, length
+            if length > best[1]:
+                best = (start, length)
+        return best
+
+    def release(self, frame):
+        with self._lock:
+            if frame not in self._leased:
+                return  # from an old geometry, or already reclaimed
+            self._leased.discard(frame)
+            frame.owner = None
+            self._isFree[frame.index] = True
+            self._lock.notify_all()
+
+    def reclaim(self):
+        """
+        Takes back every frame that is still leased.  Call when an acquisition has completely finished; anything
+        still out at that point was leaked.  Returns the number of leaked frames.
+        """
+        with self._lock:
+            leaked = list(self._leased)
+            for frame in leaked:
+                logger.warning("frame leaked by %s, leased %.1f s ago" % (frame.owner, time.time() - frame.leasedAt))
+                self._leased.discard(frame)
+                frame.owner = None
+                self._isFree[frame.index] = True
+            self.leaks += len(leaked)
+            if leaked:
+                self._lock.notify_all()
+            return len(leaked)
+
+    def stats(self):
+        with self._lock:
+            return {'capacity': self.capacity,
+                    'allocated': self._allocated,
+                    'leased': len(self._leased),
+                    'highWater': self.highWater,
+                    'leaks': self.leaks,
+                    'waits': self.waits}
@@ -0,0 +1,232 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+from twisted.internet import interfaces, protocol, reactor
+from twisted.protocols import basic
+from zope.interface import implementer
+
+import evora.common.frame_stream as frame_stream
+import evora.server.preview as preview
+from evora.common.logging import my_logger
+
+"""
+Server side of the real time frame stream.
+
+Clients connect to netconsts.FRAME_STREAM_PORT and are subscribed for as long as the connection lasts.  The
+acquisition thread calls FramePushFactory.publish() with each real time frame; the packets are built there (copying
+the pixels out of the frame pool buffer, and computing a preview for every preview size a subscriber asked for) and
+handed to the reactor, which writes them to the subscribers.  A client watching previews can ask for the full
+frame with "latest": it is sent the last full frame if that was the most recent readout, or else the full frame of
+the next one.
+
+A client on the server's own machine can ask for "mode shm": the frame is then written once into the shared memory
+ring (evora.common.frame_ring) and the client is only sent a RING notice with the frame number, so the pixels never
+cross a socket.  Full frame packets are only built while some subscriber takes full frames (modes full and both)
+or is waiting for a "latest".
+
+Each subscriber registers itself as a streaming producer on its transport, so Twisted pauses it when the socket
+buffer backs up.  A paused subscriber skips frames (counted in stats()['dropped']) instead of queueing megabytes
+behind a slow link; it gets the next frame once the buffer drains.
+"""
+
+logger = my_logger.myLogger("frame_push.py", "server")
+
+
+@implementer(interfaces.IPushProducer)
+class FramePushProtocol(basic.LineOnlyReceiver):
+    """
+    One subscribed client.  It gets full frames until it sends a "mode" line.
+    """
+    def connectionMade(self):
+        self.paused = False
+        self.mode = 'full'
+        self.size = None
+        self.transport.registerProducer(self, True)
+        self.factory.subscribe(self)
+
+    def connectionLost(self, reason):
+        self.factory.unsubscribe(self)
+
+    def lineReceived(self, line):
+        words = line.split()
+        if words[:1] == ['latest']:
+            self.factory.sendLatest(self)
+        elif words[1:2] == ['shm'] and words[0] == 'mode':
+            if self.factory.ring is not None and frame_stream.isLocal(self.transport):
+                self.factory.setMode(self, 'shm', None)
+            else:
+                logger.info("frame ring refused to %s, it stays in %s mode" % (self.transport.getPeer(), self.mode))
+        elif len(words) in (2, 3) and words[0] == 'mode' and words[1] in frame_stream.MODES:
+            try:
+                size = int(words[2]) if len(words) == 3 else self.factory.previewSize
+            except ValueError:
+                size = 0
+            if size < 1:
+                logger.warning("bad preview size in %r, %s stays in %s mode" % (line, self.transport.getPeer(),
+                                                                                self.mode))
+                return
+            self.factory.setMode(self, words[1], size)
+        else:
+            logger.warning("frame stream request not understood: %r" % line)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        self.paused = True
+
+
+class FramePushFactory(protocol.ServerFactory):
+    """
+    Keeps the subscribers and pushes frames to them.  previewSize is the preview size for clients that do not name
+    one; method, low and high are passed to preview.makePreview().  ring is the FrameRingWriter for local clients, or
+    None to refuse "mode shm".  driver is the reactor, replaceable for tests.
+    """
+    protocol = FramePushProtocol
+
+    def __init__(self, previewSize=512, method='mean', low=0.5, high=99.5, ring=None, driver=reactor):
+        self.previewSize = previewSize
+        self.method = method
+        self.low = low
+        self.high = high
+        self.ring = ring
+        self.reactor = driver
+        self.clients = []  # only touched in the reactor thread
+        self._latest = None  # packet of the last full frame sent
+        self._latestCurrent = False  # whether it is of the most recent readout
+        self._waiting = []  # clients owed the next full frame by a "latest"
+        self._lock = threading.Lock()
+        self._subscribers = 0
+        self._previewSizes = {}  # preview size -> number of subscribers wanting it
+        self._modes = {}  # mode -> number of subscribers in it
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+        self.previewTime = 0.0
+
+    def subscribe(self, client):
+        self.clients.append(client)
+        with self._lock:
+            self._subscribers = len(self.clients)
+            self._modes[client.mode] = self._modes.get(client.mode, 0) + 1
+        logger.info("frame stream subscriber %s, %d connected" % (client.transport.getPeer(), len(self.clients)))
+
+    def unsubscribe(self, client):
+        self.setMode(client, 'full', None)
+        self.clients.remove(client)
+        with self._lock:
+            if client in self._waiting:
+                self._waiting.remove(client)
+            self._subscribers = len(self.clients)
+            self._modes['full'] -= 1
+
+    def setMode(self, client, mode, size):
+        """
+        Switches client between full frames, previews of at most size pixels, both, and ring notices.
+        """
+        with self._lock:
+            if client.mode in ('preview', 'both'):
+                self._previewSizes[client.size] -= 1
+                if self._previewSizes[client.size] == 0:
+                    del self._previewSizes[client.size]
+            self._modes[client.mode] -= 1
+            client.mode, client.size = mode, size
+            self._modes[mode] = self._modes.get(mode, 0) + 1
+            if mode in ('preview', 'both'):
+                self._previewSizes[size] = self._previewSizes.get(size, 0) + 1
+
+    def subscribers(self):
+        """
+        Returns the number of connected clients.  Safe to call from any thread.
+        """
+        with self._lock:
+            return self._subscribers
+
+    def publish(self, number, obsTime, itime, imType, binning, image):
+        """
+        Pre: Called from the acquisition thread with the frame number, readout time, integration time, image type,
+        binning and the uint16 image.
+        Post: The pixels are copied into packets, so the caller can release image's buffer straight away, and the
+        packets are queued to the subscribers by the reactor.
+        """
+        with self._lock:
+            sizes = list(self._previewSizes)
+            ringClients = self._modes.get('shm', 0)
+            fullClients = self._modes.get('full', 0) + self._modes.get('both', 0) + len(self._waiting)
+        full, notice = None, None
+        if fullClients:
+            full = frame_stream.pack(number, obsTime, itime, imType, binning, image)
+        if ringClients:
+            self.ring.write(number, obsTime, itime, imType, binning, image)
+            notice = frame_stream.packNotice(number, obsTime, itime, imType, binning, image.shape)
+        start = time.time()
+        previews = {}
+        for size in sizes:
+            pixels, factor, low, high = preview.makePreview(image, size, self.method, self.low, self.high)
+            previews[size] = frame_stream.pack(number, obsTime, itime, imType, binning, pixels,
+                                               frame_stream.PREVIEW, factor, low, high)
+        with self._lock:
+            self.published += 1
+            self.previewTime += time.time() - start
+        self.reactor.callFromThread(self._send, full, previews, notice)
+
+    def _send(self, full, previews, notice):
+        self._latestCurrent = full is not None
+        waiting = []
+        if full is not None:
+            self._latest = full
+            with self._lock:
+                waiting, self._waiting = self._waiting, []
+        sent, dropped = 0, 0
+        for client in self.clients:
+            if client.paused:
+                if client in waiting:
+                    with self._lock:
+                        self._waiting.append(client)  # still owed a full frame
+                dropped += 1
+                continue
+            if client.mode == 'shm':
+                packets = [notice]
+            elif client.mode == 'preview' and client.size in previews:
+                packets = [previews[client.size]]
+            elif full is None:  # the client changed mode after the frame was published
+                packets = []
+            elif client.mode == 'full' or client.size not in previews:  # previews of a new size start next frame
+                packets = [full]
+            else:
+                packets = [previews[client.size], full]
+            if client in waiting and not any(packet is full for packet in packets):
+                packets.append(full)
+            for packet in packets:
+                if packet is not None:
+                    client.transport.writeSequence(packet)
+            sent += 1
+        with self._lock:
+            self.sent += sent
+            self.dropped += dropped
+
+    def sendLatest(self, client):
+        """
+        Sends client the full frame of the most recent readout, or, if no full frame was built for it, that of the
+        next readout.
+        """
+        if self._latestCurrent:
+            client.transport.writeSequence(self._latest)
+        else:
+            with self._lock:
+                if client not in self._waiting:
+                    self._waiting.append(client)
+
+    def stats(self):
+        with self._lock:
+            return {'subscribers': self._subscribers,
+                    'published': self.published,
+                    'sent': self.sent,
+                    'dropped': self.dropped,
+                    'previewTime': self.previewTime}
@@ -0,0 +1,197 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+from collections import deque
+
+from twisted.internet import defer, reactor
+from twisted.python import failure
+
+from evora.common.logging import my_logger
+
+"""
+The one thread that talks to the camera.
+
+The andor module wraps an SDK that is not thread safe, yet every command used to be run with deferToThread, so up to
+thirty pool threads could be inside it at once.  HardwareExecutor owns the SDK instead: the commands that touch the
+camera are queued to its thread and run there one at a time, from lanes taken highest priority first and in order
+within a lane:
+    ABORT     -- abort
+    CONTROL   -- starting acquisitions, the cooler, startup and shutdown
+    TELEMETRY -- temperature, status and the other queries
+Commands that touch no hardware (INLINE: the *Stats reports and history) are answered in the reactor thread without
+the hop.
+
+An acquisition holds the thread for as long as it runs, so its waits call service() between slices (see
+acquisition_wait.AcquisitionWaiter.between): the ABORT and TELEMETRY work queued meanwhile runs there, still on the
+owning thread, and CONTROL work waits for the acquisition to end.  Once an abort is queued it also wakes the waiter
+straight away from the reactor thread (waiter.abort(); CancelWait is the one SDK call meant to be made from another
+thread), so its AbortAcquisition runs within one wait slice however long the exposure, before the wait returns.
+
+stats() gives the distribution of the time work waited in each lane; for the ABORT lane that is the time from an
+abort arriving to AbortAcquisition starting.
+"""
+
+logger = my_logger.myLogger("hardware.py", "server")
+
+ABORT, CONTROL, TELEMETRY = range(3)
+LANE_NAMES = ('abort', 'control', 'telemetry')
+
+LANES = {'abort': ABORT,
+         'connect': CONTROL, 'setTEC': CONTROL, 'warmup': CONTROL, 'shutdown': CONTROL,
+         'expose': CONTROL, 'real': CONTROL, 'series': CONTROL,
+         'temp': TELEMETRY, 'tempRange': TELEMETRY, 'getTEC': TELEMETRY, 'status': TELEMETRY,
+         'timings': TELEMETRY, 'vertStats': TELEMETRY, 'horzStats': TELEMETRY}
+INLINE = ('writerStats', 'poolStats', 'sessionStats', 'streamStats', 'executorStats', 'history')
+
+
+def laneFor(command):
+    """
+    Returns the lane of a command line, or None when it is INLINE.  Unknown commands are CONTROL, so they never run
+    alongside an acquisition.
+    """
+    words = command.split()
+    if words and words[0] in INLINE:
+        return None
+    return LANES.get(words[0] if words else None, CONTROL)
+
+
+def _percentile(ordered, percent):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class HardwareExecutor(object):
+    """
+    Runs work on the thread that owns the camera SDK.  Until start() (in tests and scripts) work runs in the calling
+    thread instead.  driver is the reactor, replaceable for tests; history is the number of waits per lane kept for
+    stats().
+    """
+    def __init__(self, driver=reactor, history=1000):
+        self.reactor = driver
+        self._lanes = [deque() for name in LANE_NAMES]
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._thread = None
+        self._stopping = False
+        self._waits = [deque(maxlen=history) for name in LANE_NAMES]
+        self._run = [0 for name in LANE_NAMES]
+
+    def start(self):
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="HardwareExecutor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Finishes the queued work and stops the thread.
+        """
+        with self._lock:
+            self._stopping = True
+            self._work.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def owns(self):
+        """
+        Whether the calling thread may use the SDK directly: it is the executor's thread, or there is none yet.
+        """
+        return self._thread is None or threading.current_thread() is self._thread
+
+    def submit(self, lane, f, *args):
+        """
+        Queues f(*args) in lane.  Returns a Deferred fired in the reactor thread with its result or failure.
+        """
+        if self._thread is None:
+            return defer.maybeDeferred(f, *args)
+        d = defer.Deferred()
+
+        def finish(ok, result):
+            self.reactor.callFromThread(d.callback if ok else d.errback, result)
+        self._put(lane, f, args, finish)
+        return d
+
+    def call(self, lane, f, *args):
+        """
+        Runs f(*args) in lane and blocks until it is done, returning its result or raising its exception.  Runs it
+        straight away when the caller owns() the SDK.
+        """
+        if self.owns():
+            return f(*args)
+        done = threading.Event()
+        outcome = []
+
+        def finish(ok, result):
+            outcome.append((ok, result))
+            done.set()
+        self._put(lane, f, args, finish)
+        done.wait()
+        ok, result = outcome[0]
+        if not ok:
+            result.raiseException()
+        return result
+
+    def service(self):
+        """
+        Runs the queued ABORT and TELEMETRY work.  Called by a long running job on the executor's thread between its
+        waits; does nothing on any other thread.
+        """
+        if self._thread is None or threading.current_thread() is not self._thread:
+            return
+        job = self._take((ABORT, TELEMETRY), False)
+        while job is not None:
+            self._execute(job)
+            job = self._take((ABORT, TELEMETRY), False)
+
+    def _put(self, lane, f, args, finish):
+        with self._lock:
+            self._lanes[lane].append((lane, time.time(), f, args, finish))
+            self._work.notify()
+
+    def _take(self, lanes, block):
+        with self._lock:
+            while True:
+                for lane in lanes:
+                    if self._lanes[lane]:
+                        return self._lanes[lane].popleft()
+                if not block or self._stopping:
+                    return None
+                self._work.wait()
+
+    def _execute(self, job):
+        lane, queued, f, args, finish = job
+        with self._lock:
+            self._waits[lane].append(time.time() - queued)
+            self._run[lane] += 1
+        try:
+            result = f(*args)
+        except Exception:
+            finish(False, failure.Failure())
+        else:
+            finish(True, result)
+
+    def _loop(self):
+        job = self._take(range(len(LANE_NAMES)), True)
+        while job is not None:
+            self._execute(job)
+            job = self._take(range(len(LANE_NAMES)), True)
+
+    def stats(self):
+        """
+        Returns, for each of LANE_NAMES, a dict of the jobs 'queued' now and 'run' so far and the 'median', 'p95'
+        and 'max' of the last history waits in seconds.
+        """
+        report = {}
+        with self._lock:
+            for lane, name in enumerate(LANE_NAMES):
+                waits = sorted(self._waits[lane])
+                report[name] = {'queued': len(self._lanes[lane]),
+                                'run': self._run[lane],
+                                'median': _percentile(waits, 50),
+                                'p95': _percentile(waits, 95),
+                                'max': waits[-1] if waits else 0.0}
+        return report
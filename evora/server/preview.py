@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import math
+
+import numpy as np
+
+"""
+Screen sized previews of real time frames.
+
+A preview is the frame shrunk by an integer factor so its longer side fits the requested size, then stretched to
+8 bits between two percentiles.  Shrinking is either a block average ('mean', which also beats down the read noise)
+or plain striding ('stride', cheaper but aliased).  The percentiles come from a regular sample of at most
+PERCENTILE_SAMPLE pixels of the shrunk image, which is plenty for a display stretch and keeps the sort small.
+
+Everything is whole-array NumPy.  The block sum adds strided slices, rows first and then columns, rather than
+reshaping to (h, f, w, f) and summing the short axes, which is several times slower.
+"""
+
+METHODS = ('mean', 'stride')
+PERCENTILE_SAMPLE = 65536
+
+
+def decimationFactor(shape, size):
+    """
+    Returns the smallest integer factor that makes the longer side of shape at most size pixels.
+    """
+    return max(1, int(math.ceil(max(shape) / size)))
+
+
+def decimate(image, factor, method='mean'):
+    """
+    Pre: image is a 2D integer array, factor >= 1 and method one of METHODS.
+    Post: Returns the image shrunk by factor on both axes.  'mean' averages factor x factor blocks, dropping the
+    rows and columns that do not fill a block; 'stride' keeps every factor-th pixel.
+    """
+    if method not in METHODS:
+        raise ValueError("unknown decimation %s, expected one of %s" % (method, METHODS))
+    if factor == 1:
+        return image
+    if method == 'stride':
+        return image[::factor, ::factor]
+    height, width = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    image = image[:height, :width]
+    rows = image[0::factor].astype(np.uint32)
+    for i in range(1, factor):
+        rows += image[i::factor]
+    sums = rows[:, 0::factor].copy()
+    for i in range(1, factor):
+        sums += rows[:, i::factor]
+    return sums * np.float32(1 / factor ** 2)
+
+
+def stretch(image, low=0.5, high=99.5):
+    """
+    Pre: low and high are percentiles, low < high.
+    Post: Returns (pixels, lowValue, highValue): the image mapped linearly so lowValue is 0 and highValue is 255,
+    clipped and as uint8.  pixel * (highValue - lowValue) / 255 + lowValue gives back the value.
+    """
+    step = max(1, int(math.sqrt(image.size / PERCENTILE_SAMPLE)))
+    lowValue, highValue = np.percentile(image[::step, ::step], [low, high])
+    if highValue <= lowValue:
+        highValue = lowValue + 1
+    scaled = (image - np.float32(lowValue)) * np.float32(255 / (highValue - lowValue))
+    np.clip(scaled, 0, 255, out=scaled)
+    return scaled.astype(np.uint8), float(lowValue), float(highValue)
+
+
+def makePreview(image, size, method='mean', low=0.5, high=99.5):
+    """
+    Returns (pixels, factor, lowValue, highValue) for the preview of image whose longer side is at most size.
+    """
+    factor = decimationFactor(image.shape, size)
+    pixels, lowValue, highValue = stretch(decimate(image, factor, method), low, high)
+    return pixels, factor, lowValue, highValue
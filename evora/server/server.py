@@ -10,7 +10,7 @@ from __future__ import absolute_import, division, print_function
 __author__ = "Tristan J. Hillis"
 
 # Imports
-import glob
+import functools
 import os
 import signal
 import subprocess
@@ -20,13 +20,26 @@ import ConfigParser
 from datetime import datetime
 
 # MRO files
+import evora.common.command_protocol as command_protocol
+import evora.common.frame_ring as frame_ring
+import evora.common.messages as messages
 import evora.common.utils.fits as fits_utils
+import evora.common.utils.stats as stats_utils
+import evora.server.acquisition_wait as acq_wait
+import evora.server.broadcast as broadcast
+import evora.server.camera_session as camera_session
+import evora.server.fits_headers as fits_headers
+import evora.server.fits_writer as fits_writer
+import evora.server.frame_pool as frame_pool
+import evora.server.frame_push as frame_push
+import evora.server.hardware as hardware
+import evora.server.tcc_logs as tcc_logs
+import evora.server.telemetry as telemetry
 from evora.common.logging import my_logger
 import numpy as np
 import pandas as pd
 from astropy.io import fits
-from astropy.time import Time
-from twisted.internet import protocol, reactor, threads
+from twisted.internet import defer, protocol, reactor
 from twisted.protocols import basic
 
 from evora.common import netconsts
@@ -34,6 +47,8 @@ from evora.common import netconsts
 # Temporary spot to put config path and other info
 config_path = 'config/config.ini'
 section = 'server'
+config = ConfigParser.ConfigParser()
+config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), config_path))
 
 try:
     from evora.server.andor import andor
@@ -47,13 +62,45 @@ except(ImportError):
 # port for evora is 5502
 # port for filter wheel is 5503
 # port for ftp server is 5504
+# port for the real time frame stream is 5506
+# port for the http file server is 5507
 
 # Global Variables
 acquired = None
 t = None
 isAborted = None  # tracks globally when the abort has been called. Every call to the parser is an new instance
+seriesReport = None  # frame accounting of the last kinetic series
 logger = my_logger.myLogger("evora_server.py", "server")
-ftp_server = None
+executor = hardware.HardwareExecutor()  # the one thread that calls the SDK
+camera = camera_session.CameraSession(andor)  # remembers the applied setup so unchanged SDK calls are skipped
+waiter = acq_wait.createWaiter(andor)  # shared by every parser so abort can wake a running acquisition
+waiter.between = executor.service  # aborts and queries run between the waits of an acquisition
+writer = fits_writer.FitsWriter(threads=config.getint(section, 'writer_threads'),
+                                maxQueue=config.getint(section, 'writer_queue'),
+                                policy=config.get(section, 'writer_policy'),
+                                processes=config.getint(section, 'writer_processes'))  # writes series frames off the readout loop
+defaultCompression = config.get(section, 'writer_compression')  # used when a command has no compress= option
+framePool = frame_pool.FramePool(config.getint(section, 'frame_pool_size'))  # reused image buffers for every mode
+frameRing = None  # shared memory ring of real time frames for a GUI on this machine
+if config.getboolean(section, 'frame_ring') and os.path.isdir(os.path.dirname(netconsts.FRAME_RING_PATH)):
+    frameRing = frame_ring.FrameRingWriter(netconsts.FRAME_RING_PATH, config.getint(section, 'frame_ring_slots'))
+frameStream = frame_push.FramePushFactory(previewSize=config.getint(section, 'preview_size'),
+                                          method=config.get(section, 'preview_method'),
+                                          low=config.getfloat(section, 'preview_low'),
+                                          high=config.getfloat(section, 'preview_high'),
+                                          ring=frameRing)  # pushes real time frames to subscribed clients
+positionLogs = tcc_logs.PositionLogStore()  # indexed heimdall position logs for the headers
+gtccLogs = tcc_logs.GtccLogStore()  # indexed gtcc logs for the headers
+history = telemetry.TelemetryHistory(config.getint(section, 'telemetry_history'))  # samples for the history command
+sampler = telemetry.TelemetrySampler(andor, interval=config.getfloat(section, 'telemetry_interval'),
+                                     maxAge=config.getfloat(section, 'telemetry_max_age'),
+                                     call=functools.partial(executor.call, hardware.TELEMETRY),
+                                     history=history)  # answers temp and status
+headerFactory = fits_headers.HeaderFactory(andor, config.get(section, 'latitude'), config.get(section, 'longitude'),
+                                           positionLogs, gtccLogs, sampler.temperature)  # cached header templates
+file_server = None  # HTTP file service process (file_server.py)
+hub = broadcast.BroadcastHub(maxQueue=config.getint(section, 'broadcast_queue'),
+                             policy=config.get(section, 'broadcast_policy'))  # sends every reply to every client
 parser = None
 # Get gregorian date, local
 # d = date.today()
@@ -67,56 +114,118 @@ class EvoraServer(basic.LineReceiver):
     and the resulting data is sent back to the client.  This a threaded server so that long
     running functions in the parser don't hang the whole server.
     """
+    encoding = 'text'  # of the lines sent to this client, see messages
+
     def connectionMade(self):
         """
-        If you send more than one line then the callback to start the gui will completely fail.
+        Sends the new client, and only it, the status and temperature of the camera in one line: the callback that
+        starts the gui expects a single "status" line.  It comes from the sampler's snapshot, or from a sample taken
+        in the telemetry lane when that is stale, so the reactor never waits for the driver.
         """
-        self.factory.clients.append(self)
-        ep = EvoraParser(self)
-        command = ep.parse("status")
-        self.sendMessage(
-            str(command
-                ))  # activate the callback to give full control to the camera.
+        self.factory.hub.add(self)
+        snapshot = sampler.current()
+        if snapshot is not None:
+            self.sendStatus(snapshot)
+        else:
+            executor.submit(hardware.TELEMETRY, sampler.get).addCallback(self.sendStatus)
+
+    def sendStatus(self, snapshot):
+        self.factory.hub.send(self, messages.Outgoing(telemetry.snapshotLine('status', snapshot)))
 
     def connectionLost(self, reason):
         """
-        Adds connecting client to the list of existing clients.
+        Removes the disconnecting client from the list of existing clients.
         """
-        self.factory.clients.remove(self)
+        self.factory.hub.remove(self)
 
     def lineReceived(self, line):
         """
-        Called when server recieves a line. Runs the line through the parser and then
-        sends the resulting data off.
+        Called when server recieves a line. Runs the line through the parser on the hardware thread, in the lane
+        of the command (see hardware), and then sends the resulting data off.  Commands that touch no hardware,
+        including the telemetry queries while the sampler's snapshot is fresh, are answered right here.
         """
         logger.debug("received " + line)
-        ep = EvoraParser(self)
-        d = threads.deferToThread(ep.parse, line)
-        d.addCallback(self.sendData)
-
-    def sendData(self, data):
+        requestId, command = command_protocol.splitRequest(line)
+        if command.split(" ")[0] == 'protocol':
+            self.negotiate(command.split(" ")[1:], requestId)
+            return
+        if command.split(" ")[0] in telemetry.QUERIES:
+            snapshot = sampler.current()  # checked and taken at once, a stale one goes to the telemetry lane
+            if snapshot is not None:
+                self.sendData(telemetry.line(command.split(" ")[0], snapshot), requestId)
+                return
+        ep = EvoraParser(Request(self, requestId))
+        lane = hardware.laneFor(command)
+        if lane is None:
+            d = defer.maybeDeferred(ep.parse, command)  # a bad command is logged, as on the hardware thread
+            d.addCallback(self.sendData, requestId)
+            return
+        d = executor.submit(lane, ep.parse, command)
+        d.addCallback(self.sendData, requestId)
+        if lane == hardware.ABORT:
+            waiter.abort()  # queued first, so the acquisition it wakes finds the abort waiting between its waits
+
+    def sendData(self, data, requestId=None, event=False):
         """
         Decorator method to self.sendMessage(...) so that it
-        sends the resulting data to every connected client.
+        sends the resulting data to every connected client.  When the command was tagged with
+        requestId this client gets the data tagged (see command_protocol), the others get it as it is.
         """
         if data is not None:
-            self.sendMessage(str(data))
+            self.factory.hub.broadcast(messages.Outgoing(str(data), self, requestId, event))
 
     def sendMessage(self, message):
         """
-        Sends message to every connect client.
+        Sends message to every connect client.  Safe to call from the parser and acquisition threads, the hub
+        writes it from the reactor thread.
         """
-        for client in self.factory.clients:
-            client.sendLine(message)
+        self.factory.hub.broadcast(messages.Outgoing(message))
+
+    def negotiate(self, words, requestId):
+        """
+        Handles "protocol <encoding> <version>": switches this client to the encoding if it is known and answers
+        "protocol <encoding>,<version>" with the encoding and version now in use.  The answer is still in the old
+        encoding.
+        """
+        encoding = self.encoding
+        if len(words) == 2 and words[0] in messages.ENCODINGS and words[1].isdigit() and int(words[1]) >= 1:
+            encoding = words[0]
+        reply = "protocol %s,%d" % (encoding, messages.VERSION)
+        # this runs in the reactor thread, so the hub renders the reply straight away, in the old encoding
+        self.factory.hub.send(self, messages.Outgoing(reply, self, requestId))
+        self.encoding = encoding
+        logger.info("client %s uses the %s encoding" % (self.transport.getPeer(), self.encoding))
+
+
+class Request(object):
+    """
+    The connection a command came in on and its request ID (None for an untagged command).  The parser hands
+    it to the long running exposures in place of the protocol, so what they send is tagged as events of the
+    command.
+    """
+    def __init__(self, protocol, requestId):
+        self.protocol = protocol
+        self.requestId = requestId
+
+    def sendData(self, data):
+        self.protocol.sendData(data, self.requestId, event=True)
+
+    def reply(self, data):
+        """
+        Sends the command's reply from another thread, for a command that returned None and answers later.
+        """
+        self.protocol.sendData(data, self.requestId)
 
 
 class EvoraClient(protocol.ServerFactory):
     """
-    This makes up the twistedPython factory that defines the protocol and stores
-    a list of the clients connect.
+    This makes up the twistedPython factory that defines the protocol and holds
+    the broadcast hub of the connected clients.
     """
     protocol = EvoraServer
-    clients = []
+
+    def __init__(self, hub):
+        self.hub = hub
 
 
 # Evora Parser commands sent here from server where it envokes the camera commands.
@@ -139,6 +248,8 @@ class EvoraParser(object):
         (e.g. input=connect will run the Evora startup routine).
         """
         input = input.split()
+        options = dict(word.split('=', 1) for word in input if '=' in word)  # optional name=value settings
+        input = [word for word in input if '=' not in word]
         if input[0] == 'connect':
             """
             Run Evora initialization routine.
@@ -211,6 +322,51 @@ class EvoraParser(object):
             return self.e.horizontalSpeedStats(int(input[1]), int(input[2]),
                                                int(input[3]))
 
+        if input[0] == "writerStats":
+            """
+            Reports the state of the background FITS writer used by series exposures: queue depth, frame counts, and
+            the mean and max write latency in seconds.
+            """
+            return self.e.getWriterStats()
+
+        if input[0] == "poolStats":
+            """
+            Reports the image buffer pool: capacity, buffers allocated, buffers leased now, the high-water mark of
+            leased buffers, and the number of leaked buffers that had to be reclaimed.
+            """
+            return self.e.getPoolStats()
+
+        if input[0] == "sessionStats":
+            """
+            Reports the camera setup cache: SDK setup calls sent and skipped, and the setup time saved in seconds in
+            total and for the last exposure.
+            """
+            return self.e.getSessionStats()
+
+        if input[0] == "streamStats":
+            """
+            Reports the real time frame stream: subscribers connected now, frames published, packets sent and
+            packets skipped for subscribers whose connection was backed up.
+            """
+            return self.e.getStreamStats()
+
+        if input[0] == "executorStats":
+            """
+            Reports the hardware thread's lanes (abort, control and telemetry): for each the commands queued now and
+            run so far, and the median, 95th percentile and maximum of their time in the queue in seconds.
+            """
+            return self.e.getExecutorStats()
+
+        if input[0] == "history":
+            """
+            Returns the samples of a telemetry series (temperature, target, ambient, cooler or status) between two
+            times, in seconds since the epoch or, when zero or negative, relative to now, thinned to at most
+            maxpoints keeping the lowest and highest of each stretch.
+
+            Example: history temperature -43200 0 500
+            """
+            return self.e.getHistory(input[1], float(input[2]), float(input[3]), int(input[4]))
+
         if input[0] == "abort":
             """
             Calls the Evora abort command to stop an exposure.  Appears there is no way to then readout the
@@ -223,9 +379,10 @@ class EvoraParser(object):
             This if entry exectues a single exposure command.  The required arguements to define (i.e.
             when using Telnet) are image type, such as bias, the number of exposures (should be one), the integration time, the
             binning type (1x1 or 2x2), and a readoutIndex (0, 1, 2, or 4). Filter type should be specified but is not
-            required and is the last arguement.
+            required and is the last arguement.  Add compress=rice (or gzip, none) anywhere after the command to choose
+            the file compression.
 
-            Example line: expose object 1 20 2 3 g
+            Example line: expose object 1 20 2 3 g compress=rice
             """
 
             # Note to self: get rid of expNum, a different method handles getting multiple images.
@@ -246,15 +403,19 @@ class EvoraParser(object):
                                  itime,
                                  binning,
                                  readTime=readoutIndex,
-                                 filter=filter)
+                                 filter=filter,
+                                 compress=options.get('compress'),
+                                 protocol=self.protocol)
 
         if input[0] == 'real':
             """
             This if entry handles the real time series exposure where the camera runs in RunTillAbort mode.
             The arguements to give (i.e. using Telnet) are image type (e.g. bias), exposure number, integration time,
-            and binning type (1x1 or 2x2).
+            and binning type (1x1 or 2x2).  Frames are pushed to the clients subscribed to the frame stream port;
+            they are only written to disk (and their path sent with realSent) when save=1 is added or nobody is
+            subscribed.
 
-            Example: real object 1 5 2
+            Example: real object 1 5 2 save=1
             """
             # command real flat 1 10 2
             imType = input[1]
@@ -263,13 +424,14 @@ class EvoraParser(object):
             itime = float(input[3])
             binning = int(input[4])
             return self.e.realTimeExposure(self.protocol, imType, itime,
-                                           binning)
+                                           binning, save=options.get('save') == '1')
 
         if input[0] == 'series':
             """
             This handles taking multiple images in one go.  The arguements to sepcify (ie when using Telnes) are
             image type (eg bias), exposure number (>1), integration time, binning type (1x1 or 2x2), the readout index
             (0, 1, 2, or 3).  The last arguement is the filter name which isn't required but is recommended to include.
+            compress=rice (or gzip, none) chooses the file compression as for expose.
 
             Example: series object 5 20 2 3 g
             """
@@ -291,7 +453,8 @@ class EvoraParser(object):
                                           readTime=readoutIndex,
                                           filter=filter,
                                           numexp=expnum,
-                                          binning=binning)
+                                          binning=binning,
+                                          compress=options.get('compress'))
 
 
 class Evora(object):
@@ -310,8 +473,7 @@ class Evora(object):
         """
         # if the first status[0] is 20075 then the camera is not initialized yet and
         # one needs to run the startup method.
-        status = andor.GetStatus()
-        return "status " + str(status[0]) + "," + str(status[1])
+        return telemetry.line('status', sampler.get())
 
     def startup(self):
         """
@@ -326,14 +488,16 @@ class Evora(object):
         init = andor.Initialize("/usr/local/etc/andor")
 
         logger.debug('Init: ' + str(init))
+        camera.invalidate()  # the camera starts from its defaults
+        sampler.invalidate()
 
         state = andor.GetStatus()
 
         logger.debug('Status: ' + str(state))
 
-        logger.debug('SetAcquisitionMode: ' + str(andor.SetAcquisitionMode(1)))
+        logger.debug('SetAcquisitionMode: ' + str(camera.apply('SetAcquisitionMode', 1)))
 
-        logger.debug('SetShutter: ' + str(andor.SetShutter(1, 0, 50, 50)))
+        logger.debug('SetShutter: ' + str(camera.apply('SetShutter', 1, 0, 50, 50)))
 
         # make sure cooling is off when it first starts
         logger.debug('SetTemperature: ' + str(andor.SetTemperature(0)))
@@ -356,13 +520,13 @@ class Evora(object):
         # 20036 is Stabalized
         # 20034 is Off
 
-        result = andor.GetTemperatureF()
+        snapshot = sampler.get()
+        result = snapshot['tec']
         # res = coolerStatusNames[result[0] - andor.DRV_TEMPERATURE_OFF]
         logger.debug(
             str(coolerStatusNames[result[0] - andor.DRV_TEMPERATURE_OFF]) + " " + str(result[1]))
 
-        return_res = "getTEC " + str(result[0]) + "," + str(result[1])
-        return return_res
+        return telemetry.line('getTEC', snapshot)
 
     def setTEC(self, setPoint=None):
         """
@@ -377,6 +541,7 @@ class Evora(object):
             if result[0] == andor.DRV_TEMPERATURE_OFF:
                 andor.CoolerON()
             logger.debug(str(andor.SetTemperature(int(setPoint))))
+            sampler.invalidate()
         return "setTEC " + str(setPoint)
 
     def warmup(self):
@@ -388,6 +553,7 @@ class Evora(object):
         # setTemp = andor.SetTemperature(0)
         setFan = andor.SetFanMode(0)
         setCooler = andor.CoolerOFF()
+        sampler.invalidate()
 
         results = 1
         if setFan != andor.DRV_SUCCESS or setCooler != andor.DRV_SUCCESS:
@@ -402,13 +568,9 @@ class Evora(object):
         # 20035 is NotStabalized
         # 20036 is Stabalized
         # 20034 is Off
-        result = andor.GetTemperatureStatus()
-        mode = andor.GetTemperatureF()
-        txt = "" + str(mode[0])
-        logger.debug(str(result))
-        for e in result:
-            txt = txt + "," + str(e)
-        return "temp " + txt
+        snapshot = sampler.get()
+        logger.debug(str(snapshot['temperature']))
+        return telemetry.line('temp', snapshot)
 
     def getTempRange(self):
         """
@@ -438,6 +600,8 @@ class Evora(object):
         """
         logger.info('closing down camera connection')
         andor.ShutDown()
+        camera.invalidate()
+        sampler.invalidate()
         return "shutdown 1"
 
     def getTimings(self):
@@ -467,6 +631,77 @@ class Evora(object):
         logger.debug("GetNumberHSSpeeds: " + str(andor.GetNumberHSSpeeds(channel, type)))
         logger.debug("GetHSSpeed: " + str(andor.GetHSSpeed(channel, type, index)))
 
+    def getWriterStats(self):
+        """
+        Returns the background FITS writer counters as
+        "writerStats depth,maxDepth,submitted,written,dropped,blocked,meanLatency,maxLatency".
+        """
+        stats = writer.stats()
+        return "writerStats %d,%d,%d,%d,%d,%d,%.4f,%.4f" % (stats['depth'], stats['maxDepth'], stats['submitted'],
+                                                            stats['written'], stats['dropped'], stats['blocked'],
+                                                            stats['meanLatency'], stats['maxLatency'])
+
+    def getPoolStats(self):
+        """
+        Returns the frame pool counters as "poolStats capacity,allocated,leased,highWater,leaks".
+        """
+        stats = framePool.stats()
+        return "poolStats %d,%d,%d,%d,%d" % (stats['capacity'], stats['allocated'], stats['leased'],
+                                             stats['highWater'], stats['leaks'])
+
+    def getSessionStats(self):
+        """
+        Returns the camera setup cache counters as "sessionStats sent,skipped,savedTime,lastSavedTime".
+        """
+        stats = camera.stats()
+        return "sessionStats %d,%d,%.4f,%.4f" % (stats['sent'], stats['skipped'], stats['savedTime'],
+                                                 stats['lastSavedTime'])
+
+    def getStreamStats(self):
+        """
+        Returns the frame stream counters as "streamStats subscribers,published,sent,dropped".
+        """
+        stats = frameStream.stats()
+        return "streamStats %d,%d,%d,%d" % (stats['subscribers'], stats['published'], stats['sent'], stats['dropped'])
+
+    def getExecutorStats(self):
+        """
+        Returns "executorStats " followed by queued,run,median,p95,max for each of the abort, control and telemetry
+        lanes of the hardware thread.
+        """
+        stats = executor.stats()
+        fields = []
+        for name in hardware.LANE_NAMES:
+            lane = stats[name]
+            fields.append("%d,%d,%.6f,%.6f,%.6f" % (lane['queued'], lane['run'], lane['median'], lane['p95'],
+                                                    lane['max']))
+        return "executorStats " + ",".join(fields)
+
+    def getHistory(self, series, start, end, maxPoints):
+        """
+        Pre: start and end are times in seconds since the epoch, or relative to now when zero or negative.
+        Post: Returns the "history" line of the series (see telemetry.historyLine), empty for an unknown series.
+        """
+        if series not in telemetry.TelemetryHistory.SERIES:
+            logger.warning("no telemetry series " + series)
+            return telemetry.historyLine(series, [], [])
+        now = time.time()
+        start, end = [now + t if t <= 0 else t for t in (start, end)]
+        maxPoints = min(max(maxPoints, 2), telemetry.MAX_POINTS)
+        times, values = history.query(series, start, end, maxPoints)
+        return telemetry.historyLine(series, times, values)
+
+    def getCompression(self, name):
+        """
+        Pre: name is a compress= option from the protocol line, or None for the configured default.
+        Post: Returns the astropy compression type to write with, or None for uncompressed files.
+        """
+        try:
+            return fits_writer.compressionType(name or defaultCompression)
+        except ValueError as e:
+            logger.warning(str(e) + ", writing uncompressed")
+            return None
+
     def abort(self):
         """
         This will abort the exposure and throw it out.
@@ -475,6 +710,7 @@ class Evora(object):
         isAborted = True
         self.isAbort = True
         logger.debug("Aborted: " + str(andor.AbortAcquisition()))
+        waiter.abort()
         return 'abort 1'
 
     def getHeader(self, attributes):
@@ -501,9 +737,9 @@ class Evora(object):
         header.append(card=("READMODE", "Image", "Readout mode"))
         header.append(card=("INSTRUME", "evora",
                             "Instrument used for imaging"))
-        header.append(card=("LATITUDE", config[section]['latitude'],
+        header.append(card=("LATITUDE", config.get(section, 'latitude'),
                             "Decimal degrees of MRO latitude"))
-        header.append(card=("LONGITUD", config[section]['longitude'],
+        header.append(card=("LONGITUD", config.get(section, 'longitude'),
                             "Decimal degress of MRO longitude"))
 
         # get readout time and temp
@@ -514,106 +750,16 @@ class Evora(object):
 
         return header
 
-    def getHeader_2(self, attributes, tcc):
+    def getHeader_2(self, attributes, tcc, ut_time=None):
         """
-        Pre: Takes in a list of attributes: [imType, binning, itime], tcc is ether 'gtcc' or 'heimdall'
+        Pre: Takes in a list of attributes: [imType, binning, itime], tcc is ether 'gtcc' or 'heimdall'.  ut_time is the
+        time.gmtime() of the start of the exposure and defaults to now.
         Post: Returns an AstroPy header object to be used for writing to.
         """
-        imType, binning, itime, filter = attributes[0], attributes[
-            1], attributes[2], attributes[3]
-        # make new fits header object
-        header = fits.Header()
-        ut_time = time.gmtime()  # get UT time
-        dateObs = time.strftime("%Y-%m-%dT%H:%M:%S", ut_time)
-        ut_str = time.strftime("%H:%M:%S", ut_time)
-        header.append(card=("DATE-OBS", dateObs, "Time at start of exposure"))
-        header.append(card=("UT", ut_str, "UT time at start of exposure"))
-        header.append(card=("OBSERVAT", "mro", "per the iraf list"))
-        header.append(card=("IMAGETYP", imType))
-        header.append(card=("FILTER", filter))
-        header.append(card=("BINX", binning, "Horizontal Binning"))
-        header.append(card=("BINY", binning, "Vertical Binning"))
-        header.append(card=("EXPTIME", itime, "Total exposure time"))
-        header.append(card=("ACQMODE", "Single Scan", "Acquisition mode"))
-        header.append(card=("READMODE", "Image", "Readout mode"))
-        header.append(card=("INSTRUME", "evora",
-                            "Instrument used for imaging"))
-        header.append(card=("LONGITUD", config[section]['longitude'],
-                            "Decimal degrees of MRO latitude"))
-        header.append(card=("LATITUDE", config[section]['latitude'],
-                            "Decimal degress of MRO longitude"))
-
-        # get readout time and temp
-        temp = andor.GetTemperatureStatus()[1]
-        readTime = andor.GetAcquisitionTimings()[3] - itime
-        header.append(card=("TEMP", temp, "Temperature"))
-        header.append(card=("READTIME", readTime, "Pixel readout time"))
-
-        # NEEDED header keywords
-        # Done RA / Right Ascension
-        # Done DEC / Declination
-        # Done EPOCH / Epoch for RA and Dec (years)
-        # Done ST / local sidereal time (hours)
-        # Done HA / Hour Angle
-        # Done ZD / Zenith Angle
-        # AIRMASS
-        # UTMIDDLE
-        # JD
-        # HJD
-        # LJD
-        if tcc == "heimdall":
-            obsTime = time.strptime(dateObs + " UTC", "%Y-%m-%dT%H:%M:%S %Z")
-            logFileList = glob.glob(
-                "/home/mro/storage/tcc_data/positionlogs/*.txt")
-            file = self.heimdallChooseLogFile(logFileList, obsTime)
-            if file is not None:
-                results = self.heimdallParseLogFile(file, obsTime)
-                if results is not None:
-                    ra, dec, epoch, lst, ha, za = results
-
-                    airmass = 1.0 / np.cos(np.radians(za))
-                    # airmass = 1.0 / np.sin(np.radians((90-za) + 244/(165+47*(90-za)**1.1)))
-
-                    astroTime = Time(dateObs, scale='utc')
-                    print("FROM HEIMDALL LOGS:", results)
-
-                    header.append(card=("RA", ra, "Right Ascension"))
-                    header.append(card=("DEC", dec, "Declination"))
-                    header.append(card=("EPOCH", epoch,
-                                        "Epoch for RA and Dec (years)"))
-                    header.append(card=("ST", lst,
-                                        "local sidereal time (hours)"))
-                    header.append(card=("HA", ha, "Hour Angle"))
-                    header.append(card=("ZD", za, "Zenith Angle"))
-                    header.append(card=("AIRMASS", airmass,
-                                        "Airmass (X = sec z)"))
-                    header.append(card=("JD", str(astroTime.jd),
-                                        "Julian Date"))
-                    header.append(card=("MJD", str(astroTime.mjd),
-                                        "Modified Julian Date"))
-
-        else:  # gtcc
-            print("ACCESSING LOG FILES")
-            LogfileList = glob.glob("/home/mro/mnt/gtcc" + '/????-??-??T??:??:??')
-            print("FOUND %d LOGS" % len(LogfileList))
-            ObsTime = time.strptime(dateObs + ' UTC', "%Y-%m-%dT%H:%M:%S %Z")
-            LogfileName = self.ChooseLogfile(LogfileList, ObsTime)
-            if LogfileName is not None:
-                print("LOG FILE NAME:", LogfileName)
-                ra, dec, epoch, lst, ha, za = self.ParseLogfile(
-                    LogfileName, ObsTime)
-                print(ra, dec, epoch, lst, ha, za)
-
-                header.append(card=("RA", ra, "Right Ascension"))
-                header.append(card=("DEC", dec, "Declination"))
-                header.append(card=("EPOCH", epoch,
-                                    "Epoch for RA and Dec (years)"))
-                header.append(card=("ST", lst, "local sidereal time (hours)"))
-                header.append(card=("HA", ha, "Hour Angle"))
-                header.append(card=("ZD", za, "Zenith Angle"))
-
-        return header
+        return headerFactory.session(attributes, tcc).build(ut_time)
 
+    # heimdallChooseLogFile and heimdallParseLogFile are replaced by the indexed tcc_logs.PositionLogStore and are kept
+    # as the reference implementation for benchmarks/bench_position_logs.py
     def heimdallChooseLogFile(self, logFileList, obsTime):
         """
         Parameters
@@ -697,6 +843,7 @@ class Evora(object):
         except IndexError:
             return None
 
+    # ChooseLogfile and ParseLogfile are replaced by the indexed tcc_logs.GtccLogStore and are kept for reference
     def ChooseLogfile(self, LogfileList, ObsTime):
         """
         Code provided by add_headers v4.1 written by Oliver Frasier
@@ -772,11 +919,17 @@ class Evora(object):
                itime=2,
                binning=1,
                filter="",
-               readTime=3):
+               readTime=3,
+               compress=None,
+               protocol=None):
         """
         expNum is deprecated and should be removed.
         This handles a single exposure and no more.  Inputs are the image type integration time, binning type
-        filter type, as a string, and the index for the specified horizontal readout time.
+        filter type, as a string, and the index for the specified horizontal readout time.  compress names the file
+        compression (see fits_writer.COMPRESSION_TYPES) and defaults to the configured one.
+        The statistics and the write are left to the writer threads: with a protocol (the parser's Request) the
+        reply is sent from there once the file is on disk and None is returned; without one this waits for the
+        writer and returns the reply.
         """
         elapse_time = 0 - time.clock()
         if expnum is None:
@@ -788,34 +941,33 @@ class Evora(object):
         if imType is None:  # if the image type is not specified it defaults to object
             imType = "object"
 
-        retval, width, height = andor.GetDetector()
+        camera.begin()
+        retval, width, height = camera.detector()
         logger.debug('GetDetector: ' + str(retval) + " " + str(width) + " " + str(height))
         # print 'SetImage:', andor.SetImage(1,1,1,width,1,height)
-        logger.debug('SetReadMode: ' + str(andor.SetReadMode(4)))
-        logger.debug('SetAcquisitionMode: ' + str(andor.SetAcquisitionMode(1)))
+        logger.debug('SetReadMode: ' + str(camera.apply('SetReadMode', 4)))
+        logger.debug('SetAcquisitionMode: ' + str(camera.apply('SetAcquisitionMode', 1)))
         logger.debug(
-            'SetImage: ' + str(andor.SetImage(binning, binning, 1, width, 1, height)))
-        logger.debug('GetDetector (again): ' + str(andor.GetDetector()))
+            'SetImage: ' + str(camera.apply('SetImage', binning, binning, 1, width, 1, height)))
 
         if imType == "bias":
-            andor.SetShutter(
-                1, 2, 0, 0
-            )  # TLL mode high, shutter mode Permanently Closed, 0 millisec open/close
-            logger.debug('SetExposureTime: ' + str(andor.SetExposureTime(0)))
+            camera.apply('SetShutter', 1, 2, 0, 0)  # TLL mode high, shutter mode Permanently Closed, 0 millisec open/close
+            logger.debug('SetExposureTime: ' + str(camera.apply('SetExposureTime', 0)))
         else:
             if imType in ['flat', 'object']:
-                andor.SetShutter(1, 0, 5, 5)
+                camera.apply('SetShutter', 1, 0, 5, 5)
             else:
-                andor.SetShutter(1, 2, 0, 0)
+                camera.apply('SetShutter', 1, 2, 0, 0)
             logger.debug(
-                'SetExposureTime: ' + str(andor.SetExposureTime(itime))
+                'SetExposureTime: ' + str(camera.apply('SetExposureTime', itime))
             )  # TLL mode high, shutter mode Fully Auto, 5 millisec open/close
 
         # set Readout speeds 0, 1, 2, or 3
         # print("SetVSSpeed:", andor.SetVSSpeed(3))
         logger.debug(
-            "SetHSSpeed: " + str(andor.SetHSSpeed(0, readTime))
+            "SetHSSpeed: " + str(camera.apply('SetHSSpeed', 0, readTime))
         )  # default readTime is index 3 which is 0.5 MHz or ~6 sec
+        logger.debug("Setup: " + str(camera.report()))
 
         results, expTime, accTime, kTime = andor.GetAcquisitionTimings()
         logger.debug("Adjusted Exposure Time: " + str([results, expTime, accTime, kTime]))
@@ -824,16 +976,16 @@ class Evora(object):
         # header = self.getHeader(attributes)
         header = self.getHeader_2(attributes, 'heimdall')
 
+        waiter.arm()
         logger.debug('StartAcquisition: ' + str(andor.StartAcquisition()))
 
-        status = andor.GetStatus()
+        status = waiter.wait()
         logger.debug(str(status))
-        while status[1] == andor.DRV_ACQUIRING:
-            status = andor.GetStatus()
 
-        data = np.zeros(width // binning * height // binning, dtype='uint16')
-        logger.debug(str(data.shape))
-        result = andor.GetAcquiredData16(data)
+        framePool.configure(width, height, binning)
+        frame = framePool.lease('expose')
+        logger.debug(str(frame.data.shape))
+        result = andor.GetAcquiredData16(frame.data)
 
         success = None
         if result == 20002:
@@ -842,104 +994,140 @@ class Evora(object):
             success = 0  # for false
 
         logger.debug(str(result) + 'success={}'.format(result == 20002))
-        filename = None
-        if success == 1:
-            data = data.reshape(width // binning, height // binning)
-            #data = np.fliplr(data)
-            logger.debug(str(data.shape) + " " + str(data.dtype))
-            hdu = fits.PrimaryHDU(data,
-                                  do_not_scale_image_data=True,
-                                  uint=True,
-                                  header=header)
-            # filename = time.strftime('/data/forTCC/image_%Y%m%d_%H%M%S.fits')
-            filename = fits_utils.get_image_path('expose')
-            hdu.writeto(filename, clobber=True)
-            logger.debug("wrote: {}".format(filename))
+        if success != 1:
+            frame.release()
+            return "expose " + str(success) + ",None," + str(itime)
+
+        data = frame.image
+        #data = np.fliplr(data)
+        logger.debug(str(data.shape) + " " + str(data.dtype))
+        # filename = time.strftime('/data/forTCC/image_%Y%m%d_%H%M%S.fits')
+        compress = self.getCompression(compress)
+        filename = fits_writer.outputName(fits_utils.get_image_path('expose'), compress)
+        replies = []
+        send = protocol.reply if protocol is not None else replies.append
+        notify = functools.partial(self.sendExposed, send, itime)
+        writer.submit(fits_writer.WriteJob(data, filename, header=header, notify=notify, done=frame.release,
+                                           compress=compress, stats=True), policy='block')  # never drop a science frame
         elapse_time += time.clock()
         print("Took %.3f seconds." % elapse_time)
-        return "expose " + str(success) + "," + str(filename) + "," + str(
-            itime)
+        if protocol is not None:
+            return None
+        writer.flush()
+        return replies[0] if replies else None
+
+    def sendExposed(self, send, itime, filename, stats):
+        """
+        Called by the writer thread once the image of an expose is on disk, to send the reply with its statistics.
+        """
+        send("expose 1," + filename + "," + str(itime) + "," + stats_utils.format_record(stats))
 
-    def realTimeExposure(self, protocol, imType, itime, binning=1):
+    def realTimeExposure(self, protocol, imType, itime, binning=1, save=False):
         """
         Inputs are the Evora server protocol, the image type, the integration time, and the binning size.
-        Runs camera in RunTillAbort mode.
+        Runs camera in RunTillAbort mode.  Each frame is published on the frame stream and the clients are sent
+        "realSent <frame number>,<stats>"; with save, or when no client is subscribed, the frame is also written to
+        the tmp directory and "realSent <path>,<stats>" is sent instead.  The frame is published first; the statistics
+        (from a sample of the frame, image_stats with fast=True) and the write are left to the writer threads, which
+        send realSent.  A frame they have no room for is dropped rather than holding up the camera, and a loop that
+        falls behind the camera skips ahead to its most recent frame.
         """
         # global acquired
-        retval, width, height = andor.GetDetector()
+        camera.begin()
+        retval, width, height = camera.detector()
         logger.debug('GetDetector: ' + str(retval) + " " + str(width) + " " + str(height))
 
-        logger.debug("SetAcquisitionMode: " + str(andor.SetAcquisitionMode(5)))
-        logger.debug('SetReadMode: ' + str(andor.SetReadMode(4)))
+        logger.debug("SetAcquisitionMode: " + str(camera.apply('SetAcquisitionMode', 5)))
+        logger.debug('SetReadMode: ' + str(camera.apply('SetReadMode', 4)))
 
         logger.debug(
-            'SetImage: ' + str(andor.SetImage(binning, binning, 1, width, 1, height)))
-        logger.debug('GetDetector (again): ' + str(andor.GetDetector()))
+            'SetImage: ' + str(camera.apply('SetImage', binning, binning, 1, width, 1, height)))
 
-        logger.debug('SetExposureTime: ' + str(andor.SetExposureTime(itime)))
-        logger.debug('SetKineticTime: ' + str(andor.SetKineticCycleTime(0)))
+        logger.debug('SetExposureTime: ' + str(camera.apply('SetExposureTime', itime)))
+        logger.debug('SetKineticTime: ' + str(camera.apply('SetKineticCycleTime', 0)))
 
         if imType == "bias":
-            andor.SetShutter(
-                1, 2, 0, 0
-            )  # TLL mode high, shutter mode Permanently Closed, 0 millisec open/close
-            logger.debug('SetExposureTime: ' + str(andor.SetExposureTime(0)))
+            camera.apply('SetShutter', 1, 2, 0, 0)  # TLL mode high, shutter mode Permanently Closed, 0 millisec open/close
+            logger.debug('SetExposureTime: ' + str(camera.apply('SetExposureTime', 0)))
         else:
             if imType in ['flat', 'object']:
-                andor.SetShutter(1, 0, 5, 5)
+                camera.apply('SetShutter', 1, 0, 5, 5)
             else:
-                andor.SetShutter(1, 2, 0, 0)
+                camera.apply('SetShutter', 1, 2, 0, 0)
             logger.debug(
-                'SetExposureTime: ' + str(andor.SetExposureTime(itime))
+                'SetExposureTime: ' + str(camera.apply('SetExposureTime', itime))
             )  # TLL mode high, shutter mode Fully Auto, 5 millisec open/close
 
-        data = np.zeros(width // binning * height // binning, dtype='uint16')
+        framePool.configure(width, height, binning)
         logger.debug(
-            "SetHSSpeed: " + str(andor.SetHSSpeed(0, 1))
+            "SetHSSpeed: " + str(camera.apply('SetHSSpeed', 0, 1))
         )  # read time on real is fast because they aren't science images
+        logger.debug("Setup: " + str(camera.report()))
+        waiter.arm()
         logger.debug('StartAcquisition: ' + str(andor.StartAcquisition()))
 
         status = andor.GetStatus()
         logger.debug(str(status))
         workingImNum = 1
+        skipped = 0
         start = time.time()
         end = 0
         while status[1] == andor.DRV_ACQUIRING:
+            waiter.waitForFrame()  # sleeps until the next frame is read out or abort is called
 
             progress = andor.GetAcquisitionProgress()
             currImNum = progress[
                 2]  # won't update until an acquisition is done
             status = andor.GetStatus()
 
-            if status[1] == andor.DRV_ACQUIRING and currImNum == workingImNum:
+            if status[1] == andor.DRV_ACQUIRING and currImNum >= workingImNum:
+                if currImNum > workingImNum:  # fell behind: only the most recent frame is worth sending
+                    skipped += currImNum - workingImNum
+                    workingImNum = currImNum
                 logger.debug("Progress: " + str(andor.GetAcquisitionProgress()))
-                results = andor.GetMostRecentImage16(data)  # store image data
+                frame = framePool.lease('real', timeout=0)
+                if frame is None:  # the writers still have every buffer
+                    logger.warning("real time frame %d skipped, no free frame buffer" % workingImNum)
+                    skipped += 1
+                    workingImNum += 1
+                    continue
+                results = andor.GetMostRecentImage16(frame.data)  # store image data
                 logger.debug(
                     str(results) + 'success={}'.format(results == 20002)
                 )  # print if the results were successful
 
                 if results == andor.DRV_SUCCESS:  # if the array filled store successfully
-                    data = data.reshape(width // binning, height // binning)  # reshape into image
+                    data = frame.image
                     logger.debug(str(data.shape) + " " + str(data.dtype))
-                    hdu = fits.PrimaryHDU(data,
-                                          do_not_scale_image_data=True,
-                                          uint=True)
-                    # filename = time.strftime('/tmp/image_%Y%m%d_%H%M%S.fits')
-                    filename = fits_utils.get_image_path('real')
-                    hdu.writeto(filename, clobber=True)
-                    logger.debug("wrote: {}".format(filename))
-                    data = np.zeros(width // binning * height // binning,
-                                    dtype='uint16')
-
-                    protocol.sendData("realSent %s" % filename)
+                    streamed = frameStream.subscribers() > 0
+                    if streamed:
+                        frameStream.publish(workingImNum, time.time(), itime, imType, binning, data)
+
+                    filename = fits_utils.get_image_path('real') if save or not streamed else None
+                    notify = functools.partial(self.sendRealSent, protocol, workingImNum)
+                    writer.submit(fits_writer.WriteJob(data, filename, notify=notify, done=frame.release, stats=True,
+                                                       fast=True), policy='drop')
+
                     # print("Sending", "realSent%d" % (workingImNum))
                     workingImNum += 1
                     end = time.time()
                     logger.debug("Took %f seconds" % (end - start))
                     start = time.time()
+                else:
+                    frame.release()
 
+        writer.flush()  # every realSent goes out before the real reply
+        framePool.reclaim()
+        logger.info("real time: %d frames read, %d skipped" % (workingImNum - 1 - skipped, skipped))
         return "real 1"  # exits with 1 for success
 
+    def sendRealSent(self, protocol, number, filename, stats):
+        """
+        Called by the writer threads with the statistics of a real time frame, and its filename if it was saved.
+        """
+        name = str(number) if filename is None else filename
+        protocol.sendData("realSent %s,%s" % (name, stats_utils.format_record(stats)))
+
     def kseriesExposure(self,
                         protocol,
                         imType,
@@ -950,106 +1138,151 @@ class Evora(object):
                         binning=1,
                         numAccum=1,
                         accumCycleTime=0,
-                        kCycleTime=0):
+                        kCycleTime=0,
+                        compress=None):
         """
         This handles multiple image acquisition using the camera kinetic series capability.  The basic arguements are
         the passed in protocol, the image type, integration time, filter type, readout index, number of exposures, and binning type.
 
         In the future this function could be modified to include accumulations or add time the kinetic cycle time.  Accumulations
         are how many images should be readout as one, and kCycleTime can add time between each exposure that is taken.
+        compress names the file compression (see fits_writer.COMPRESSION_TYPES) and defaults to the configured one.
+
+        Each pass reads every new image from the camera's circular buffer (GetNumberNewImages/GetImages16), so images
+        are only lost if the buffer wraps before they are read.  The frame accounting of the run is left in the global
+        seriesReport.
         """
-        global isAborted
+        global isAborted, seriesReport
         isAborted = False
-        retval, width, height = andor.GetDetector()
+        camera.begin()
+        retval, width, height = camera.detector()
         logger.debug('GetDetector: ' + str(retval) + " " + str(width) + " " + str(height))
 
-        logger.debug("SetAcquisitionMode: " + str(andor.SetAcquisitionMode(3)))
-        logger.debug('SetReadMode: ' + str(andor.SetReadMode(4)))
+        logger.debug("SetAcquisitionMode: " + str(camera.apply('SetAcquisitionMode', 3)))
+        logger.debug('SetReadMode: ' + str(camera.apply('SetReadMode', 4)))
 
         logger.debug(
-            'SetImage: ' + str(andor.SetImage(binning, binning, 1, width, 1, height)))
-        logger.debug('GetDetector (again): ' + str(andor.GetDetector()))
+            'SetImage: ' + str(camera.apply('SetImage', binning, binning, 1, width, 1, height)))
 
         if imType == "bias":
             itime = 0
-            andor.SetShutter(
-                1, 2, 0, 0
-            )  # TLL mode high, shutter mode Permanently Closed, 0 millisec open/close
-            logger.debug('SetExposureTime: ' + str(andor.SetExposureTime(0)))
+            camera.apply('SetShutter', 1, 2, 0, 0)  # TLL mode high, shutter mode Permanently Closed, 0 millisec open/close
+            logger.debug('SetExposureTime: ' + str(camera.apply('SetExposureTime', 0)))
         else:
             if imType in ['flat', 'object']:
-                andor.SetShutter(1, 0, 5, 5)
+                camera.apply('SetShutter', 1, 0, 5, 5)
             else:
-                andor.SetShutter(1, 2, 0, 0)
+                camera.apply('SetShutter', 1, 2, 0, 0)
             logger.debug(
-                'SetExposureTime: ' + str(andor.SetExposureTime(itime))
+                'SetExposureTime: ' + str(camera.apply('SetExposureTime', itime))
             )  # TLL mode high, shutter mode Fully Auto, 5 millisec open/close
 
-        logger.debug("SetNumberOfAccumulations: " + str(andor.SetNumberAccumulations(numAccum)))  # number of exposures to be combined
-        logger.debug("SetAccumulationTime: " + str(andor.SetAccumulationCycleTime(accumCycleTime)))
-        logger.debug("SetNumberOfKinetics: " + str(andor.SetNumberKinetics(numexp)))  # this is the number of exposures the user wants
-        logger.debug('SetKineticTime: ' + str(andor.SetKineticCycleTime(accumCycleTime)))
-        logger.debug("SetTriggerMode: " + str(andor.SetTriggerMode(0)))
+        logger.debug("SetNumberOfAccumulations: " + str(camera.apply('SetNumberAccumulations', numAccum)))  # number of exposures to be combined
+        logger.debug("SetAccumulationTime: " + str(camera.apply('SetAccumulationCycleTime', accumCycleTime)))
+        logger.debug("SetNumberOfKinetics: " + str(camera.apply('SetNumberKinetics', numexp)))  # this is the number of exposures the user wants
+        logger.debug('SetKineticTime: ' + str(camera.apply('SetKineticCycleTime', accumCycleTime)))
+        logger.debug("SetTriggerMode: " + str(camera.apply('SetTriggerMode', 0)))
         logger.debug("Timings: " + str(andor.GetAcquisitionTimings()))
-        logger.debug("SetHSSpeed: " + str(andor.SetHSSpeed(0, readTime)))  # default readTime is index 3 which is 0.5 MHz or ~6 sec
+        logger.debug("SetHSSpeed: " + str(camera.apply('SetHSSpeed', 0, readTime)))  # default readTime is index 3 which is 0.5 MHz or ~6 sec
+        logger.debug("Setup: " + str(camera.report()))
 
-        # write headers
         attributes = [imType, binning, itime, filter]
-        # header = self.getHeader(attributes)
-        header = self.getHeader_2(attributes, 'heimdall')
+        compress = self.getCompression(compress)
+        headers = headerFactory.session(attributes, 'heimdall')  # static cards are built once for the series
+        framePool.configure(width, height, binning)
 
+        waiter.arm()
+        writer.resetStats()
         logger.debug('StartAcquisition: ' + str(andor.StartAcquisition()))
+        seriesStart = time.time()
+        cycleTime = andor.GetAcquisitionTimings()[3]
+        headersAhead = {1: headers.prepare(time.gmtime(seriesStart))}  # built while the image integrates
 
         status = andor.GetStatus()
         logger.debug(str(status))
 
-        imageAcquired = False
-
-        counter = 1
-        while status[1] == andor.DRV_ACQUIRING:
-            status = andor.GetStatus()
-            progress = andor.GetAcquisitionProgress()
-
-            runtime = 0
-            if progress[2] == counter or (not isAborted and progress[2] == 0 and imageAcquired):
-                runtime -= time.clock()
-                data = np.zeros(width // binning * height // binning,
-                                dtype='uint16')  # reserve room for image
-                results = andor.GetMostRecentImage16(data)  # store image data
-                logger.debug(
-                    str(results) + " " + 'success={}'.format(results == 20002)
-                )  # print if the results were successful
-                logger.debug('image number: ' + str(progress[2]))
-
-                if results == andor.DRV_SUCCESS:  # if the array filled store successfully
-                    data = data.reshape(width // binning, height // binning)  # reshape into image
-                    logger.debug(str(data.shape) + " " + str(data.dtype))
-
-                    hdu = fits.PrimaryHDU(data,
-                                          do_not_scale_image_data=True,
-                                          uint=True,
-                                          header=header)
-                    # filename = time.strftime('/data/forTCC/image_%Y%m%d_%H%M%S.fits')
-                    filename = fits_utils.get_image_path('series')
-                    hdu.writeto(filename, clobber=True)
-
-                    logger.debug("wrote: {}".format(filename))
+        counter = 1  # number of the next image to hand to the writers, as sent in seriesSent
+        nextImage = 1  # index of the next image to read from the camera's circular buffer
+        lost = 0
+        while True:
+            if status[1] == andor.DRV_ACQUIRING:
+                waiter.waitForFrame()  # sleeps until the next frame is read out or abort is called
+            status = andor.GetStatus()  # read before draining so the last pass gets every image
+
+            # drain every image read out since the last pass, not just the most recent one
+            result, first, last = andor.GetNumberNewImages()
+            if result == andor.DRV_SUCCESS and last >= nextImage:
+                if first > nextImage:
+                    logger.warning("images %d-%d were overwritten before they were read" % (nextImage, first - 1))
+                    lost += first - nextImage
+                    nextImage = first
+
+                runtime = 0 - time.clock()
+                while nextImage <= last:
+                    frames = framePool.leaseRun(last - nextImage + 1, 'series', timeout=0.1)
+                    while not frames and not waiter.isAborted():  # the writers hold every buffer
+                        executor.service()  # an abort still runs while we wait for them
+                        frames = framePool.leaseRun(last - nextImage + 1, 'series', timeout=0.1)
+                    if not frames:
+                        logger.warning("aborted before images %d-%d were read" % (nextImage, last))
+                        lost += last - nextImage + 1
+                        nextImage = last + 1
+                        break
+                    stop = nextImage + len(frames) - 1
+                    result, validFirst, validLast = andor.GetImages16(nextImage, stop, frame_pool.contiguous(frames))
+                    logger.debug('images %d-%d: %s' % (nextImage, stop, result))
+                    if result != andor.DRV_SUCCESS:
+                        logger.warning("could not read images %d-%d: %s" % (nextImage, stop, result))
+                        lost += len(frames)
+                        for frame in frames:
+                            frame.release()
+                        nextImage = stop + 1
+                        continue
+
+                    # hand the frames to the writer threads; they build the header, write and tell the clients
+                    for frame in frames:
+                        header = headersAhead.pop(nextImage, None)
+                        if header is None:
+                            header = headers.prepare(time.gmtime(seriesStart + (nextImage - 1) * cycleTime))
+                        filename = fits_writer.outputName(fits_utils.get_image_path('series'), compress)
+                        notify = functools.partial(self.sendSeriesSent, protocol, counter, itime)
+                        writer.submit(fits_writer.WriteJob(frame.image, filename, headerFunc=header.get, notify=notify,
+                                                           done=frame.release, compress=compress, stats=True))
+                        counter += 1
+                        nextImage += 1
+                runtime += time.clock()
+                logger.debug("Took %f seconds to hand off." % runtime)
 
-                    protocol.sendData("seriesSent" + str(counter) + " " + str(counter) + "," + str(itime) + "," + filename)
-                    # make a new header and write time to it for new exposure.
-                    # header = self.getHeader(attributes)
-                    header = self.getHeader_2(attributes, 'heimdall')
+                if nextImage <= numexp and nextImage not in headersAhead:
+                    headersAhead[nextImage] = headers.prepare(
+                        time.gmtime(seriesStart + (nextImage - 1) * cycleTime))  # the next exposure is underway
 
-                    if counter == numexp:
-                        logger.info("entered abort")
-                        isAborted = True
+            if status[1] != andor.DRV_ACQUIRING:
+                break
 
-                    imageAcquired = True
-                    counter += 1
-                runtime += time.clock()
-                logger.debug("Took %f seconds to write." % runtime)
+        writer.flush()  # every seriesSent goes out before the series reply
+        framePool.reclaim()
+        logger.debug("Writer stats: " + str(writer.stats()))
+        logger.debug("Frame pool stats: " + str(framePool.stats()))
+        logger.debug("Header stats: " + str(headerFactory.stats()))
+
+        writerStats = writer.stats()  # counted since the series started
+        seriesReport = {'requested': numexp,
+                        'acquired': nextImage - 1,
+                        'saved': writerStats['written'],
+                        'lost': lost,
+                        'dropped': writerStats['dropped']}
+        logger.info("Series: " + str(seriesReport))
         return "series 1," + str(counter)  # exits with 1 for success
 
+    def sendSeriesSent(self, protocol, number, itime, filename, stats=None):
+        """
+        Called by the writer threads once a series image is on disk to tell the clients about it, with the statistics
+        record the writer computed when there is one.
+        """
+        record = "," + stats_utils.format_record(stats) if stats is not None else ""
+        protocol.sendData("seriesSent" + str(number) + " " + str(number) + "," + str(itime) + "," + filename + record)
+
     # deprecated to kseriesExposure
     """
     def seriesExposure(self, protocol, imType, itime, numexp=1, binning=1):
@@ -1171,7 +1404,8 @@ class FilterThread(threading.Thread):
 
 
 def kill(sig, frame):
-    os.killpg(os.getpgid(ftp_server.pid), signal.SIGKILL)
+    os.killpg(os.getpgid(file_server.pid), signal.SIGKILL)
+    writer.close(timeout=10)  # os._exit would leave the compression processes behind
     reactor.stop()
     os._exit(1)
     # sys.exit(1)
@@ -1179,9 +1413,6 @@ def kill(sig, frame):
 
 if __name__ == "__main__":
     filter_server = None
-    # parse config
-    parser = ConfigParser()
-    parser.read(config_path)
     try:
         # sys.stdout = Logger(sys.stdout)
         # sys.stderr = Logger(sys.stderr)
@@ -1191,13 +1422,17 @@ if __name__ == "__main__":
 
         signal.signal(signal.SIGINT, kill)
 
-        reactor.suggestThreadPoolSize(30)
-        reactor.listenTCP(netconsts.CAMERA_PORT, EvoraClient())
+        writer.startProcesses()  # fork the compression workers before any threads exist
+        reactor.listenTCP(netconsts.CAMERA_PORT, EvoraClient(hub))
+        reactor.listenTCP(netconsts.FRAME_STREAM_PORT, frameStream)
+        executor.start()
+        sampler.start(publish=lambda line: hub.broadcast(messages.Outgoing(line)))
 
-        ftp_server_path = os.path.join(os.path.dirname(__file__), "ftp_server.py")
-        ftp_server = subprocess.Popen(ftp_server_path,
-                                      shell=True,
-                                      preexec_fn=os.setsid)
+        # images are served over HTTP by file_server.py; ftp_server.py is no longer started
+        file_server_path = os.path.join(os.path.dirname(__file__), "file_server.py")
+        file_server = subprocess.Popen(file_server_path,
+                                       shell=True,
+                                       preexec_fn=os.setsid)
 
         # Once the camera server starts start the ftp server
         # ftp_server = FTPThread()
@@ -1209,14 +1444,14 @@ if __name__ == "__main__":
         # filter_server.start()
         # print("Server ready.")
 
-        # Wait 0.5 seconds for ftp_server to start or quit
+        # Wait 0.5 seconds for file_server to start or quit
         time.sleep(0.5)
 
-        # Make sure ftp_server is actually running
-        if ftp_server.poll() is None:
+        # Make sure file_server is actually running
+        if file_server.poll() is None:
             reactor.run()
         else:
-            print("[server.py] FTP server has exited. Quitting...")
+            print("[server.py] File server has exited. Quitting...")
             quit()
 
     except KeyboardInterrupt:
@@ -1224,4 +1459,5 @@ if __name__ == "__main__":
         # filter_server.on = False
         # filter_server.stop()
         # sys.exit(0)
+        writer.close(timeout=10)
         print("Hello")
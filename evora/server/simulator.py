@@ -0,0 +1,351 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+import numpy as np
+
+"""
+A timing-accurate stand-in for the SWIG "andor" module.
+
+Unlike evora.server.dummy, which only returns canned values, this keeps the camera state that the server relies on
+(acquisition mode, exposure and kinetic cycle times, acquisition status, completed frames) and advances it with the
+wall clock.  It follows the same SWIG conventions as the real driver: pointer arguments are returned as a list after
+the status code, e.g. GetDetector() -> [DRV_SUCCESS, width, height].
+
+It is used by the benchmarks and tests to exercise the server acquisition paths without hardware.
+"""
+
+# Andor SDK return codes (see include/atmcdLXd.h)
+DRV_SUCCESS = 20002
+DRV_NO_NEW_DATA = 20024
+DRV_TEMPERATURE_OFF = 20034
+DRV_TEMPERATURE_NOT_STABILIZED = 20035
+DRV_TEMPERATURE_STABILIZED = 20036
+DRV_TEMPERATURE_NOT_REACHED = 20037
+DRV_P1INVALID = 20066
+DRV_P2INVALID = 20067
+DRV_P3INVALID = 20068
+DRV_ACQUIRING = 20072
+DRV_IDLE = 20073
+DRV_NOT_INITIALIZED = 20075
+
+
+class AndorSimulator(object):
+    """
+    Simulated iKon camera.  Instances are used in place of the andor module, so every SDK function is a method with
+    the SWIG signature.
+    """
+    DRV_SUCCESS = DRV_SUCCESS
+    DRV_NO_NEW_DATA = DRV_NO_NEW_DATA
+    DRV_TEMPERATURE_OFF = DRV_TEMPERATURE_OFF
+    DRV_TEMPERATURE_STABILIZED = DRV_TEMPERATURE_STABILIZED
+    DRV_ACQUIRING = DRV_ACQUIRING
+    DRV_IDLE = DRV_IDLE
+
+    def __init__(self, width=2048, height=2048, readoutTime=0.5, seed=0, setupLatency=0.0, bufferImages=16):
+        self.width = width
+        self.height = height
+        self.readoutTime = readoutTime  # seconds to clock out one frame
+        self.setupLatency = setupLatency  # seconds each setup call (GetDetector, Set...) spends in the driver
+        self.bufferImages = bufferImages  # images the circular buffer holds before the oldest is overwritten
+
+        self.calls = {}  # SDK function name -> number of calls
+
+        self._lock = threading.Condition()
+        self._binning = 1
+        self._acquisitionMode = 1
+        self._exposureTime = 0.0
+        self._kineticCycleTime = 0.0
+        self._numberKinetics = 1
+
+        self._startTime = None
+        self._stopTime = None  # set by AbortAcquisition
+        self._framesWaited = 0  # frames already reported by WaitForAcquisition
+        self._cancelled = False
+        self._retrieved = 0  # last image index handed out by GetImages16
+
+        self._temperature = 20.0
+        self._setPoint = 0
+        self._coolerOn = False
+
+        rng = np.random.RandomState(seed)
+        self._sky = rng.poisson(1000, size=width * height).astype(np.uint16)
+
+    # Helpers
+    def _record(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def _setup(self, name):
+        self._record(name)
+        if self.setupLatency:
+            time.sleep(self.setupLatency)
+
+    def _cycleTime(self):
+        return max(self._exposureTime + self.readoutTime, self._kineticCycleTime, 1e-3)
+
+    def _totalFrames(self):
+        if self._acquisitionMode == 5:  # run till abort
+            return None
+        if self._acquisitionMode == 3:  # kinetic series
+            return self._numberKinetics
+        return 1
+
+    def _framesCompleted(self, now=None):
+        """
+        Number of frames fully read out since StartAcquisition.
+        """
+        if self._startTime is None:
+            return 0
+        if now is None:
+            now = time.time()
+        if self._stopTime is not None:
+            now = min(now, self._stopTime)
+        done = int((now - self._startTime) / self._cycleTime())
+        total = self._totalFrames()
+        if total is not None:
+            done = min(done, total)
+        return done
+
+    def _acquiring(self, now=None):
+        if self._startTime is None or self._stopTime is not None:
+            return False
+        total = self._totalFrames()
+        return total is None or self._framesCompleted(now) < total
+
+    def _nextFrameTime(self):
+        return self._startTime + (self._framesCompleted() + 1) * self._cycleTime()
+
+    def _fill(self, arr, frameNumber):
+        """
+        Writes a frame into arr.  The first pixel carries the 1-based frame number so callers can check ordering.
+        """
+        arr[:] = self._sky[:arr.size]
+        arr[0] = frameNumber & 0xffff
+
+    def frameSize(self):
+        return (self.width // self._binning) * (self.height // self._binning)
+
+    # Status
+    def GetStatus(self):
+        self._record("GetStatus")
+        with self._lock:
+            return [DRV_SUCCESS, DRV_ACQUIRING if self._acquiring() else DRV_IDLE]
+
+    def GetDetector(self):
+        self._setup("GetDetector")
+        return [DRV_SUCCESS, self.width, self.height]
+
+    def GetAcquisitionTimings(self):
+        self._record("GetAcquisitionTimings")
+        return [DRV_SUCCESS, self._exposureTime, self._exposureTime, self._cycleTime()]
+
+    def GetAcquisitionProgress(self):
+        self._record("GetAcquisitionProgress")
+        with self._lock:
+            return [DRV_SUCCESS, 0, self._framesCompleted()]
+
+    def GetTotalNumberImagesAcquired(self):
+        self._record("GetTotalNumberImagesAcquired")
+        with self._lock:
+            return [DRV_SUCCESS, self._framesCompleted()]
+
+    # Temperature
+    def GetTemperatureF(self):
+        self._record("GetTemperatureF")
+        if not self._coolerOn:
+            return [DRV_TEMPERATURE_OFF, self._temperature]
+        return [DRV_TEMPERATURE_STABILIZED, self._temperature]
+
+    def GetTemperatureStatus(self):
+        self._record("GetTemperatureStatus")
+        return [DRV_SUCCESS, self._temperature, float(self._setPoint), 20.0, 0.0]
+
+    def GetTemperatureRange(self):
+        self._record("GetTemperatureRange")
+        return [DRV_SUCCESS, -120, 10]
+
+    def SetTemperature(self, temperature):
+        self._record("SetTemperature")
+        self._setPoint = temperature
+        return DRV_SUCCESS
+
+    def CoolerON(self):
+        self._record("CoolerON")
+        self._coolerOn = True
+        return DRV_SUCCESS
+
+    def CoolerOFF(self):
+        self._record("CoolerOFF")
+        self._coolerOn = False
+        return DRV_SUCCESS
+
+    def SetFanMode(self, mode):
+        self._record("SetFanMode")
+        return DRV_SUCCESS
+
+    # Acquisition setup
+    def SetAcquisitionMode(self, mode):
+        self._setup("SetAcquisitionMode")
+        self._acquisitionMode = mode
+        return DRV_SUCCESS
+
+    def SetReadMode(self, mode):
+        self._setup("SetReadMode")
+        return DRV_SUCCESS
+
+    def SetImage(self, hbin, vbin, hstart, hend, vstart, vend):
+        self._setup("SetImage")
+        self._binning = hbin
+        return DRV_SUCCESS
+
+    def SetShutter(self, typ, mode, closingTime, openingTime):
+        self._setup("SetShutter")
+        return DRV_SUCCESS
+
+    def SetExposureTime(self, exposureTime):
+        self._setup("SetExposureTime")
+        self._exposureTime = float(exposureTime)
+        return DRV_SUCCESS
+
+    def SetKineticCycleTime(self, cycleTime):
+        self._setup("SetKineticCycleTime")
+        self._kineticCycleTime = float(cycleTime)
+        return DRV_SUCCESS
+
+    def SetNumberKinetics(self, number):
+        self._setup("SetNumberKinetics")
+        self._numberKinetics = number
+        return DRV_SUCCESS
+
+    def SetNumberAccumulations(self, number):
+        self._setup("SetNumberAccumulations")
+        return DRV_SUCCESS
+
+    def SetAccumulationCycleTime(self, cycleTime):
+        self._setup("SetAccumulationCycleTime")
+        return DRV_SUCCESS
+
+    def SetTriggerMode(self, mode):
+        self._setup("SetTriggerMode")
+        return DRV_SUCCESS
+
+    def SetHSSpeed(self, typ, index):
+        self._setup("SetHSSpeed")
+        return DRV_SUCCESS
+
+    # Acquisition control
+    def StartAcquisition(self):
+        self._record("StartAcquisition")
+        with self._lock:
+            if self._acquiring():
+                return DRV_ACQUIRING
+            self._startTime = time.time()
+            self._stopTime = None
+            self._framesWaited = 0
+            self._cancelled = False
+            self._retrieved = 0
+            self._lock.notify_all()
+        return DRV_SUCCESS
+
+    def AbortAcquisition(self):
+        self._record("AbortAcquisition")
+        with self._lock:
+            if not self._acquiring():
+                return DRV_IDLE
+            self._stopTime = time.time()
+            self._lock.notify_all()
+        return DRV_SUCCESS
+
+    def WaitForAcquisitionTimeOut(self, timeoutMs):
+        """
+        Sleeps until a frame completes, CancelWait is called, or the timeout passes.  Like the SDK the event is
+        sticky: frames that completed while nobody was waiting return immediately.
+        """
+        self._record("WaitForAcquisitionTimeOut")
+        deadline = time.time() + timeoutMs / 1000.0
+        with self._lock:
+            while True:
+                if self._cancelled:
+                    self._cancelled = False
+                    return DRV_NO_NEW_DATA
+                completed = self._framesCompleted()
+                if completed > self._framesWaited:
+                    self._framesWaited = completed
+                    return DRV_SUCCESS
+                now = time.time()
+                if now >= deadline or not self._acquiring(now):
+                    return DRV_NO_NEW_DATA
+                self._lock.wait(min(deadline, self._nextFrameTime()) - now)
+
+    def WaitForAcquisition(self):
+        self._record("WaitForAcquisition")
+        while True:
+            result = self.WaitForAcquisitionTimeOut(1000)
+            if result == DRV_SUCCESS or not self._acquiring():
+                return result
+
+    def CancelWait(self):
+        self._record("CancelWait")
+        with self._lock:
+            self._cancelled = True
+            self._lock.notify_all()
+        return DRV_SUCCESS
+
+    # Data retrieval
+    def GetAcquiredData16(self, arr):
+        self._record("GetAcquiredData16")
+        with self._lock:
+            completed = self._framesCompleted()
+            if self._acquiring() or completed == 0:
+                return DRV_ACQUIRING if self._acquiring() else DRV_NO_NEW_DATA
+        self._fill(arr, completed)
+        return DRV_SUCCESS
+
+    def GetMostRecentImage16(self, arr):
+        self._record("GetMostRecentImage16")
+        with self._lock:
+            completed = self._framesCompleted()
+        if completed == 0:
+            return DRV_NO_NEW_DATA
+        self._fill(arr, completed)
+        return DRV_SUCCESS
+
+    def GetSizeOfCircularBuffer(self):
+        self._record("GetSizeOfCircularBuffer")
+        return [DRV_SUCCESS, self.bufferImages]
+
+    def GetNumberNewImages(self):
+        """
+        Returns [result, first, last], the 1-based indexes of the images not yet retrieved that are still in the
+        circular buffer.  Images overwritten before they were retrieved are skipped, as on the camera.
+        """
+        self._record("GetNumberNewImages")
+        with self._lock:
+            completed = self._framesCompleted()
+            first = max(self._retrieved + 1, completed - self.bufferImages + 1, 1)
+        if first > completed:
+            return [DRV_NO_NEW_DATA, 0, 0]
+        return [DRV_SUCCESS, first, completed]
+
+    def GetImages16(self, first, last, arr):
+        """
+        Copies images first..last from the circular buffer into arr, one after the other.  Returns
+        [result, validfirst, validlast].
+        """
+        self._record("GetImages16")
+        with self._lock:
+            completed = self._framesCompleted()
+            oldest = max(completed - self.bufferImages + 1, 1)
+            if first < oldest or first > completed:
+                return [DRV_P1INVALID, 0, 0]
+            if last < first or last > completed:
+                return [DRV_P2INVALID, 0, 0]
+            size = self.frameSize()
+            if arr.size != (last - first + 1) * size:
+                return [DRV_P3INVALID, 0, 0]
+            self._retrieved = max(self._retrieved, last)
+        for i in range(last - first + 1):
+            self._fill(arr[i * size:(i + 1) * size], first + i)
+        return [DRV_SUCCESS, first, last]
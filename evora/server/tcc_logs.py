@@ -0,0 +1,334 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import bisect
+import calendar
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from evora.common.logging import my_logger
+
+"""
+Telescope position lookups for the FITS headers.
+
+Heimdall's TCC writes one position log per UT day to positionlogs/<year><month><day>.txt (no zero padding), one line
+per sample:
+
+    20200722T04:15:01 <ra> <dec> <epoch> <lst> <za>
+
+PositionLogStore keeps an index per log file that is parsed once and then followed as lines are appended.  Sample
+times are held in a sorted NumPy array so the last sample at or before the exposure start is found with a binary
+search instead of re-reading the whole day's log for every frame.
+
+The gtcc TCC instead starts a new log whenever it restarts, named by its UT creation time (e.g. 2016-07-22T03:12:45),
+on a network mount.  Each line is
+
+    <UT date&time> <ra> <dec> <epoch> <lst> <hour angle> <zenith angle> fslide:<position>
+
+GtccLogStore caches the directory listing until the directory mtime changes and keeps a sorted table of log start
+times, and for each log a byte offset and time per line, so the closest line is one bisect and one seek.
+"""
+
+logger = my_logger.myLogger("tcc_logs.py", "server")
+
+HEIMDALL_LOG_DIR = "/home/mro/storage/tcc_data/positionlogs"
+GTCC_LOG_DIR = "/home/mro/mnt/gtcc"
+GTCC_LOG_NAME = re.compile(r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$")
+GTCC_MAX_LOG_AGE = 1800  # seconds; an older log is not trusted for the current exposure
+
+
+def heimdallLogName(obsTime):
+    """
+    Pre: obsTime is a UT time.struct_time.
+    Post: Returns the file name of the heimdall position log for that UT day.
+    """
+    return str(obsTime.tm_year) + str(obsTime.tm_mon) + str(obsTime.tm_mday) + ".txt"
+
+
+def parseHeimdallTimes(stamps):
+    """
+    Converts a list of "%Y%m%dT%H:%M:%S" strings to UT seconds since the epoch in one vectorized step.
+    """
+    iso = [s[0:4] + "-" + s[4:6] + "-" + s[6:8] + s[8:] for s in stamps]
+    return np.array(iso, dtype='datetime64[s]').astype(np.int64).astype(np.float64)
+
+
+class PositionLogIndex(object):
+    """
+    Index of one position log.  refresh() reads only the bytes appended since the last call; a line that is still
+    being written (no trailing newline) is held back until it is complete.
+    """
+    COLUMNS = 5  # ra, dec, epoch, lst, za
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._times = np.empty(0, dtype=np.float64)
+        self._values = np.empty((0, self.COLUMNS), dtype=np.float64)
+        self._offset = 0  # bytes of the file already indexed
+        self._inode = None
+
+    def _reset(self):
+        self.count = 0
+        self._offset = 0
+
+    def _append(self, times, values):
+        needed = self.count + len(times)
+        if needed > len(self._times):
+            capacity = max(needed, 2 * len(self._times), 1024)
+            grownTimes = np.empty(capacity, dtype=np.float64)
+            grownValues = np.empty((capacity, self.COLUMNS), dtype=np.float64)
+            grownTimes[:self.count] = self._times[:self.count]
+            grownValues[:self.count] = self._values[:self.count]
+            self._times, self._values = grownTimes, grownValues
+
+        self._times[self.count:needed] = times
+        self._values[self.count:needed] = values
+        outOfOrder = self.count > 0 and len(times) > 0 and times[0] < self._times[self.count - 1]
+        self.count = needed
+        if outOfOrder or np.any(np.diff(times) < 0):
+            order = np.argsort(self._times[:self.count], kind='mergesort')
+            self._times[:self.count] = self._times[:self.count][order]
+            self._values[:self.count] = self._values[:self.count][order]
+
+    def refresh(self):
+        """
+        Indexes any lines appended since the last refresh.  Returns the number of new samples.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return 0
+        if st.st_ino != self._inode or st.st_size < self._offset:  # replaced or truncated, start over
+            self._inode = st.st_ino
+            self._reset()
+        if st.st_size == self._offset:
+            return 0
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read(st.st_size - self._offset)
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return 0  # only a partial line so far
+        self._offset += end
+
+        stamps = []
+        rows = []
+        for line in chunk[:end].decode('ascii', 'replace').splitlines():
+            fields = line.split()
+            if len(fields) < self.COLUMNS + 1:
+                continue
+            try:
+                rows.append([float(v) for v in fields[1:self.COLUMNS + 1]])
+            except ValueError:
+                continue
+            stamps.append(fields[0])
+        if not stamps:
+            return 0
+
+        try:
+            times = parseHeimdallTimes(stamps)
+        except ValueError:
+            logger.warning("bad time stamp in " + self.path)
+            return 0
+        self._append(times, np.array(rows, dtype=np.float64))
+        return len(stamps)
+
+    def lookup(self, t):
+        """
+        Pre: t is UT seconds since the epoch.
+        Post: Returns (ra, dec, epoch, lst, ha, za) of the last sample at or before t, or None if there is none.
+        """
+        idx = np.searchsorted(self._times[:self.count], t, side='right') - 1
+        if idx < 0:
+            return None
+        ra, dec, epoch, lst, za = self._values[idx]
+        return (ra, dec, epoch, lst, lst - ra, za)
+
+
+class PositionLogStore(object):
+    """
+    Serves position lookups for any exposure time, opening and following the log of the right UT day.  Safe to
+    share between the writer threads.
+    """
+    def __init__(self, directory=HEIMDALL_LOG_DIR, keep=2):
+        self.directory = directory
+        self.keep = keep  # number of daily indexes kept in memory
+        self._indexes = {}
+        self._order = []
+        self._lock = threading.Lock()
+
+    def _index(self, name):
+        index = self._indexes.get(name)
+        if index is None:
+            index = self._indexes[name] = PositionLogIndex(os.path.join(self.directory, name))
+            self._order.append(name)
+            while len(self._order) > self.keep:
+                del self._indexes[self._order.pop(0)]
+        return index
+
+    def lookup(self, obsTime):
+        """
+        Pre: obsTime is the UT time.struct_time of the exposure start.
+        Post: Returns (ra, dec, epoch, lst, ha, za) or None when there is no log or no earlier sample.
+        """
+        name = heimdallLogName(obsTime)
+        if not os.path.isfile(os.path.join(self.directory, name)):
+            return None
+        with self._lock:
+            index = self._index(name)
+            index.refresh()
+            return index.lookup(calendar.timegm(obsTime))
+
+
+class LineIndex(object):
+    """
+    Byte offset and UT time of every line of a gtcc log.  Growth of the file is indexed incrementally; the last,
+    possibly partial, line is only indexed once its newline has been written.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.times = []
+        self.offsets = []
+        self._offset = 0
+        self._inode = None
+
+    def refresh(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return
+        if st.st_ino != self._inode or st.st_size < self._offset:  # replaced or truncated, start over
+            self._inode = st.st_ino
+            self.times = []
+            self.offsets = []
+            self._offset = 0
+        if st.st_size == self._offset:
+            return
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            chunk = f.read(st.st_size - self._offset)
+
+        offsets = []
+        stamps = []
+        position = 0
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines(True):
+            stamp = line.split(None, 1)[0] if line.strip() else b""
+            if len(stamp) == 19:
+                offsets.append(self._offset + position)
+                stamps.append(stamp.decode('ascii'))
+            position += len(line)
+        self._offset += end
+
+        if stamps:
+            try:
+                times = np.array(stamps, dtype='datetime64[s]').astype(np.int64).tolist()
+            except ValueError:
+                logger.warning("bad time stamp in " + self.path)
+                return
+            self.times.extend(times)
+            self.offsets.extend(offsets)
+
+    def closest(self, t):
+        """
+        Returns the byte offset of the line closest in time to t, or None for an empty log.
+        """
+        if not self.times:
+            return None
+        i = bisect.bisect_left(self.times, t)
+        if i == len(self.times) or (i > 0 and t - self.times[i - 1] < self.times[i] - t):
+            i -= 1
+        return self.offsets[i]
+
+
+class GtccLogStore(object):
+    """
+    Chooses and reads gtcc logs for an exposure time.  Safe to share between the writer threads.
+    """
+    def __init__(self, directory=GTCC_LOG_DIR, keep=4):
+        self.directory = directory
+        self.keep = keep  # number of line indexes kept in memory
+
+        self._mtime = None
+        self._epochs = {}  # log name -> UT start time, kept across listings so names are parsed once
+        self._names = []  # sorted by start time
+        self._starts = []
+
+        self._indexes = {}
+        self._order = []
+        self._lock = threading.Lock()
+
+    def _refreshListing(self):
+        try:
+            mtime = os.stat(self.directory).st_mtime
+        except OSError:
+            self._names, self._starts = [], []
+            return
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+
+        epochs = {}
+        for name in os.listdir(self.directory):
+            if not GTCC_LOG_NAME.match(name):
+                continue
+            epoch = self._epochs.get(name)
+            if epoch is None:
+                epoch = calendar.timegm(time.strptime(name, "%Y-%m-%dT%H:%M:%S"))
+            epochs[name] = epoch
+        self._epochs = epochs
+
+        ordered = sorted(epochs.items(), key=lambda item: item[1])
+        self._names = [entry[0] for entry in ordered]
+        self._starts = [entry[1] for entry in ordered]
+
+    def chooseLogfile(self, obsTime):
+        """
+        Pre: obsTime is the UT time.struct_time of the exposure start.
+        Post: Returns the path of the last log started before obsTime, or None if there is none within
+        GTCC_MAX_LOG_AGE seconds.
+        """
+        t = calendar.timegm(obsTime)
+        with self._lock:
+            self._refreshListing()
+            i = bisect.bisect_left(self._starts, t) - 1
+            if i < 0 or t - self._starts[i] >= GTCC_MAX_LOG_AGE:
+                return None
+            return os.path.join(self.directory, self._names[i])
+
+    def parseLogfile(self, path, obsTime):
+        """
+        Pre: path is a gtcc log, obsTime the UT time.struct_time of the exposure start.
+        Post: Returns the (ra, dec, epoch, lst, ha, za) strings of the line closest to obsTime, or None.
+        """
+        with self._lock:
+            index = self._indexes.get(path)
+            if index is None:
+                index = self._indexes[path] = LineIndex(path)
+                self._order.append(path)
+                while len(self._order) > self.keep:
+                    del self._indexes[self._order.pop(0)]
+            index.refresh()
+            offset = index.closest(calendar.timegm(obsTime))
+        if offset is None:
+            return None
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.readline().decode('ascii', 'replace').split()
+        if len(data) < 7:
+            return None
+        return data[1], data[2], data[3], data[4], data[5], data[6]
+
+    def lookup(self, obsTime):
+        path = self.chooseLogfile(obsTime)
+        if path is None:
+            return None
+        return self.parseLogfile(path, obsTime)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python2
+from __future__ import absolute_import, division, print_function
+
+import threading
+import time
+
+import numpy as np
+
+from evora.common.logging import my_logger
+
+"""
+One sampler of the camera's cooler and status for every client.
+
+Each GUI used to ask for "temp" every ten seconds, and every request became a parser on a worker thread calling the
+driver, in the middle of a readout or not.  TelemetrySampler reads GetStatus, GetTemperatureF and
+GetTemperatureStatus on its own thread every interval seconds and keeps the latest snapshot; "temp", "getTEC" and
+"status" are answered from it.  A query finding the snapshot older than maxAge (e.g. before the thread has started,
+or after invalidate()) reads the driver itself, and queries arriving while that read is under way wait for it rather
+than each making their own.  The reads are made through call, on the thread that owns the driver (see hardware).
+
+When a sample differs from the last one the sampler calls publish() with a "telemetry" line, and a client that
+connects is sent the same fields as its "status" line (see snapshotLine()), so it has the whole state in one message:
+    status <result>,<status>,<TEC mode>,<result>,<temperature>,<target>,<ambient>,<cooler volts>
+The first two fields are the GetStatus reply as before, the rest those of the "temp" reply.
+
+Every sample is also kept in a TelemetryHistory, a fixed size ring of arrays, so the server can answer
+    history <series> <from> <to> <maxpoints>
+with a night's cooldown curve in one line (see TelemetryHistory.query and historyLine()).
+"""
+
+logger = my_logger.myLogger("telemetry.py", "server")
+
+QUERIES = ('temp', 'getTEC', 'status')  # the commands answered from the snapshot
+MAX_POINTS = 1000  # most points in a history reply, which has to fit in a line
+
+
+class TelemetrySampler(object):
+    """
+    Caches the telemetry of one camera.  driver is the andor module; interval is the sampling period and maxAge the
+    oldest snapshot a query is answered from, in seconds.  call(f) runs f where the driver may be used, by default in
+    the calling thread.  Samples are recorded in history, a TelemetryHistory, if given.
+    """
+    def __init__(self, driver, interval=2.0, maxAge=5.0, call=None, history=None):
+        self.driver = driver
+        self.interval = interval
+        self.maxAge = maxAge
+        self.call = call
+        self.history = history
+        self.publish = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._sampled = threading.Condition(self._lock)
+        self._sampling = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.samples = 0
+        self.hits = 0
+        self.waits = 0
+        self.pushed = 0
+
+    def start(self, publish=None):
+        """
+        Starts the sampling thread.  publish, if given, is called from it with each changed "telemetry" line.
+        """
+        self.publish = publish
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="TelemetrySampler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def invalidate(self):
+        """
+        Makes the next query read the driver, e.g. after a command that changes the cooler or the camera state.
+        """
+        with self._lock:
+            if self._snapshot is not None:
+                self._snapshot = dict(self._snapshot, time=0)  # stale, but still the latest()
+
+    def get(self, force=False):
+        """
+        Returns the latest snapshot, a dict of the 'time' it was taken and the 'status', 'tec' (GetTemperatureF)
+        and 'temperature' (GetTemperatureStatus) replies, reading the driver if it is older than maxAge or force is
+        True.
+        """
+        if not force:
+            with self._lock:
+                if self._fresh():
+                    self.hits += 1
+                    return self._snapshot
+        if self.call is None:
+            return self._read(force)
+        return self.call(self._read, force)
+
+    def latest(self):
+        """
+        Returns the last snapshot however old, or None before the first, without reading the driver.
+        """
+        with self._lock:
+            return self._snapshot
+
+    def current(self):
+        """
+        Returns the latest snapshot if it is at most maxAge old, or else None, without reading the driver.  Safe to
+        call from the reactor thread.
+        """
+        with self._lock:
+            if not self._fresh():
+                return None
+            self.hits += 1
+            return self._snapshot
+
+    def temperature(self):
+        """
+        Returns the CCD temperature of the latest() snapshot, or None before the first.
+        """
+        snapshot = self.latest()
+        return None if snapshot is None else snapshot['temperature'][1]
+
+    def fresh(self):
+        """
+        Whether get() would answer without reading the driver.
+        """
+        with self._lock:
+            return self._fresh()
+
+    def _fresh(self):
+        return self._snapshot is not None and time.time() - self._snapshot['time'] <= self.maxAge
+
+    def _read(self, force):
+        with self._lock:
+            while True:
+                if not force and self._fresh():
+                    self.hits += 1
+                    return self._snapshot
+                if not self._sampling:
+                    break
+                self.waits += 1
+                self._sampled.wait()  # someone else is reading the driver, use theirs
+                force = False
+            self._sampling = True
+        return self._sample()
+
+    def _sample(self):
+        snapshot = None
+        try:
+            snapshot = {'status': list(self.driver.GetStatus()),
+                        'tec': list(self.driver.GetTemperatureF()),
+                        'temperature': list(self.driver.GetTemperatureStatus()),
+                        'time': time.time()}
+        finally:
+            with self._lock:
+                if snapshot is not None:  # stored before the waiters wake up to look for it
+                    self._snapshot = snapshot
+                    self.samples += 1
+                self._sampling = False
+                self._sampled.notify_all()
+        if self.history is not None:
+            self.history.record(snapshot)
+        return snapshot
+
+    def _run(self):
+        last = None
+        while not self._stop.is_set():
+            try:
+                snapshot = self.get(force=True)
+            except Exception as e:
+                logger.error("telemetry sample failed: %s" % e)
+            else:
+                current = snapshotLine('telemetry', snapshot)
+                if current != last and self.publish is not None:
+                    self.publish(current)
+                    with self._lock:
+                        self.pushed += 1
+                last = current
+            self._stop.wait(self.interval)
+
+    def stats(self):
+        with self._lock:
+            return {'samples': self.samples, 'hits': self.hits, 'waits': self.waits, 'pushed': self.pushed}
+
+
+class TelemetryHistory(object):
+    """
+    The last capacity samples of each of SERIES, with their times, in preallocated arrays used as a ring.
+    """
+    SERIES = ('temperature', 'target', 'ambient', 'cooler', 'status')
+
+    def __init__(self, capacity=43200):
+        self.capacity = capacity
+        self._times = np.zeros(capacity)
+        self._values = dict((name, np.zeros(capacity, dtype=np.float32)) for name in self.SERIES)
+        self._recorded = 0
+        self._lock = threading.Lock()
+
+    def record(self, snapshot):
+        """
+        Adds a TelemetrySampler snapshot: its CCD temperature, set point and ambient temperature, the cooler's
+        GetTemperatureF code and the camera's GetStatus code.
+        """
+        temperature = snapshot['temperature'] + [np.nan] * 3  # nan for what a driver does not report
+        with self._lock:
+            i = self._recorded % self.capacity
+            self._times[i] = snapshot['time']
+            self._values['temperature'][i] = temperature[1]
+            self._values['target'][i] = temperature[2]
+            self._values['ambient'][i] = temperature[3]
+            self._values['cooler'][i] = snapshot['tec'][0]
+            self._values['status'][i] = snapshot['status'][1]
+            self._recorded += 1
+
+    def __len__(self):
+        return min(self._recorded, self.capacity)
+
+    def query(self, series, start, end, maxPoints):
+        """
+        Pre: series is one of SERIES, start and end are times in seconds since the epoch and maxPoints is at least 2.
+        Post: Returns the arrays (times, values) of the samples from start to end, oldest first.  When there are more
+        than maxPoints they are split into maxPoints // 2 runs and only the lowest and highest sample of each run
+        is kept, in time order, so the peaks of the curve survive.
+        """
+        with self._lock:
+            head = self._recorded % self.capacity if self._recorded > self.capacity else 0
+            count = len(self)
+            times = np.roll(self._times[:count], -head)
+            values = np.roll(self._values[series][:count], -head)
+        first = np.searchsorted(times, start, side='left')
+        last = np.searchsorted(times, end, side='right')
+        times, values = times[first:last], values[first:last]
+        if len(times) <= maxPoints:
+            return times, values
+
+        edges = np.linspace(0, len(times), maxPoints // 2 + 1).astype(int)
+        keep = []
+        for low, high in zip(edges[:-1], edges[1:]):
+            run = values[low:high]
+            keep.extend(sorted(set([low + int(np.argmin(run)), low + int(np.argmax(run))])))
+        return times[keep], values[keep]
+
+
+def historyLine(series, times, values):
+    """
+    Returns the history reply for the points of a query:
+        history <series>,<time of the first point>,<points>,<seconds after the first>,<value>,...
+    """
+    if len(times) == 0:
+        return "history %s,0,0" % series
+    fields = [series, "%.3f" % times[0], str(len(times))]
+    for offset, value in zip(times - times[0], values):
+        fields.append("%.1f" % offset)
+        fields.append("%.6g" % value)
+    return "history " + ",".join(fields)
+
+
+def _temp(snapshot):
+    return ",".join(str(value) for value in [snapshot['tec'][0]] + snapshot['temperature'])
+
+
+def line(key, snapshot):
+    """
+    Returns the reply to the query key ('temp', 'getTEC' or 'status') from a snapshot.
+    """
+    status, tec = snapshot['status'], snapshot['tec']
+    if key == 'temp':
+        return "temp " + _temp(snapshot)
+    if key == 'getTEC':
+        return "getTEC " + str(tec[0]) + "," + str(tec[1])
+    return "status " + str(status[0]) + "," + str(status[1])
+
+
+def snapshotLine(key, snapshot):
+    """
+    Returns every field of a snapshot as a line with key: the status reply's fields followed by the temp reply's.
+    """
+    return key + " " + str(snapshot['status'][0]) + "," + str(snapshot['status'][1]) + "," + _temp(snapshot)
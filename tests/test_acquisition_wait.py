@@ -0,0 +1,49 @@
+import threading
+import time
+import unittest
+
+import evora.server.acquisition_wait as acq_wait
+from evora.server.simulator import AndorSimulator
+
+
+class TestAcquisitionWait(unittest.TestCase):
+    def setUp(self):
+        self.driver = AndorSimulator(width=64, height=64, readoutTime=0.05)
+
+    def start(self, waiter, exposure):
+        self.driver.SetAcquisitionMode(1)
+        self.driver.SetExposureTime(exposure)
+        waiter.arm()
+        self.driver.StartAcquisition()
+
+    def test_create_waiter_picks_sdk_when_available(self):
+        self.assertIsInstance(acq_wait.createWaiter(self.driver), acq_wait.SDKWaiter)
+        self.assertIsInstance(acq_wait.createWaiter(self.driver, 'poll'), acq_wait.PollingWaiter)
+
+    def test_wait_returns_when_readout_done(self):
+        for mode in ('sdk', 'poll'):
+            waiter = acq_wait.createWaiter(self.driver, mode)
+            self.start(waiter, 0.1)
+            status = waiter.wait(timeout=5)
+            self.assertEqual(status[1], self.driver.DRV_IDLE)
+
+    def test_abort_wakes_waiter(self):
+        for mode in ('sdk', 'poll'):
+            waiter = acq_wait.createWaiter(self.driver, mode)
+            self.start(waiter, 30)
+            threading.Timer(0.1, waiter.abort).start()
+            start = time.time()
+            waiter.wait()
+            self.assertLess(time.time() - start, 1.0)
+            self.assertTrue(waiter.isAborted())
+            self.driver.AbortAcquisition()
+
+    def test_wait_for_frame_times_out(self):
+        waiter = acq_wait.createWaiter(self.driver, 'sdk')
+        self.start(waiter, 30)
+        self.assertFalse(waiter.waitForFrame(timeout=0.05))
+        self.driver.AbortAcquisition()
+
+
+if __name__ == '__main__':
+    unittest.main()
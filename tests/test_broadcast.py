@@ -0,0 +1,101 @@
+import threading
+import unittest
+
+from twisted.protocols import basic
+from twisted.test import proto_helpers
+
+from evora.server.broadcast import BroadcastHub
+
+
+class ImmediateReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class QueuedReactor(object):
+    """
+    Holds the calls made with callFromThread until run() is called, like the reactor thread would.
+    """
+    def __init__(self):
+        self.calls = []
+
+    def callFromThread(self, f, *args):
+        self.calls.append((f, args))
+
+    def run(self):
+        calls, self.calls = self.calls, []
+        for f, args in calls:
+            f(*args)
+
+
+class Client(basic.LineReceiver):
+    def lines(self):
+        return self.transport.value().split(self.delimiter)[:-1]
+
+
+class TestBroadcastHub(unittest.TestCase):
+    def connect(self, hub, count):
+        clients = []
+        for i in range(count):
+            client = Client()
+            client.makeConnection(proto_helpers.StringTransport())
+            hub.add(client)
+            clients.append(client)
+        return clients
+
+    def test_paused_client_catches_up(self):
+        hub = BroadcastHub(maxQueue=10, driver=ImmediateReactor())
+        fast, slow = self.connect(hub, 2)
+        slow.transport.producer.pauseProducing()
+        for i in range(5):
+            hub.broadcast("line %d" % i)
+        self.assertEqual(len(fast.lines()), 5)
+        self.assertEqual(slow.lines(), [])
+        slow.transport.producer.resumeProducing()
+        self.assertEqual(slow.lines(), fast.lines())
+        hub.broadcast("line 5")
+        self.assertEqual(slow.lines()[-1], "line 5")
+        self.assertEqual(hub.stats()['queued'], 5)
+
+    def test_slow_client_is_disconnected(self):
+        hub = BroadcastHub(maxQueue=10, driver=ImmediateReactor())
+        clients = self.connect(hub, 5)
+        slow = clients[0]
+        slow.transport.producer.pauseProducing()
+        for i in range(200):
+            hub.broadcast("seriesSent%d %d" % (i, i))
+        for fast in clients[1:]:
+            self.assertEqual(len(fast.lines()), 200)
+        self.assertTrue(slow.transport.disconnected)
+        self.assertNotIn(slow, hub.clients())
+        self.assertEqual(hub.stats()['disconnected'], 1)
+        self.assertEqual(hub.stats()['maxPending'], 10)
+        hub.remove(slow)  # connectionLost comes afterwards
+
+    def test_drop_policy_keeps_the_newest(self):
+        hub = BroadcastHub(maxQueue=3, policy='drop', driver=ImmediateReactor())
+        slow, = self.connect(hub, 1)
+        slow.transport.producer.pauseProducing()
+        for i in range(10):
+            hub.broadcast("line %d" % i)
+        slow.transport.producer.resumeProducing()
+        self.assertEqual(slow.lines(), ["line 7", "line 8", "line 9"])
+        self.assertEqual(hub.stats()['dropped'], 7)
+        self.assertRaises(ValueError, BroadcastHub, policy='block')
+
+    def test_other_threads_go_through_the_reactor(self):
+        driver = QueuedReactor()
+        hub = BroadcastHub(driver=driver)
+        client, = self.connect(hub, 1)
+        workers = [threading.Thread(target=lambda: [hub.broadcast("line") for i in range(50)]) for j in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(client.lines(), [])  # nothing written off the reactor thread
+        driver.run()
+        self.assertEqual(len(client.lines()), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
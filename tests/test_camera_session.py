@@ -0,0 +1,62 @@
+import unittest
+
+from evora.server.camera_session import CameraSession
+from evora.server.simulator import DRV_P1INVALID, DRV_SUCCESS, AndorSimulator
+
+
+class TestCameraSession(unittest.TestCase):
+    def setUp(self):
+        self.driver = AndorSimulator(width=64, height=64)
+        self.camera = CameraSession(self.driver)
+
+    def setup(self, itime=1.0, binning=1):
+        self.camera.begin()
+        width, height = self.camera.detector()[1:]
+        self.camera.apply('SetReadMode', 4)
+        self.camera.apply('SetAcquisitionMode', 1)
+        self.camera.apply('SetImage', binning, binning, 1, width, 1, height)
+        self.camera.apply('SetShutter', 1, 0, 5, 5)
+        self.camera.apply('SetExposureTime', itime)
+        self.camera.apply('SetHSSpeed', 0, 3)
+        return self.camera.report()
+
+    def test_repeated_setup_is_skipped(self):
+        first = self.setup()
+        second = self.setup()
+        self.assertEqual((first['sent'], first['skipped']), (6, 0))
+        self.assertEqual((second['sent'], second['skipped']), (0, 6))
+        self.assertEqual(self.driver.calls['GetDetector'], 1)
+        self.assertEqual(self.driver.calls['SetImage'], 1)
+
+    def test_changed_values_are_sent(self):
+        self.setup()
+        report = self.setup(itime=2.0, binning=2)
+        self.assertEqual(report['sent'], 2)
+        self.assertEqual(self.driver.calls['SetExposureTime'], 2)
+        self.assertEqual(self.driver._exposureTime, 2.0)
+        self.assertEqual(self.driver._binning, 2)
+
+    def test_invalidate_resends_everything(self):
+        self.setup()
+        self.camera.invalidate()
+        self.assertEqual(self.setup()['sent'], 6)
+        self.assertEqual(self.driver.calls['GetDetector'], 2)
+
+    def test_failed_call_is_not_cached(self):
+        self.driver.SetHSSpeed = lambda typ, index: DRV_P1INVALID
+        self.assertEqual(self.camera.apply('SetHSSpeed', 0, 9), DRV_P1INVALID)
+        self.driver.SetHSSpeed = lambda typ, index: DRV_SUCCESS
+        self.camera.begin()
+        self.camera.apply('SetHSSpeed', 0, 9)
+        self.assertEqual(self.camera.report()['sent'], 1)
+
+    def test_saved_time_uses_measured_cost(self):
+        self.driver.setupLatency = 0.005
+        self.setup()
+        report = self.setup()
+        self.assertGreater(report['savedTime'], 5 * 0.004)
+        self.assertEqual(report['setupTime'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
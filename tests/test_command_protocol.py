@@ -0,0 +1,55 @@
+import unittest
+
+from twisted.test import proto_helpers
+
+import evora.server.server as server
+from evora.common.command_protocol import Reply, parseReply, splitRequest, tagReply, tagRequest
+from evora.server.broadcast import BroadcastHub
+
+
+class ImmediateReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class TestLineFormat(unittest.TestCase):
+    def test_requests(self):
+        self.assertEqual(splitRequest(tagRequest(17, "expose object 1 0.5")), ("17", "expose object 1 0.5"))
+        self.assertEqual(splitRequest("temp"), (None, "temp"))
+        self.assertEqual(splitRequest("@ temp"), (None, "@ temp"))
+
+    def test_replies(self):
+        self.assertEqual(parseReply("temp -80,-80,0,20034"), Reply(None, False, "temp", "-80,-80,0,20034"))
+        self.assertEqual(parseReply(tagReply("17", "series 1,11")), Reply("17", False, "series", "1,11"))
+        self.assertEqual(parseReply(tagReply("17", "seriesSent3 3,0.5,/data/a.fits", event=True)),
+                         Reply("17", True, "seriesSent3", "3,0.5,/data/a.fits"))
+        self.assertEqual(parseReply("abort"), Reply(None, False, "abort", ""))
+
+
+class TestTaggedReplies(unittest.TestCase):
+    def setUp(self):
+        factory = server.EvoraClient(BroadcastHub(driver=ImmediateReactor()))
+        self.clients = []
+        for i in range(2):
+            client = factory.buildProtocol(None)
+            client.transport = proto_helpers.StringTransport()
+            factory.hub.add(client)
+            self.clients.append(client)
+
+    def lines(self, client):
+        return client.transport.value().split("\r\n")[:-1]
+
+    def test_only_the_sender_gets_the_tag(self):
+        asking, other = self.clients
+        asking.sendData("temp -80,-80,0,20034", "5")
+        server.Request(asking, "6").sendData("seriesSent1 1,0.5,/data/a.fits")
+        server.Request(asking, None).sendData("realSent 1")
+        asking.sendData("status 1")
+        self.assertEqual(self.lines(asking), ["@5 temp -80,-80,0,20034", "@6+ seriesSent1 1,0.5,/data/a.fits",
+                                              "realSent 1", "status 1"])
+        self.assertEqual(self.lines(other), ["temp -80,-80,0,20034", "seriesSent1 1,0.5,/data/a.fits",
+                                             "realSent 1", "status 1"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import time
+import unittest
+
+from evora.common.display_queue import DisplayQueue
+
+
+class TestDisplayQueue(unittest.TestCase):
+    def setUp(self):
+        self.queue = DisplayQueue()
+
+    def test_real_time_frames_coalesce(self):
+        for i in range(5):
+            self.queue.put("real%d" % i, coalesce=True)
+        self.assertEqual(self.queue.pending(), 1)
+        item, queued = self.queue.get()
+        self.assertEqual(item, "real4")
+        self.assertEqual(self.queue.stats()['dropped'], 4)
+        self.assertIsNone(self.queue.get(timeout=0.01))
+
+    def test_kept_images_are_never_dropped(self):
+        for i in range(3):
+            self.queue.put("series%d" % i)
+            self.queue.put("real%d" % i, coalesce=True)
+        items = [self.queue.get()[0] for i in range(4)]
+        self.assertEqual(items, ["series0", "series1", "series2", "real2"])
+        self.assertEqual(self.queue.stats()['dropped'], 2)
+
+    def test_discard_latest(self):
+        self.queue.put("single")
+        self.queue.put("real", coalesce=True)
+        self.queue.discardLatest()
+        self.assertEqual(self.queue.get()[0], "single")
+        self.assertIsNone(self.queue.get(timeout=0.01))
+        self.assertEqual(self.queue.stats()['dropped'], 1)
+
+    def test_get_wakes_up_on_put(self):
+        got = []
+        thread = threading.Thread(target=lambda: got.append(self.queue.get(timeout=5)))
+        thread.start()
+        time.sleep(0.05)
+        self.queue.put("single")
+        thread.join()
+        self.assertEqual(got[0][0], "single")
+
+    def test_lag(self):
+        self.queue.put("real", coalesce=True)
+        item, queued = self.queue.get()
+        time.sleep(0.02)
+        self.queue.finished(queued)
+        stats = self.queue.stats()
+        self.assertEqual((stats['displayed'], stats['pending']), (1, 0))
+        self.assertGreaterEqual(stats['lastLag'], 0.02)
+        self.assertEqual(stats['maxLag'], stats['meanLag'])
+
+        self.queue.resetStats()
+        self.assertEqual(self.queue.stats(), {'displayed': 0, 'dropped': 0, 'pending': 0, 'lastLag': 0.0,
+                                              'meanLag': 0.0, 'maxLag': 0.0})
+
+    def test_slow_display_does_not_fall_behind(self):
+        """
+        A display three times slower than the camera stays within one frame of it.
+        """
+        shown = []
+
+        def display():
+            while True:
+                got = self.queue.get(timeout=0.3)
+                if got is None:
+                    return
+                time.sleep(0.015)
+                shown.append(got[0])
+                self.queue.finished(got[1])
+        thread = threading.Thread(target=display)
+        thread.start()
+        for i in range(30):
+            self.queue.put(i, coalesce=True)
+            time.sleep(0.005)
+        thread.join()
+        stats = self.queue.stats()
+        self.assertEqual(shown[-1], 29)
+        self.assertEqual(stats['displayed'] + stats['dropped'], 30)
+        self.assertGreater(stats['dropped'], 0)
+        self.assertLess(stats['maxLag'], 0.15)
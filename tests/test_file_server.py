@@ -0,0 +1,147 @@
+import base64
+import hashlib
+import httplib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from evora.client.transfer_images import FileService, TransferScheduler
+from evora.server.file_server import FileServer, parseRange
+
+
+class TestParseRange(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual(parseRange(None, 100), None)
+        self.assertEqual(parseRange("bytes=10-19", 100), (10, 19))
+        self.assertEqual(parseRange("bytes=90-", 100), (90, 99))
+        self.assertEqual(parseRange("bytes=95-200", 100), (95, 99))
+        self.assertEqual(parseRange("bytes=-10", 100), (90, 99))
+        self.assertEqual(parseRange("bytes=-200", 100), (0, 99))
+        self.assertEqual(parseRange("bytes=0-1,5-6", 100), None)
+        self.assertEqual(parseRange("items=0-1", 100), None)
+        self.assertEqual(parseRange("bytes=100-", 100), False)
+        self.assertEqual(parseRange("bytes=20-10", 100), False)
+        self.assertEqual(parseRange("bytes=-0", 100), False)
+
+
+class TestFileServer(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.root, "tmp"))
+        self.data = os.urandom(300000)
+        with open(os.path.join(self.root, "image.fits"), 'wb') as f:
+            f.write(self.data)
+        with open(os.path.join(self.root, "tmp", "real.fits"), 'wb') as f:
+            f.write(b"real")
+        self.server = FileServer(self.root, ('127.0.0.1', 0))
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.connection = httplib.HTTPConnection('127.0.0.1', self.port, timeout=10)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.root)
+
+    def get(self, path, headers={}):
+        self.connection.request("GET", path, headers=headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_whole_file(self):
+        response, body = self.get("/files/image.fits")
+        self.assertEqual(response.status, 200)
+        self.assertEqual(body, self.data)
+        self.assertEqual(response.getheader("Accept-Ranges"), "bytes")
+        self.assertEqual(int(response.getheader("Content-Length")), len(self.data))
+
+    def test_range(self):
+        response, body = self.get("/files/image.fits", {"Range": "bytes=1000-1999"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, self.data[1000:2000])
+        self.assertEqual(response.getheader("Content-Range"), "bytes 1000-1999/%d" % len(self.data))
+
+        response, body = self.get("/files/image.fits", {"Range": "bytes=-100"})
+        self.assertEqual(response.status, 206)
+        self.assertEqual(body, self.data[-100:])
+
+        response, body = self.get("/files/image.fits", {"Range": "bytes=%d-" % len(self.data)})
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.getheader("Content-Range"), "bytes */%d" % len(self.data))
+
+    def test_etag(self):
+        response, body = self.get("/files/image.fits")
+        etag = response.getheader("ETag")
+        response, body = self.get("/files/image.fits", {"If-None-Match": etag})
+        self.assertEqual((response.status, body), (304, b""))
+
+        response, body = self.get("/files/image.fits", {"Range": "bytes=0-9", "If-Range": etag})
+        self.assertEqual((response.status, body), (206, self.data[:10]))
+        response, body = self.get("/files/image.fits", {"Range": "bytes=0-9", "If-Range": '"stale"'})
+        self.assertEqual((response.status, body), (200, self.data))
+
+    def test_digest(self):
+        response, body = self.get("/files/image.fits")
+        self.assertIsNone(response.getheader("Digest"))
+        response, body = self.get("/files/image.fits", {"Want-Digest": "md5", "Range": "bytes=0-9"})
+        self.assertEqual(response.getheader("Digest"),
+                         "md5=" + base64.b64encode(hashlib.md5(self.data).digest()))
+
+    def test_listing(self):
+        response, body = self.get("/list/")
+        self.assertEqual(response.status, 200)
+        entries = {entry['name']: entry for entry in json.loads(body)}
+        self.assertEqual(sorted(entries), ["image.fits", "tmp"])
+        self.assertEqual(entries["image.fits"]['size'], len(self.data))
+        self.assertTrue(entries["tmp"]['dir'])
+
+        response, body = self.get("/list/", {"If-None-Match": response.getheader("ETag")})
+        self.assertEqual(response.status, 304)
+
+        response, body = self.get("/list/tmp")
+        self.assertEqual([entry['name'] for entry in json.loads(body)], ["real.fits"])
+
+    def test_outside_root(self):
+        for path in ("/files/../../etc/passwd", "/files/%2e%2e/etc/passwd", "/list/..",
+                     "/files/missing.fits", "/files/tmp", "/other"):
+            response, body = self.get(path)
+            self.assertEqual(response.status, 404, path)
+
+    def test_keep_alive(self):
+        self.get("/files/image.fits")
+        socket = self.connection.sock
+        for i in range(5):
+            response, body = self.get("/files/tmp/real.fits")
+            self.assertEqual(body, b"real")
+        self.assertIs(self.connection.sock, socket)
+
+    def test_client(self):
+        client = FileService('127.0.0.1', self.port)
+        names = TransferScheduler('127.0.0.1', self.port, workers=0)  # only resolves the names
+        save = tempfile.mkdtemp()
+        try:
+            client.retrieve(names.submit(None, "image.fits", save + "/", "copy.fits"))
+            with open(os.path.join(save, "copy.fits"), 'rb') as f:
+                self.assertEqual(f.read(), self.data)
+
+            names.cwd("tmp/")
+            client.retrieve(names.submit(None, "real.fits", save + "/", "real.fits"))
+            names.cdup()
+            self.assertEqual(names.directory, "")
+            self.assertRaises(IOError, client.retrieve, names.submit(None, "real.fits", save + "/", "real.fits"))
+
+            socket = client.connection.sock
+            socket.close()  # the server dropped the idle connection
+            client.retrieve(names.submit(None, "tmp/real.fits", save + "/", "again.fits"))
+            self.assertIsNot(client.connection.sock, socket)
+            with open(os.path.join(save, "again.fits"), 'rb') as f:
+                self.assertEqual(f.read(), b"real")
+        finally:
+            client.close()
+            shutil.rmtree(save)
@@ -0,0 +1,78 @@
+import calendar
+import time
+import unittest
+
+from evora.server.fits_headers import HeaderFactory
+from evora.server.simulator import AndorSimulator
+
+START = time.gmtime(calendar.timegm((2020, 7, 22, 4, 15, 1)))
+
+
+class FakeLogs(object):
+    def __init__(self, results):
+        self.results = results
+        self.calls = 0
+
+    def lookup(self, obsTime):
+        self.calls += 1
+        return self.results
+
+
+class TestHeaderFactory(unittest.TestCase):
+    def setUp(self):
+        self.driver = AndorSimulator(width=64, height=64)
+        self.driver.SetExposureTime(2.0)
+        self.heimdall = FakeLogs((1.5, 45.0, 2000.0, 2.0, 0.5, 60.0))
+        self.gtcc = FakeLogs(('1.5', '45.0', '2000.0', '2.0', '0.5', '60.0'))
+        self.factory = HeaderFactory(self.driver, '46.9528', '-120.7278', self.heimdall, self.gtcc)
+        self.attributes = ['object', 1, 2.0, 'r']
+
+    def test_header_cards(self):
+        header = self.factory.session(self.attributes, 'heimdall').build(START)
+        self.assertEqual(list(header.keys())[:4], ['DATE-OBS', 'UT', 'OBSERVAT', 'IMAGETYP'])
+        self.assertEqual(header['DATE-OBS'], '2020-07-22T04:15:01')
+        self.assertEqual(header['UT'], '04:15:01')
+        self.assertEqual(header['LATITUDE'], '46.9528')
+        self.assertAlmostEqual(header['READTIME'], 0.5)
+        self.assertEqual(header['TEMP'], self.driver.GetTemperatureStatus()[1])
+        self.assertAlmostEqual(header['AIRMASS'], 2.0)
+        self.assertEqual(header['MJD'], '59052.1770949')
+
+        header = self.factory.session(self.attributes, 'gtcc').build(START)
+        self.assertEqual(header['RA'], '1.5')
+        self.assertNotIn('AIRMASS', header)
+
+    def test_temperature_never_asks_the_driver(self):
+        readings = [None, -60.5]
+        self.factory.temperature = lambda: readings.pop(0)
+        self.driver.GetTemperatureStatus = None  # not callable here, as off the hardware thread
+        session = self.factory.session(self.attributes, 'heimdall')
+        self.assertEqual(str(session.build(START)['TEMP']), '')  # no sample yet
+        self.assertEqual(session.build(START)['TEMP'], -60.5)
+
+    def test_template_is_cached_and_not_modified(self):
+        first = self.factory.session(self.attributes, 'heimdall')
+        first.build(START)
+        second = self.factory.session(self.attributes, 'heimdall')
+        self.assertIs(first.template, second.template)
+        self.assertNotIn('RA', second.template)
+        self.assertEqual(self.factory.stats()['hits'], 1)
+
+        self.factory.session(['flat', 1, 2.0, 'r'], 'heimdall')
+        self.assertEqual(self.factory.stats()['misses'], 2)
+
+    def test_prepare_builds_in_background(self):
+        session = self.factory.session(self.attributes, 'heimdall')
+        pending = [session.prepare(time.gmtime(calendar.timegm(START) + i)) for i in range(5)]
+        headers = [p.get(timeout=30) for p in pending]
+        self.assertEqual([h['UT'] for h in headers], ['04:15:0%d' % (1 + i) for i in range(5)])
+        self.assertEqual(self.heimdall.calls, 5)
+
+    def test_prepare_reraises_errors(self):
+        self.heimdall.results = (1.5, 45.0)  # malformed log line
+        pending = self.factory.session(self.attributes, 'heimdall').prepare(START)
+        self.assertRaises(ValueError, pending.get, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
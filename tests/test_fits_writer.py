@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from astropy.io import fits
+
+from evora.server.fits_writer import FitsWriter, WriteJob, compressionType, outputName
+
+
+class TestFitsWriter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def job(self, i, notify=None, headerFunc=None):
+        data = np.full((16, 16), i, dtype=np.uint16)
+        return WriteJob(data, os.path.join(self.dir, "image_%03d.fits" % i), headerFunc=headerFunc, notify=notify)
+
+    def test_writes_and_notifies_in_order(self):
+        writer = FitsWriter(threads=4, maxQueue=4, policy='block')
+        notified = []
+        for i in range(20):
+            writer.submit(self.job(i, notify=notified.append))
+        self.assertTrue(writer.flush(timeout=30))
+
+        self.assertEqual(notified, [os.path.join(self.dir, "image_%03d.fits" % i) for i in range(20)])
+        self.assertEqual(fits.getdata(notified[7])[0, 0], 7)
+        stats = writer.stats()
+        self.assertEqual(stats['written'], 20)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertEqual(stats['depth'], 0)
+
+    def test_header_built_on_writer_thread(self):
+        writer = FitsWriter(threads=1)
+        threads = []
+
+        def headerFunc():
+            threads.append(threading.current_thread().name)
+            header = fits.Header()
+            header.append(card=("IMAGETYP", "bias"))
+            return header
+
+        notified = []
+        writer.submit(self.job(1, notify=notified.append, headerFunc=headerFunc))
+        writer.flush(timeout=30)
+        self.assertNotEqual(threads[0], threading.current_thread().name)
+        self.assertEqual(fits.getheader(notified[0])['IMAGETYP'], 'bias')
+
+    def test_drop_policy_counts_dropped_frames(self):
+        writer = FitsWriter(threads=1, maxQueue=1, policy='drop')
+        release = threading.Event()
+        writer.submit(self.job(0, headerFunc=lambda: release.wait() and None))
+        results = [writer.submit(self.job(i)) for i in range(1, 6)]
+        release.set()
+        writer.flush(timeout=30)
+
+        self.assertIn(False, results)
+        stats = writer.stats()
+        self.assertEqual(stats['dropped'], results.count(False))
+        self.assertEqual(stats['written'] + stats['dropped'], 6)
+
+    def test_compressed_frames_are_lossless(self):
+        writer = FitsWriter(threads=1, processes=1)
+        data = np.random.RandomState(0).poisson(1000, (64, 64)).astype(np.uint16)
+        data[0, :2] = (0, 65535)
+        header = fits.Header()
+        header.append(card=("IMAGETYP", "object"))
+        notified = []
+        compress = compressionType('rice')
+        filename = outputName(os.path.join(self.dir, "image.fits"), compress)
+        pool = writer.startProcesses()
+        writer.submit(WriteJob(data, filename, header=header, notify=notified.append, compress=compress))
+        self.assertTrue(writer.close(timeout=30))
+        self.assertIsNone(writer._pool)
+        self.assertFalse(any(worker.is_alive() for worker in pool._pool))
+
+        self.assertEqual(notified, [os.path.join(self.dir, "image.fits.fz")])
+        self.assertEqual(fits.getheader(filename, 1, disable_image_compression=True)['ZCMPTYPE'], 'RICE_1')
+        with fits.open(filename) as hdus:
+            self.assertEqual(hdus[1].header['IMAGETYP'], 'object')
+            self.assertEqual(hdus[1].data.dtype, np.uint16)
+            self.assertTrue((hdus[1].data == data).all())
+
+    def test_stats_record(self):
+        writer = FitsWriter(threads=1)
+        data = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        filename = os.path.join(self.dir, "image.fits")
+        notified = []
+        writer.submit(WriteJob(data, filename, notify=lambda *args: notified.append(args), stats=True))
+        writer.submit(WriteJob(data, os.path.join(self.dir, "plain.fits"), notify=lambda *args: notified.append(args)))
+        writer.flush(timeout=30)
+
+        self.assertEqual(len(notified), 2)
+        self.assertEqual(notified[0][1]['median'], 5.5)
+        self.assertEqual(notified[1], (os.path.join(self.dir, "plain.fits"),))
+        header = fits.getheader(filename)
+        self.assertEqual([header[key] for key in ('DATAMIN', 'DATAMAX', 'DATAMEAN', 'DATAMED', 'DATAMAD')],
+                         [0, 11, 5.5, 5.5, 3.0])
+        self.assertNotIn('DATAMIN', fits.getheader(os.path.join(self.dir, "plain.fits")))
+
+    def test_stats_only_and_policy_per_job(self):
+        writer = FitsWriter(threads=1, maxQueue=1)
+        release = threading.Event()
+        notified = []
+        writer.submit(self.job(0, headerFunc=lambda: release.wait() and None))
+        writer.submit(self.job(1))
+        data = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        self.assertFalse(writer.submit(WriteJob(data, None, stats=True), policy='drop'))  # queue full
+        release.set()
+        writer.flush(timeout=30)
+        writer.submit(WriteJob(data, None, notify=lambda *args: notified.append(args), stats=True, fast=True))
+        writer.flush(timeout=30)
+
+        self.assertEqual(notified[0][0], None)
+        self.assertEqual(notified[0][1]['max'], 11)
+        self.assertEqual(sorted(os.listdir(self.dir)), ["image_000.fits", "image_001.fits"])
+        self.assertEqual((writer.stats()['dropped'], writer.stats()['written']), (1, 3))
+
+    def test_compression_names(self):
+        self.assertIsNone(compressionType(None))
+        self.assertIsNone(compressionType('none'))
+        self.assertEqual(compressionType('RICE'), 'RICE_1')
+        self.assertRaises(ValueError, compressionType, 'jpeg')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import threading
+import unittest
+
+from evora.server.frame_pool import FramePool, contiguous
+
+
+class TestFramePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = FramePool(capacity=3)
+        self.pool.configure(64, 32, binning=2)
+
+    def test_frames_are_reused(self):
+        frame = self.pool.lease()
+        self.assertEqual(frame.image.shape, (32, 16))
+        self.assertEqual(frame.data.size, 32 * 16)
+        frame.release()
+        self.assertIs(self.pool.lease(), frame)
+        self.assertEqual(self.pool.stats()['allocated'], 1)
+
+    def test_high_water_mark(self):
+        frames = [self.pool.lease() for i in range(3)]
+        for frame in frames:
+            frame.release()
+        self.pool.lease().release()
+        stats = self.pool.stats()
+        self.assertEqual(stats['highWater'], 3)
+        self.assertEqual(stats['leased'], 0)
+
+    def test_lease_waits_when_exhausted(self):
+        frames = [self.pool.lease() for i in range(3)]
+        self.assertIsNone(self.pool.lease(timeout=0.01))
+
+        threading.Timer(0.05, frames[0].release).start()
+        self.assertIs(self.pool.lease(timeout=5), frames[0])
+        self.assertEqual(self.pool.stats()['waits'], 1)
+
+    def test_reclaim_reports_leaks(self):
+        self.pool.lease('series')
+        self.pool.lease('series').release()
+        self.assertEqual(self.pool.reclaim(), 1)
+        self.assertEqual(self.pool.stats()['leaks'], 1)
+        self.assertEqual(self.pool.stats()['leased'], 0)
+
+    def test_lease_run_is_contiguous(self):
+        first, second, third = self.pool.leaseRun(3)
+        second.release()
+        self.assertEqual(self.pool.leaseRun(2), [second])  # only one frame is free
+
+        first.release()
+        second.release()
+        run = self.pool.leaseRun(5)
+        self.assertEqual(run, [first, second])
+        data = contiguous(run)
+        self.assertEqual(data.size, 2 * 32 * 16)
+        data[:] = 7
+        self.assertTrue((first.image == 7).all())
+        self.assertTrue((second.image == 7).all())
+        self.assertFalse((third.image == 7).all())
+
+    def test_new_geometry_drops_old_frames(self):
+        old = self.pool.lease()
+        self.pool.configure(64, 32, binning=1)
+        old.release()
+        frame = self.pool.lease()
+        self.assertIsNot(frame, old)
+        self.assertEqual(frame.image.shape, (64, 32))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from evora.common.frame_ring import FrameRingReader, FrameRingWriter
+
+
+class TestFrameRing(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "frames")
+        self.writer = FrameRingWriter(self.path, slots=3)
+        self.image = np.arange(6 * 8, dtype=np.uint16).reshape(6, 8)
+
+    def tearDown(self):
+        self.writer.unlink()
+        shutil.rmtree(self.dir)
+
+    def test_reader_needs_a_ring(self):
+        self.assertRaises(OSError, FrameRingReader, self.path)
+
+    def test_frames_are_read_in_place(self):
+        self.writer.write(1, 100.0, 2.5, "flat", 2, self.image)
+        reader = FrameRingReader(self.path)
+        meta, image = reader.read(1)
+        self.assertEqual((meta['number'], meta['obsTime'], meta['itime'], meta['imType'], meta['binning']),
+                         (1, 100.0, 2.5, "flat", 2))
+        np.testing.assert_array_equal(image, self.image)
+        self.assertFalse(image.flags.writeable)
+        self.assertEqual(reader.head(), 1)
+
+    def test_overwritten_frames_are_detected(self):
+        reader = None
+        for number in range(1, 5):
+            self.writer.write(number, 0, 0, "object", 1, self.image + number)
+            if reader is None:
+                reader = FrameRingReader(self.path)
+                meta, first = reader.read(1)
+        self.assertFalse(reader.valid(1))  # slot 1 now holds frame 4
+        self.assertIsNone(reader.read(1))
+        np.testing.assert_array_equal(reader.read(4)[1], self.image + 4)
+        np.testing.assert_array_equal(reader.read(2)[1], self.image + 2)
+
+    def test_copies_survive_the_ring_going_round(self):
+        self.writer.write(1, 0, 0, "object", 1, self.image)
+        reader = FrameRingReader(self.path)
+        meta, view = reader.read(1)
+        meta, copy = reader.readCopy(1)
+        for number in range(2, 5):  # frame 4 lands in frame 1's slot while frame 1 waits to be displayed
+            self.writer.write(number, 0, 0, "object", 1, self.image + number)
+        np.testing.assert_array_equal(view, self.image + 4)  # torn: the view shows the new frame
+        np.testing.assert_array_equal(copy, self.image)
+        self.assertIsNone(reader.readCopy(1))
+
+    def test_frame_overwritten_while_copied_is_dropped(self):
+        self.writer.write(1, 0, 0, "object", 1, self.image)
+        reader = FrameRingReader(self.path)
+        read = reader.read
+
+        def readThenOverwrite(number):
+            frame = read(number)
+            for later in range(2, 5):
+                self.writer.write(later, 0, 0, "object", 1, self.image + later)
+            return frame
+        reader.read = readThenOverwrite
+        self.assertIsNone(reader.readCopy(1))
+
+    def test_larger_frame_replaces_the_ring(self):
+        self.writer.write(1, 0, 0, "object", 2, self.image)
+        reader = FrameRingReader(self.path)
+        meta, old = reader.read(1)
+        big = np.ones((12, 16), dtype=np.uint16)
+        self.writer.write(2, 0, 0, "object", 1, big)
+        np.testing.assert_array_equal(reader.read(2)[1], big)
+        np.testing.assert_array_equal(old, self.image)  # images from the old ring stay readable
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,260 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+import numpy as np
+from twisted.internet.address import IPv4Address
+from twisted.test import proto_helpers
+
+import evora.common.frame_stream as frame_stream
+from evora.common.frame_ring import FrameRingReader, FrameRingWriter
+from evora.common.utils.stats import parse_record
+import evora.server.acquisition_wait as acq_wait
+import evora.server.server as server
+from evora.server.camera_session import CameraSession
+from evora.server.frame_pool import FramePool
+from evora.server.frame_push import FramePushFactory
+from evora.server.simulator import AndorSimulator
+
+
+class ImmediateReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class Collector(frame_stream.FrameReceiver):
+    def __init__(self):
+        self.frames = []
+
+    def frameReceived(self, meta, image):
+        self.frames.append((meta, image))
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendData(self, data):
+        self.sent.append(data)
+
+
+def receive(chunks):
+    collector = Collector()
+    collector.makeConnection(proto_helpers.StringTransport())
+    for chunk in chunks:
+        collector.dataReceived(chunk)
+    return collector.frames
+
+
+class TestFramePacket(unittest.TestCase):
+    def setUp(self):
+        self.image = np.arange(12 * 10, dtype=np.uint16).reshape(12, 10) * 500
+
+    def test_round_trip(self):
+        packet = frame_stream.pack(7, 1234.5, 0.25, "object", 2, self.image)
+        meta, image = receive(["".join(packet)])[0]
+        self.assertEqual(meta, {'number': 7, 'obsTime': 1234.5, 'itime': 0.25, 'imType': 'object', 'binning': 2,
+                                'kind': frame_stream.FULL, 'factor': 1, 'low': 0.0, 'high': 0.0})
+        np.testing.assert_array_equal(image, self.image)
+
+    def test_split_and_joined_reads(self):
+        data = "".join("".join(frame_stream.pack(i, 0, 0, "bias", 1, self.image + i)) for i in range(3))
+        frames = receive(data[i:i + 7] for i in range(0, len(data), 7)) + receive([data])
+        self.assertEqual([meta['number'] for meta, image in frames], [0, 1, 2, 0, 1, 2])
+        np.testing.assert_array_equal(frames[2][1], self.image + 2)
+
+    def test_truncated_packet_is_rejected(self):
+        packet = "".join(frame_stream.pack(1, 0, 0, "bias", 1, self.image))
+        with self.assertRaises(ValueError):
+            frame_stream.unpack(packet[frame_stream.PREFIX.size:-2])
+
+
+class TestFramePush(unittest.TestCase):
+    def setUp(self):
+        self.factory = FramePushFactory(driver=ImmediateReactor())
+
+    def connect(self, peer='192.168.1.1'):
+        client = self.factory.buildProtocol(None)
+        transport = proto_helpers.StringTransport(peerAddress=IPv4Address('TCP', peer, 5506))
+        client.makeConnection(transport)
+        return client, transport
+
+    def test_frames_reach_every_subscriber(self):
+        connections = [self.connect() for i in range(2)]
+        image = np.ones((4, 6), dtype=np.uint16)
+        self.factory.publish(1, 0, 1.0, "flat", 1, image)
+        image[:] = 0  # the buffer may be reused once publish returns
+        for client, transport in connections:
+            frames = receive([transport.value()])
+            self.assertEqual(len(frames), 1)
+            np.testing.assert_array_equal(frames[0][1], np.ones((4, 6)))
+        self.assertEqual(self.factory.stats()['sent'], 2)
+
+    def test_backed_up_subscriber_skips_frames(self):
+        slow, slowTransport = self.connect()
+        fast, fastTransport = self.connect()
+        slow.pauseProducing()
+        self.factory.publish(1, 0, 1.0, "flat", 1, np.ones((4, 6), dtype=np.uint16))
+        slow.resumeProducing()
+        self.factory.publish(2, 0, 1.0, "flat", 1, np.ones((4, 6), dtype=np.uint16))
+        self.assertEqual([m['number'] for m, i in receive([slowTransport.value()])], [2])
+        self.assertEqual([m['number'] for m, i in receive([fastTransport.value()])], [1, 2])
+        self.assertEqual(self.factory.stats()['dropped'], 1)
+
+    def test_preview_mode(self):
+        previewer, previewTransport = self.connect()
+        both, bothTransport = self.connect()
+        previewer.lineReceived("mode preview 8")
+        both.lineReceived("mode both")
+        image = np.arange(16 * 32, dtype=np.uint16).reshape(16, 32)
+        self.factory.publish(1, 0, 1.0, "flat", 1, image)
+
+        frames = receive([previewTransport.value()])
+        self.assertEqual([(m['kind'], m['factor'], i.shape, i.dtype) for m, i in frames],
+                         [(frame_stream.PREVIEW, 4, (4, 8), np.uint8)])
+        self.assertEqual([(m['kind'], i.shape) for m, i in receive([bothTransport.value()])],
+                         [(frame_stream.PREVIEW, (16, 32)), (frame_stream.FULL, (16, 32))])  # default size
+
+        meta, pixels = frames[0]
+        restored = frame_stream.dequantize(meta, pixels)
+        self.assertLess(abs(restored.mean() - image.mean()), 5)
+
+    def test_bad_preview_size_keeps_the_mode(self):
+        client, transport = self.connect()
+        client.lineReceived("mode preview 8")
+        for line in ("mode preview 0", "mode both -3", "mode preview big"):
+            client.lineReceived(line)
+            self.assertEqual((client.mode, client.size), ('preview', 8))
+        self.factory.publish(1, 0, 1.0, "flat", 1, np.ones((16, 16), dtype=np.uint16))
+        self.assertEqual([m['factor'] for m, i in receive([transport.value()])], [2])
+
+    def test_latest_sends_last_full_frame(self):
+        client, transport = self.connect()
+        watcher, watcherTransport = self.connect()
+        client.lineReceived("mode preview 8")
+        self.factory.publish(1, 0, 1.0, "flat", 1, np.ones((16, 16), dtype=np.uint16))
+        transport.clear()
+        client.lineReceived("latest")
+        self.assertEqual([(m['number'], m['kind']) for m, i in receive([transport.value()])],
+                         [(1, frame_stream.FULL)])
+
+    def test_latest_with_only_previews_waits_for_the_next_frame(self):
+        client, transport = self.connect()
+        client.lineReceived("mode preview 8")
+        with mock.patch.object(frame_stream, 'pack', wraps=frame_stream.pack) as pack:
+            self.factory.publish(1, 0, 1.0, "flat", 1, np.ones((16, 16), dtype=np.uint16))
+        self.assertEqual([c[0][6:7] for c in pack.call_args_list], [(frame_stream.PREVIEW,)])  # no full frame packed
+        client.lineReceived("latest")
+        client.lineReceived("latest")
+        self.factory.publish(2, 0, 1.0, "flat", 1, np.ones((16, 16), dtype=np.uint16))
+        self.factory.publish(3, 0, 1.0, "flat", 1, np.ones((16, 16), dtype=np.uint16))
+        self.assertEqual([(m['number'], m['kind']) for m, i in receive([transport.value()])],
+                         [(1, frame_stream.PREVIEW), (2, frame_stream.PREVIEW), (2, frame_stream.FULL),
+                          (3, frame_stream.PREVIEW)])
+
+    def test_local_clients_read_the_ring(self):
+        directory = tempfile.mkdtemp()
+        try:
+            self.factory.ring = FrameRingWriter(os.path.join(directory, "frames"), slots=4)
+            local, localTransport = self.connect(peer='127.0.0.1')
+            remote, remoteTransport = self.connect()
+            local.lineReceived("mode shm")
+            remote.lineReceived("mode shm")
+            self.assertEqual((local.mode, remote.mode), ('shm', 'full'))
+
+            image = np.arange(12, dtype=np.uint16).reshape(3, 4)
+            self.factory.publish(5, 0, 1.0, "flat", 1, image)
+            notices = receive([localTransport.value()])
+            self.assertEqual([(m['number'], m['kind'], i) for m, i in notices], [(5, frame_stream.RING, None)])
+            np.testing.assert_array_equal(FrameRingReader(self.factory.ring.path).read(5)[1], image)
+            self.assertEqual(len(receive([remoteTransport.value()])), 1)
+
+            remote.connectionLost(None)
+            self.factory.publish(6, 0, 1.0, "flat", 1, image)
+            self.assertEqual(len(self.factory._latest[1]), image.nbytes)  # no full packet with only ring clients
+        finally:
+            shutil.rmtree(directory)
+
+    def test_ring_refused_without_writer(self):
+        local, transport = self.connect(peer='127.0.0.1')
+        local.lineReceived("mode preview 8")
+        local.lineReceived("mode shm")
+        self.assertEqual(local.mode, 'preview')
+
+    def test_unsubscribe_on_disconnect(self):
+        client, transport = self.connect()
+        self.assertEqual(self.factory.subscribers(), 1)
+        client.connectionLost(None)
+        self.assertEqual(self.factory.subscribers(), 0)
+
+
+class TestRealTimeExposure(unittest.TestCase):
+    """
+    Runs realTimeExposure on the simulator until a few frames are out, then aborts it.
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def run_real(self, subscribe, save, slowFirstFrame=False):
+        driver = AndorSimulator(width=32, height=32, readoutTime=0.005)
+        stream = FramePushFactory(driver=ImmediateReactor())
+        if slowFirstFrame:
+            publish = stream.publish
+            stream.publish = lambda number, *args: time.sleep(0.1 if number == 1 else 0) or publish(number, *args)
+        transport = proto_helpers.StringTransport()
+        if subscribe:
+            stream.buildProtocol(None).makeConnection(transport)
+        protocol = FakeProtocol()
+        with mock.patch.object(server, 'andor', driver), \
+                mock.patch.object(server, 'camera', CameraSession(driver)), \
+                mock.patch.object(server, 'waiter', acq_wait.createWaiter(driver)), \
+                mock.patch.object(server, 'framePool', FramePool(4)), \
+                mock.patch.object(server, 'frameStream', stream), \
+                mock.patch.object(server.fits_utils, 'get_image_path',
+                                  lambda type: tempfile.mktemp(suffix=".fits", dir=self.dir)):
+            thread = threading.Thread(target=server.Evora().realTimeExposure,
+                                      args=(protocol, "object", 0.01, 1, save))
+            thread.start()
+            deadline = time.time() + 10
+            while len(protocol.sent) < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            server.Evora().abort()
+            thread.join(5)
+        return protocol.sent, receive([transport.value()])
+
+    def test_subscribed_preview_skips_disk(self):
+        sent, frames = self.run_real(subscribe=True, save=False)
+        self.assertEqual(os.listdir(self.dir), [])
+        self.assertEqual([message.split(",")[0] for message in sent[:3]], ["realSent 1", "realSent 2", "realSent 3"])
+        self.assertIsNotNone(parse_record(sent[0].split(",")[1:]))
+        self.assertEqual([meta['number'] for meta, image in frames[:3]], [1, 2, 3])
+
+    def test_slow_frame_skips_ahead(self):
+        sent, frames = self.run_real(subscribe=True, save=False, slowFirstFrame=True)
+        numbers = [int(message.split(",")[0].split()[1]) for message in sent]
+        self.assertGreaterEqual(len(numbers), 3)
+        self.assertEqual(numbers, sorted(set(numbers)))
+        self.assertGreater(numbers[1], 2)  # the frames read out during the slow one were skipped
+        self.assertEqual([meta['number'] for meta, image in frames], numbers)
+
+    def test_save_writes_frames_too(self):
+        sent, frames = self.run_real(subscribe=True, save=True)
+        self.assertEqual(len(os.listdir(self.dir)), len(sent))
+        self.assertEqual(len(frames), len(sent))
+        self.assertTrue(sent[0].startswith("realSent " + self.dir))
+
+    def test_without_subscribers_frames_are_saved(self):
+        sent, frames = self.run_real(subscribe=False, save=False)
+        self.assertEqual(len(os.listdir(self.dir)), len(sent))
+        self.assertEqual(frames, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import threading
+import time
+import unittest
+
+import mock
+from twisted.test import proto_helpers
+
+import evora.server.acquisition_wait as acq_wait
+import evora.server.server as server
+from evora.common.messages import decodeLine
+from evora.server import hardware
+from evora.server.broadcast import BroadcastHub
+from evora.server.simulator import AndorSimulator
+
+
+class ImmediateReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class TestLanes(unittest.TestCase):
+    def test_lane_for(self):
+        self.assertEqual(hardware.laneFor("abort"), hardware.ABORT)
+        self.assertEqual(hardware.laneFor("series object 5 20 2 3 g compress=rice"), hardware.CONTROL)
+        self.assertEqual(hardware.laneFor("temp"), hardware.TELEMETRY)
+        self.assertIsNone(hardware.laneFor("writerStats"))
+        self.assertEqual(hardware.laneFor("somethingNew 1"), hardware.CONTROL)
+        self.assertEqual(hardware.laneFor(""), hardware.CONTROL)
+
+
+class TestHardwareExecutor(unittest.TestCase):
+    def setUp(self):
+        self.executor = hardware.HardwareExecutor(driver=ImmediateReactor())
+
+    def tearDown(self):
+        self.executor.stop()
+
+    def test_runs_inline_until_started(self):
+        self.assertTrue(self.executor.owns())
+        self.assertEqual(self.executor.call(hardware.CONTROL, lambda x: x + 1, 1), 2)
+        results = []
+        self.executor.submit(hardware.TELEMETRY, lambda: 5).addCallback(results.append)
+        self.assertEqual(results, [5])
+
+    def test_priority_and_one_thread(self):
+        order, threads = [], set()
+        release = threading.Event()
+
+        def job(name):
+            threads.add(threading.current_thread().name)
+            order.append(name)
+
+        self.executor.start()
+        self.executor.submit(hardware.CONTROL, release.wait)  # holds the thread while the others queue
+        done = []
+        for lane, name in [(hardware.TELEMETRY, "temp"), (hardware.CONTROL, "expose"), (hardware.ABORT, "abort"),
+                           (hardware.CONTROL, "series")]:
+            self.executor.submit(lane, job, name).addCallback(done.append)
+        self.assertFalse(self.executor.owns())
+        release.set()
+        self.executor.stop()
+        self.assertEqual(order, ["abort", "expose", "series", "temp"])
+        self.assertEqual(threads, set(["HardwareExecutor"]))
+        self.assertEqual(len(done), 4)
+
+        stats = self.executor.stats()
+        self.assertEqual((stats['abort']['run'], stats['control']['run'], stats['telemetry']['run']), (1, 3, 1))
+        self.assertGreater(stats['telemetry']['max'], 0)
+
+    def test_errors_reach_the_caller(self):
+        self.executor.start()
+        failures = []
+        self.executor.submit(hardware.CONTROL, lambda: 1 // 0).addErrback(failures.append)
+        self.assertRaises(ZeroDivisionError, self.executor.call, hardware.TELEMETRY, lambda: 1 // 0)
+        self.assertEqual(failures[0].type, ZeroDivisionError)
+
+    def test_abort_preempts_acquisition(self):
+        driver = AndorSimulator(width=32, height=32, readoutTime=0.01)
+        waiter = acq_wait.createWaiter(driver)
+        waiter.between = self.executor.service
+        events = []
+
+        def exposure():
+            driver.SetAcquisitionMode(1)
+            driver.SetExposureTime(30)
+            waiter.arm()
+            driver.StartAcquisition()
+            started.set()
+            status = waiter.wait()
+            while status[1] == driver.DRV_ACQUIRING:  # woken, but still acquiring until the abort has run
+                waiter.waitForFrame()
+                status = driver.GetStatus()
+            events.append("exposure done")
+
+        started = threading.Event()
+        self.executor.start()
+        self.executor.submit(hardware.CONTROL, exposure)
+        started.wait()
+        self.executor.submit(hardware.CONTROL, events.append, "next exposure")
+        self.executor.submit(hardware.TELEMETRY, lambda: events.append(("temp", driver.GetStatus()[1])))
+        begin = time.time()
+        self.executor.submit(hardware.ABORT, driver.AbortAcquisition)
+        waiter.abort()
+        self.executor.stop()
+
+        self.assertLess(time.time() - begin, 1.0)
+        self.assertEqual([events[0][0]] + events[1:], ["temp", "exposure done", "next exposure"])
+        self.assertLess(self.executor.stats()['abort']['max'], 1.0)
+
+    def test_abort_command_runs_before_the_wait_returns(self):
+        driver = AndorSimulator(width=32, height=32, readoutTime=0.01)
+        waiter = acq_wait.createWaiter(driver)
+        waiter.between = self.executor.service
+        wake = waiter.abort
+        waiter.abort = lambda: wake() or time.sleep(0.1)  # the woken acquisition runs on before the reactor does
+        started = threading.Event()
+        statuses = []
+
+        def exposure():
+            driver.SetAcquisitionMode(1)
+            driver.SetExposureTime(30)
+            waiter.arm()
+            driver.StartAcquisition()
+            started.set()
+            statuses.append(waiter.wait()[1])  # expose reads the image next
+
+        self.executor.start()
+        self.executor.submit(hardware.CONTROL, exposure)
+        started.wait()
+        with mock.patch.object(server, 'andor', driver), mock.patch.object(server, 'waiter', waiter), \
+                mock.patch.object(server, 'executor', self.executor):
+            client = server.EvoraClient(BroadcastHub(driver=ImmediateReactor())).buildProtocol(None)
+            client.transport = proto_helpers.StringTransport()
+            client.factory.hub.add(client)
+            client.lineReceived("@1 abort")
+            self.executor.stop()
+        self.assertEqual(statuses, [driver.DRV_IDLE])
+        self.assertEqual(decodeLine(client.transport.value().split("\r\n")[0]).key, "abort")
+
+
+class TestInlineCommands(unittest.TestCase):
+    def test_stats_answered_in_line(self):
+        client = server.EvoraClient(BroadcastHub(driver=ImmediateReactor())).buildProtocol(None)
+        client.transport = proto_helpers.StringTransport()
+        client.factory.hub.add(client)
+        client.lineReceived("@1 executorStats")
+        message = decodeLine(client.transport.value().split("\r\n")[0])
+        self.assertEqual((message.requestId, message.key), ("1", "executorStats"))
+        self.assertEqual(message['abortQueued'], 0)
+        self.assertIsInstance(message['telemetryMax'], float)
+
+
+if __name__ == '__main__':
+    unittest.main()
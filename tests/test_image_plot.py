@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from evora.client.gui.image_plot import ImagePlot
+
+
+class TestImagePlot(unittest.TestCase):
+    def setUp(self):
+        self.figure = Figure(figsize=(2, 2), dpi=50)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_subplot(111)
+        self.plot = ImagePlot(self.figure, self.axes, self.canvas)
+        self.frame = np.arange(12, dtype=np.uint16).reshape(3, 4)
+
+    def test_image_is_reused(self):
+        self.plot.show(self.frame, 0, 11, 'gray')
+        image = self.plot.image
+        self.assertTrue(self.plot.draw())  # first frame lays out and draws everything
+        for i in range(5):
+            self.plot.show(self.frame + i, i, 11 + i, 'gray_r')
+            self.assertFalse(self.plot.draw())
+        self.assertIs(self.plot.image, image)
+        self.assertEqual(self.axes.images, [image])
+        self.assertEqual(image.get_clim(), (4, 15))
+        self.assertEqual(image.get_cmap().name, 'gray_r')
+        np.testing.assert_array_equal(image.get_array(), self.frame + 4)
+        self.assertEqual((self.plot.fullDraws, self.plot.blits), (1, 5))
+
+    def test_new_shape_or_resize_redraws_everything(self):
+        self.plot.show(self.frame, 0, 11, 'gray')
+        self.plot.draw()
+        self.plot.show(self.frame.T, 0, 11, 'gray')
+        self.assertEqual(len(self.axes.images), 1)
+        self.assertTrue(self.plot.draw())
+
+        self.figure.set_size_inches(3, 3)
+        self.canvas.resize_event()
+        self.assertTrue(self.plot.draw())
+        self.assertFalse(self.plot.draw())
+
+    def test_clear(self):
+        self.plot.show(self.frame, 0, 11, 'gray')
+        self.plot.draw()
+        self.plot.clear()
+        self.assertEqual(self.axes.images, [])
+        self.plot.setClim(0, 1)  # nothing to change
+        self.plot.show(self.frame, 0, 11, 'gray')
+        self.assertTrue(self.plot.draw())
+
+    def test_fps(self):
+        self.assertEqual(self.plot.fps(), 0.0)
+        self.plot.show(self.frame, 0, 11, 'gray')
+        for i in range(3):
+            self.plot.draw()
+        self.assertGreater(self.plot.fps(), 0)
+        self.plot.resetFps()
+        self.assertEqual(self.plot.fps(), 0.0)
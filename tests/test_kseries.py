@@ -0,0 +1,166 @@
+import functools
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+from astropy.io import fits
+
+from evora.common.utils.stats import parse_record
+import evora.server.acquisition_wait as acq_wait
+import evora.server.server as server
+from evora.server import hardware
+from evora.server.camera_session import CameraSession
+from evora.server.fits_writer import FitsWriter
+from evora.server.frame_pool import FramePool
+from evora.server.simulator import AndorSimulator
+
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendData(self, data):
+        self.sent.append(data)
+
+
+class ImmediateReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class TestKineticSeries(unittest.TestCase):
+    """
+    Runs kseriesExposure on the simulator with a writer that is slower than the kinetic cycle.
+    """
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.written = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def slowWrite(self, job):
+        job.headerFunc()
+        time.sleep(0.01)
+        self.written.append(int(job.data.flat[0]))
+
+    def run_series(self, numexp, bufferImages, policy='block'):
+        driver = AndorSimulator(width=32, height=32, readoutTime=0.002, bufferImages=bufferImages)
+        writer = FitsWriter(threads=1, maxQueue=2, policy=policy)
+        writer._write = self.slowWrite
+        protocol = FakeProtocol()
+        with mock.patch.object(server, 'andor', driver), \
+                mock.patch.object(server, 'camera', CameraSession(driver)), \
+                mock.patch.object(server, 'waiter', acq_wait.createWaiter(driver)), \
+                mock.patch.object(server, 'writer', writer), \
+                mock.patch.object(server, 'framePool', FramePool(4)), \
+                mock.patch.object(server.headerFactory, 'driver', driver), \
+                mock.patch.object(server.fits_utils, 'get_image_path', lambda type: self.dir + "/image.fits"):
+            reply = server.Evora().kseriesExposure(protocol, "object", 0.001, numexp=numexp)
+        return reply, protocol
+
+    def test_no_frame_lost_when_writer_is_slow(self):
+        reply, protocol = self.run_series(40, bufferImages=64)
+        self.assertEqual(reply, "series 1,41")
+        self.assertEqual(self.written, list(range(1, 41)))
+        self.assertEqual([m.split()[0] for m in protocol.sent], ["seriesSent%d" % i for i in range(1, 41)])
+        self.assertEqual(server.seriesReport,
+                         {'requested': 40, 'acquired': 40, 'saved': 40, 'lost': 0, 'dropped': 0})
+
+    def test_overwritten_frames_are_counted(self):
+        reply, protocol = self.run_series(40, bufferImages=4)
+        report = server.seriesReport
+        self.assertGreater(report['lost'], 0)
+        self.assertEqual(report['acquired'], 40)
+        self.assertEqual(report['saved'] + report['lost'], 40)
+        self.assertEqual(len(self.written), report['saved'])
+        self.assertEqual(self.written, sorted(self.written))
+
+    def test_dropped_frames_are_not_counted_as_saved(self):
+        reply, protocol = self.run_series(40, bufferImages=64, policy='drop')
+        report = server.seriesReport
+        self.assertGreater(report['dropped'], 0)
+        self.assertEqual(report['saved'] + report['dropped'] + report['lost'], 40)
+        self.assertEqual(len(self.written), report['saved'])
+
+    def test_abort_while_the_writer_is_stalled(self):
+        driver = AndorSimulator(width=32, height=32, readoutTime=0.002, bufferImages=64)
+        executor = hardware.HardwareExecutor(driver=ImmediateReactor())
+        waiter = acq_wait.createWaiter(driver)
+        waiter.between = executor.service
+        pool = FramePool(3)
+        writer = FitsWriter(threads=1, maxQueue=2)
+        stalled = threading.Event()
+        writer._write = lambda job: stalled.wait()
+        aborted, replies = [], []
+
+        def abortAcquisition():
+            aborted.append(time.time())
+            return driver.AbortAcquisition()
+        with mock.patch.object(server, 'andor', driver), \
+                mock.patch.object(server, 'camera', CameraSession(driver)), \
+                mock.patch.object(server, 'waiter', waiter), \
+                mock.patch.object(server, 'executor', executor), \
+                mock.patch.object(server, 'writer', writer), \
+                mock.patch.object(server, 'framePool', pool), \
+                mock.patch.object(server.headerFactory, 'driver', driver), \
+                mock.patch.object(server.fits_utils, 'get_image_path', lambda type: self.dir + "/image.fits"):
+            executor.start()
+            series = functools.partial(server.Evora().kseriesExposure, FakeProtocol(), "object", 0.001, numexp=1000)
+            executor.submit(hardware.CONTROL, series).addCallback(replies.append)
+            deadline = time.time() + 10
+            while pool.stats()['leased'] < 3 and time.time() < deadline:  # every buffer is with the writer
+                time.sleep(0.01)
+            begin = time.time()
+            executor.submit(hardware.ABORT, abortAcquisition)
+            waiter.abort()
+            while not aborted and time.time() < begin + 5:
+                time.sleep(0.01)
+            stalled.set()
+            executor.stop()
+
+        self.assertTrue(aborted)
+        self.assertLess(aborted[0] - begin, 1.0)
+        self.assertEqual(replies[0].split(",")[0], "series 1")
+        report = server.seriesReport
+        self.assertLess(report['acquired'], 1000)
+        self.assertEqual(report['saved'] + report['lost'], report['acquired'])
+
+
+class TestExpose(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_reply_comes_from_the_writer(self):
+        driver = AndorSimulator(width=32, height=32, readoutTime=0.002)
+        writer = FitsWriter(threads=1)
+        replies = []
+        request = mock.Mock()
+        request.reply = lambda line: replies.append((line, threading.current_thread().name))
+        with mock.patch.object(server, 'andor', driver), \
+                mock.patch.object(server, 'camera', CameraSession(driver)), \
+                mock.patch.object(server, 'waiter', acq_wait.createWaiter(driver)), \
+                mock.patch.object(server, 'writer', writer), \
+                mock.patch.object(server, 'framePool', FramePool(4)), \
+                mock.patch.object(server.headerFactory, 'driver', driver), \
+                mock.patch.object(server.fits_utils, 'get_image_path', lambda type: self.dir + "/image.fits"):
+            self.assertIsNone(server.Evora().expose("object", 1, 0.01, 1, protocol=request))
+            writer.flush(timeout=30)
+            reply = server.Evora().expose("object", 1, 0.01, 1)  # without a protocol it waits for the writer
+
+        self.assertEqual(replies[0][1], "FitsWriter-0")
+        line = replies[0][0]
+        self.assertTrue(line.startswith("expose 1," + self.dir + "/image.fits,0.01,"))
+        self.assertIsNotNone(parse_record(line.split(",")[3:]))
+        self.assertIn('DATAMED', fits.getheader(self.dir + "/image.fits"))
+        self.assertTrue(reply.startswith("expose 1,"))
+
+
+if __name__ == '__main__':
+    unittest.main()
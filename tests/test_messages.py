@@ -0,0 +1,84 @@
+import json
+import unittest
+
+from twisted.test import proto_helpers
+
+import evora.server.server as server
+from evora.common.messages import Message, Outgoing, decodeLine, schema
+from evora.server.broadcast import BroadcastHub
+
+
+class ImmediateReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class TestMessage(unittest.TestCase):
+    def test_typed_fields(self):
+        message = decodeLine("temp 20036,20002,-60.2,-60,20,0.5")
+        self.assertEqual((message.key, message['mode'], message['temperature'], message['target']),
+                         ("temp", 20036, -60.2, -60.0))
+        self.assertEqual(message.value, "20036,20002,-60.2,-60,20,0.5")
+
+        message = decodeLine("@4+ seriesSent12 12,0.5,/data/image_012.fits,0,11,5.5,5.5,3")
+        self.assertEqual((message.requestId, message.event, message['number']), ("4", True, 12))
+        self.assertEqual(message.stats(), [0, 11, 5.5, 5.5, 3])
+        self.assertEqual(schema("seriesSent12"), schema("seriesSent"))
+
+    def test_missing_and_extra_fields(self):
+        self.assertEqual(decodeLine("expose 0,None,0.5")['success'], 0)
+        self.assertIsNone(decodeLine("expose 1,/data/a.fits,0.5").stats())
+        message = decodeLine("getTEC 20036,-60,7")
+        self.assertEqual(message.extra, ["7"])
+        self.assertEqual(message.text, "getTEC 20036,-60,7")
+        self.assertNotIn('temperature', decodeLine("status 20002,20073").fields)  # from an older server
+        self.assertEqual(decodeLine("unknownKey a,b").extra, ["a", "b"])
+        self.assertEqual(decodeLine("timings").text, "timings")
+
+    def test_json_round_trip(self):
+        line = Message.fromText("seriesSent3", "3,0.5,/data/a.fits,0,11,5.5,5.5,3", "9", True).toJson()
+        record = json.loads(line)
+        self.assertEqual((record['v'], record['key'], record['id'], record['event']), (1, "seriesSent3", "9", True))
+        message = decodeLine(line)
+        self.assertEqual((message.requestId, message.event, message['itime']), ("9", True, 0.5))
+        self.assertEqual(message.text, "seriesSent3 3,0.5,/data/a.fits,0,11,5.5,5.5,3")
+        self.assertEqual(message.stats(), [0, 11, 5.5, 5.5, 3])
+
+
+class TestNegotiation(unittest.TestCase):
+    def setUp(self):
+        factory = server.EvoraClient(BroadcastHub(driver=ImmediateReactor()))
+        self.clients = []
+        for i in range(2):
+            client = factory.buildProtocol(None)
+            client.transport = proto_helpers.StringTransport()
+            factory.hub.add(client)
+            self.clients.append(client)
+
+    def lines(self, client):
+        return client.transport.value().split("\r\n")[:-1]
+
+    def test_json_client(self):
+        json_client, text_client = self.clients
+        json_client.lineReceived("@1 protocol json 1")
+        text_client.lineReceived("protocol xml 1")
+        json_client.sendData("temp 20036,20002,-60.2,-60", "2")
+        server.Request(text_client, "3").sendData("realSent 4,0,11,5.5,5.5,3")
+
+        reply, temp, realSent = self.lines(json_client)
+        self.assertEqual(reply, "@1 protocol json,1")  # still in text
+        self.assertEqual(decodeLine(temp)['temperature'], -60.2)
+        self.assertEqual(json.loads(temp)['id'], "2")
+        self.assertEqual(json.loads(realSent), {'v': 1, 'key': 'realSent', 'fields': {
+            'frame': '4', 'min': 0.0, 'max': 11.0, 'mean': 5.5, 'median': 5.5, 'mad': 3.0}})
+        self.assertEqual(self.lines(text_client), ["protocol text,1", "temp 20036,20002,-60.2,-60",
+                                                   "@3+ realSent 4,0,11,5.5,5.5,3"])
+
+    def test_encoded_once(self):
+        message = Outgoing("status 20002,20073")
+        first = message.lineFor(self.clients[0])
+        self.assertIs(message.lineFor(self.clients[1]), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
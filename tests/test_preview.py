@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+import evora.server.preview as preview
+
+
+class TestPreview(unittest.TestCase):
+    def setUp(self):
+        self.image = np.random.RandomState(0).poisson(800, (100, 130)).astype(np.uint16)
+
+    def test_decimation_factor_fits_size(self):
+        self.assertEqual(preview.decimationFactor((2048, 2048), 512), 4)
+        self.assertEqual(preview.decimationFactor((2048, 2048), 500), 5)
+        self.assertEqual(preview.decimationFactor((256, 256), 512), 1)
+
+    def test_mean_matches_block_average(self):
+        small = preview.decimate(self.image, 4)
+        self.assertEqual(small.shape, (25, 32))
+        expected = self.image[:100, :128].reshape(25, 4, 32, 4).astype(np.float64).mean(axis=(1, 3))
+        np.testing.assert_allclose(small, expected, rtol=1e-6)
+
+    def test_stride(self):
+        np.testing.assert_array_equal(preview.decimate(self.image, 3, 'stride'), self.image[::3, ::3])
+        self.assertRaises(ValueError, preview.decimate, self.image, 3, 'median')
+
+    def test_stretch_clips_to_percentiles(self):
+        image = self.image.copy()
+        image[0, 0] = 65535  # a cosmic ray must not flatten the stretch
+        pixels, low, high = preview.stretch(image, 1, 99)
+        self.assertEqual(pixels.dtype, np.uint8)
+        self.assertEqual((pixels.min(), pixels.max()), (0, 255))
+        self.assertLess(high, 1000)
+        self.assertGreater(np.median(pixels), 100)
+
+    def test_flat_image(self):
+        pixels, low, high = preview.stretch(np.full((8, 8), 1000, dtype=np.uint16))
+        self.assertEqual(high, low + 1)
+        self.assertEqual(pixels.max(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
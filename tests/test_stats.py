@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from evora.common.utils.fits import calcstats
+from evora.common.utils.stats import format_record, image_stats, parse_record, sample
+
+
+class TestImageStats(unittest.TestCase):
+    def reference(self, data, percentiles):
+        median = np.median(data)
+        return [data.min(), data.max(), data.mean(), median, np.median(np.abs(data.astype(np.float64) - median)),
+                [np.percentile(data, q) for q in percentiles]]
+
+    def check(self, data, percentiles=(0, 0.5, 25, 50, 99.5, 100)):
+        stats = image_stats(data, percentiles=percentiles)
+        got = [stats['min'], stats['max'], stats['mean'], stats['median'], stats['mad'], stats['percentiles']]
+        for value, expected in zip(got, self.reference(data, percentiles)):
+            np.testing.assert_allclose(value, expected)
+
+    def test_matches_numpy(self):
+        random = np.random.RandomState(0)
+        for shape in ((1, 1), (2, 2), (7, 9), (10, 10), (256, 300)):
+            data = random.poisson(1000, shape).astype(np.uint16)
+            self.check(data)
+            data.flat[-1] = 65535  # saturated
+            self.check(data)
+            self.check(random.randint(0, 256, shape).astype(np.uint8))
+
+    def test_half_integer_median(self):
+        data = np.array([[1, 2], [5, 100]], dtype=np.uint16)
+        stats = image_stats(data)
+        self.assertEqual(stats['median'], 3.5)
+        self.assertEqual(stats['mad'], np.median(np.abs(data - 3.5)))
+
+    def test_other_types_fall_back(self):
+        data = np.random.RandomState(1).normal(0, 10, (50, 40)).astype(np.float32)
+        self.check(data)
+        self.check(data.astype(np.int32))
+
+    def test_fast(self):
+        data = np.random.RandomState(2).poisson(500, (1024, 1024)).astype(np.uint16)
+        data[8, 4] = 60000
+        self.assertLess(sample(data).size, data.size)
+        stats = image_stats(data, fast=True)
+        self.assertEqual(stats['max'], 60000)  # (8, 4) is on the sample grid
+        self.assertAlmostEqual(stats['median'], np.median(data), delta=1)
+        self.assertAlmostEqual(stats['mean'], data.mean(), delta=0.5)
+
+    def test_calcstats(self):
+        data = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        self.assertEqual(calcstats(data), [0, 11, 5.5, 5.5, 3.0])
+
+    def test_record(self):
+        stats = image_stats(np.arange(12, dtype=np.uint16).reshape(3, 4))
+        self.assertEqual(format_record(stats), "0,11,5.5,5.5,3")
+        message = "seriesSent2 2,0.5,/data/image.fits," + format_record(stats)
+        self.assertEqual(parse_record(message.split(",")[3:]), [0, 11, 5.5, 5.5, 3.0])
+        self.assertIsNone(parse_record("expose 1,/data/image.fits,0.5".split(",")[3:]))
+        self.assertIsNone(parse_record("a,b,c,d,e".split(",")))
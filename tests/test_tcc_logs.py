@@ -0,0 +1,109 @@
+import calendar
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from evora.server.tcc_logs import GtccLogStore, PositionLogStore, heimdallLogName
+
+DAY = calendar.timegm((2020, 7, 22, 0, 0, 0))
+
+
+def line(seconds, ra):
+    stamp = time.strftime("%Y%m%dT%H:%M:%S", time.gmtime(DAY + seconds))
+    return "%s %.1f 45.0 2000.0 %.1f 30.0\n" % (stamp, ra, ra + 1)
+
+
+class TestPositionLogStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = PositionLogStore(self.dir)
+        self.path = os.path.join(self.dir, heimdallLogName(time.gmtime(DAY)))
+        with open(self.path, 'w') as f:
+            f.writelines(line(s, s) for s in (10, 20, 30))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def lookup(self, seconds):
+        return self.store.lookup(time.gmtime(DAY + seconds))
+
+    def test_nearest_earlier_sample(self):
+        self.assertEqual(self.lookup(25), (20.0, 45.0, 2000.0, 21.0, 1.0, 30.0))
+        self.assertEqual(self.lookup(30)[0], 30.0)
+        self.assertEqual(self.lookup(1000)[0], 30.0)
+
+    def test_no_sample_before_start(self):
+        self.assertIsNone(self.lookup(5))
+
+    def test_missing_log(self):
+        self.assertIsNone(self.store.lookup(time.gmtime(DAY + 86400 * 3)))
+
+    def test_follows_appended_lines(self):
+        self.assertEqual(self.lookup(45)[0], 30.0)
+        with open(self.path, 'a') as f:
+            f.write(line(40, 40))
+            f.write(line(50, 50)[:10])  # partially written line
+        self.assertEqual(self.lookup(45)[0], 40.0)
+        with open(self.path, 'a') as f:
+            f.write(line(50, 50)[10:])
+        self.assertEqual(self.lookup(55)[0], 50.0)
+
+
+def gtccName(seconds):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(DAY + seconds))
+
+
+def gtccLine(seconds, ra):
+    return "%s %.1f 45.0 2000.0 %.1f 1.0 30.0 fslide:1\n" % (gtccName(seconds), ra, ra + 1)
+
+
+class TestGtccLogStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = GtccLogStore(self.dir)
+        self.first = os.path.join(self.dir, gtccName(0))
+        self.second = os.path.join(self.dir, gtccName(1000))
+        with open(self.first, 'w') as f:
+            f.writelines(gtccLine(s, s) for s in (0, 10, 20, 30))
+        with open(self.second, 'w') as f:
+            f.writelines(gtccLine(s, s) for s in (1000, 1010))
+        with open(os.path.join(self.dir, "notes.txt"), 'w') as f:
+            f.write("not a log\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_choose_logfile(self):
+        self.assertEqual(self.store.chooseLogfile(time.gmtime(DAY + 500)), self.first)
+        self.assertEqual(self.store.chooseLogfile(time.gmtime(DAY + 1005)), self.second)
+        self.assertIsNone(self.store.chooseLogfile(time.gmtime(DAY - 5)))
+        self.assertIsNone(self.store.chooseLogfile(time.gmtime(DAY + 1000 + 1800)))
+
+    def test_listing_follows_new_logs(self):
+        third = os.path.join(self.dir, gtccName(2000))
+        self.assertEqual(self.store.chooseLogfile(time.gmtime(DAY + 2005)), self.second)
+        with open(third, 'w') as f:
+            f.write(gtccLine(2000, 2000))
+        os.utime(self.dir, (time.time() + 10, time.time() + 10))  # coarse mtimes may not tick within the test
+        self.assertEqual(self.store.chooseLogfile(time.gmtime(DAY + 2005)), third)
+
+    def test_closest_line(self):
+        self.assertEqual(self.store.lookup(time.gmtime(DAY + 14)), ('10.0', '45.0', '2000.0', '11.0', '1.0', '30.0'))
+        self.assertEqual(self.store.lookup(time.gmtime(DAY + 16))[0], '20.0')
+        self.assertEqual(self.store.lookup(time.gmtime(DAY + 500))[0], '30.0')
+
+    def test_follows_appended_lines(self):
+        self.assertEqual(self.store.lookup(time.gmtime(DAY + 41))[0], '30.0')
+        with open(self.first, 'a') as f:
+            f.write(gtccLine(40, 40))
+            f.write(gtccLine(50, 50)[:12])  # partially written line
+        self.assertEqual(self.store.lookup(time.gmtime(DAY + 49))[0], '40.0')
+        with open(self.first, 'a') as f:
+            f.write(gtccLine(50, 50)[12:])
+        self.assertEqual(self.store.lookup(time.gmtime(DAY + 49))[0], '50.0')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import functools
+import threading
+import time
+import unittest
+
+import mock
+import numpy as np
+from twisted.test import proto_helpers
+
+import evora.server.server as server
+from evora.common.messages import decodeLine, historyPoints
+from evora.server import hardware, telemetry
+from evora.server.broadcast import BroadcastHub
+
+
+class FakeDriver(object):
+    """
+    Answers like the andor module, taking delay seconds per call and counting the calls.
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.threads = set()
+        self.temperature = -60.2
+
+    def _call(self, value):
+        self.calls += 1
+        self.threads.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        return value
+
+    def GetStatus(self):
+        return self._call([20002, 20073])
+
+    def GetTemperatureF(self):
+        return self._call([20036, self.temperature])
+
+    def GetTemperatureStatus(self):
+        return self._call([20002, self.temperature, -60.0, 20.0, 0.5])
+
+
+class TestTelemetrySampler(unittest.TestCase):
+    def test_cached(self):
+        driver = FakeDriver()
+        sampler = telemetry.TelemetrySampler(driver, maxAge=60)
+        first = sampler.get()
+        self.assertIs(sampler.get(), first)
+        self.assertEqual(driver.calls, 3)
+        sampler.invalidate()
+        sampler.get()
+        self.assertEqual(driver.calls, 6)
+        self.assertEqual((sampler.stats()['samples'], sampler.stats()['hits']), (2, 1))
+
+    def test_concurrent_misses_read_once(self):
+        driver = FakeDriver(delay=0.05)
+        sampler = telemetry.TelemetrySampler(driver, maxAge=60)
+        snapshots = []
+        threads = [threading.Thread(target=lambda: snapshots.append(sampler.get())) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(driver.calls, 3)
+        self.assertEqual(len(snapshots), 8)
+        self.assertTrue(all(snapshot is snapshots[0] for snapshot in snapshots))
+
+    def test_current_never_reads(self):
+        driver = FakeDriver()
+        sampler = telemetry.TelemetrySampler(driver, maxAge=60)
+        self.assertIsNone(sampler.current())
+        snapshot = sampler.get()
+        self.assertIs(sampler.current(), snapshot)
+        sampler.invalidate()
+        self.assertIsNone(sampler.current())
+        self.assertEqual(driver.calls, 3)
+
+    def test_publishes_changes(self):
+        driver = FakeDriver()
+        sampler = telemetry.TelemetrySampler(driver, interval=0.01)
+        pushed = []
+        sampler.start(pushed.append)
+        time.sleep(0.1)
+        driver.temperature = -61.0
+        time.sleep(0.1)
+        sampler.stop()
+        self.assertEqual(pushed, ["telemetry 20002,20073,20036,20002,-60.2,-60.0,20.0,0.5",
+                                  "telemetry 20002,20073,20036,20002,-61.0,-60.0,20.0,0.5"])
+        self.assertGreater(sampler.stats()['samples'], 2)
+
+    def test_lines(self):
+        snapshot = telemetry.TelemetrySampler(FakeDriver()).get()
+        self.assertEqual(telemetry.line('temp', snapshot), "temp 20036,20002,-60.2,-60.0,20.0,0.5")
+        self.assertEqual(telemetry.line('getTEC', snapshot), "getTEC 20036,-60.2")
+        self.assertEqual(telemetry.line('status', snapshot), "status 20002,20073")
+        message = decodeLine(telemetry.snapshotLine('status', snapshot))
+        self.assertEqual((message['result'], message['mode'], message['temperature']), (20002, 20036, -60.2))
+
+
+class ImmediateReactor(object):
+    def callFromThread(self, f, *args):
+        f(*args)
+
+
+class TestServerQueries(unittest.TestCase):
+    def test_reactor_never_reads_the_driver(self):
+        driver = FakeDriver()
+        executor = hardware.HardwareExecutor(driver=ImmediateReactor())
+        sampler = telemetry.TelemetrySampler(driver, maxAge=60, call=functools.partial(executor.call,
+                                                                                       hardware.TELEMETRY))
+        executor.start()
+        try:
+            with mock.patch.object(server, 'sampler', sampler), mock.patch.object(server, 'executor', executor):
+                client = server.EvoraClient(BroadcastHub(driver=ImmediateReactor())).buildProtocol(None)
+                client.makeConnection(proto_helpers.StringTransport())  # no snapshot yet: sampled in the lane
+                executor.stop()
+                executor.start()
+                client.lineReceived("@1 temp")  # fresh: answered from the snapshot
+                sampler.invalidate()
+                client.lineReceived("@2 status")  # stale: sampled in the lane again
+                executor.stop()
+        finally:
+            executor.stop()
+        lines = [decodeLine(line) for line in client.transport.value().split("\r\n") if line]
+        self.assertEqual([(m.key, m.requestId) for m in lines], [("status", None), ("temp", "1"), ("status", "2")])
+        self.assertEqual(lines[0]['temperature'], -60.2)
+        self.assertEqual(driver.calls, 6)
+        self.assertEqual(driver.threads, set(["HardwareExecutor"]))
+
+
+def snapshot(t, temperature, status=20073):
+    return {'time': t, 'status': [20002, status], 'tec': [20035, temperature],
+            'temperature': [20002, temperature, -60.0, 20.0, 0.5]}
+
+
+class TestTelemetryHistory(unittest.TestCase):
+    def test_ring_keeps_the_newest(self):
+        history = telemetry.TelemetryHistory(capacity=5)
+        for i in range(8):
+            history.record(snapshot(1000.0 + i, -float(i)))
+        self.assertEqual(len(history), 5)
+        times, values = history.query('temperature', 0, 2000, 100)
+        self.assertEqual(list(times), [1003.0, 1004.0, 1005.0, 1006.0, 1007.0])
+        self.assertEqual(list(values), [-3.0, -4.0, -5.0, -6.0, -7.0])
+        times, values = history.query('temperature', 1004.0, 1005.5, 100)
+        self.assertEqual(list(times), [1004.0, 1005.0])
+        self.assertEqual(list(history.query('status', 0, 2000, 100)[1]), [20073] * 5)
+
+    def test_downsampling_keeps_extremes(self):
+        history = telemetry.TelemetryHistory(capacity=10000)
+        curve = 20.0 - np.arange(10000) * 0.008  # cooling down
+        curve[4321] = 35.0  # a spike
+        for i, value in enumerate(curve):
+            history.record(snapshot(float(i), value))
+        times, values = history.query('temperature', 0, 10000, 100)
+        self.assertLessEqual(len(times), 100)
+        self.assertTrue(np.all(np.diff(times) > 0))
+        self.assertIn(4321.0, list(times))
+        self.assertEqual((values.max(), values.min()), (np.float32(35.0), np.float32(curve[-1])))
+
+    def test_history_command(self):
+        history = telemetry.TelemetryHistory(capacity=100)
+        now = float(int(time.time()))
+        for i in range(60):
+            history.record(snapshot(now - 60 + i, -0.5 * i))
+        with mock.patch.object(server, 'history', history):
+            message = decodeLine(server.EvoraParser(None).parse("history temperature %d %d 10" % (now - 30, now)))
+            recent = decodeLine(server.EvoraParser(None).parse("history temperature -120 0 500"))
+            unknown = server.EvoraParser(None).parse("history humidity -30 0 10")
+        self.assertEqual((message['series'], message['count']), ("temperature", 10))
+        self.assertEqual(recent['count'], 60)
+        points = historyPoints(message)
+        self.assertEqual(len(points), 10)
+        self.assertAlmostEqual(points[0][0], now - 30, places=2)
+        self.assertEqual(points[0][1], -15.0)
+        self.assertEqual(points[-1][1], -29.5)
+        self.assertEqual(unknown, "history humidity,0,0")
+
+
+if __name__ == '__main__':
+    unittest.main()
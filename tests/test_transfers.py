@@ -0,0 +1,174 @@
+import errno
+import httplib
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+from evora.client.transfer_images import REAL, SCIENCE, FileService, Transfer, TransferScheduler
+from evora.common.utils.files import part_name
+from evora.server.file_server import FileServer
+
+
+class Parser(object):
+    def __init__(self):
+        self.done = []
+        self.failed = []
+
+    def transferDone(self, msg, file):
+        self.done.append(file)
+
+    def transferFail(self, msg):
+        self.failed.append(msg)
+
+
+class FlakyService(FileService):
+    """
+    Breaks the connection after the first chunk of the first transfer.
+    """
+    broken = False
+
+    def request(self, url, headers={}):
+        response = FileService.request(self, url, headers)
+        if not self.broken:
+            self.broken = True
+            read = response.read
+
+            def breakOff(amt=None):
+                if response.fp is None or self.connection is None:
+                    raise socket.error("connection reset")
+                data = read(amt)
+                self.connection.sock.close()
+                response.fp = None
+                return data
+            response.read = breakOff
+        return response
+
+
+class TestTransfers(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.save = tempfile.mkdtemp() + "/"
+        os.mkdir(os.path.join(self.root, "tmp"))
+        self.data = os.urandom(100000)
+        for name in ("image.fits", "tmp/real.fits"):
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(self.data)
+        self.server = FileServer(self.root, ('127.0.0.1', 0))
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.parser = Parser()
+        self.scheduler = TransferScheduler('127.0.0.1', self.port, workers=2, retryDelay=0,
+                                           dispatch=lambda f, *args, **kwargs: f(*args, **kwargs))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.save)
+
+    def saved(self, name):
+        with open(self.save + name, 'rb') as f:
+            return f.read()
+
+    def test_real_lane_first_and_latest(self):
+        science = [self.scheduler.submit(self.parser, "image.fits", self.save, "s%d.fits" % i) for i in range(3)]
+        self.scheduler.submit(self.parser, "tmp/real.fits", self.save, "r1.fits", REAL)
+        latest = self.scheduler.submit(self.parser, "tmp/real.fits", self.save, "r2.fits", REAL)
+        order = [self.scheduler.next() for i in range(4)]
+        self.assertEqual(order, [latest] + science)
+        self.assertEqual(self.scheduler.stats()['superseded'], 1)
+
+    def test_cwd(self):
+        self.scheduler.cwd("tmp/")
+        self.assertEqual(self.scheduler.submit(self.parser, "real.fits", self.save, "r.fits", REAL).name,
+                         "tmp/real.fits")
+        self.scheduler.cdup()
+        self.assertEqual(self.scheduler.directory, "")
+        self.assertEqual(self.scheduler.submit(self.parser, "image.fits", self.save, "s.fits").name, "image.fits")
+
+    def test_pool(self):
+        self.scheduler.start()
+        for i in range(6):
+            self.scheduler.submit(self.parser, "image.fits", self.save, "s%d.fits" % i)
+        self.scheduler.submit(self.parser, "missing.fits", self.save, "m.fits")
+        while len(self.parser.done) + len(self.parser.failed) < 7:
+            threading.Event().wait(0.01)
+        self.assertEqual(sorted(self.parser.done), [self.save + "s%d.fits" % i for i in range(6)])
+        self.assertEqual(self.saved("s5.fits"), self.data)
+        self.assertEqual(self.parser.failed[0].errno, errno.ENOENT)
+        stats = self.scheduler.stats()
+        self.assertEqual((stats['done'], stats['failed'], stats['queued'], stats['active']), (6, 1, 0, 0))
+        self.assertGreater(stats['meanRate'], 0)
+
+    def test_retry_resumes(self):
+        service = FlakyService('127.0.0.1', self.port, chunk=30000)
+        transfer = self.scheduler.submit(self.parser, "image.fits", self.save, "s.fits", SCIENCE)
+        self.scheduler.run(service, self.scheduler.next())
+        self.assertEqual(self.parser.done, [self.save + "s.fits"])
+        self.assertEqual(self.saved("s.fits"), self.data)
+        self.assertEqual(transfer.attempts, 2)
+        self.assertEqual(transfer.bytes, len(self.data))  # the first chunk was not fetched again
+        self.assertEqual(self.scheduler.stats()['retried'], 1)
+
+    def test_resume_of_changed_file_starts_over(self):
+        service = FileService('127.0.0.1', self.port)
+        transfer = Transfer(self.parser, "image.fits", self.save, "s.fits", SCIENCE)
+        with open(part_name(transfer.filename()), 'wb') as f:
+            f.write(b"x" * 500)
+        transfer.offset, transfer.etag = 500, '"old"'
+        service.retrieve(transfer)
+        self.assertEqual(self.saved("s.fits"), self.data)
+        self.assertFalse(os.path.exists(part_name(transfer.filename())))
+
+    def test_resume_of_complete_file(self):
+        service = FileService('127.0.0.1', self.port)
+        transfer = Transfer(self.parser, "image.fits", self.save, "s.fits", SCIENCE)
+        service.retrieve(transfer)
+        os.rename(transfer.filename(), part_name(transfer.filename()))  # broke off before the rename
+        transfer.bytes = 0
+        service.retrieve(transfer)
+        self.assertEqual(transfer.bytes, 0)
+        self.assertEqual(self.saved("s.fits"), self.data)
+
+        transfer.bytes = 0
+        service.retrieve(transfer)  # the partial file is gone, so this fetches it all again
+        self.assertEqual(transfer.bytes, len(self.data))
+
+    def test_verify(self):
+        service = FileService('127.0.0.1', self.port, verify=True)
+        transfer = Transfer(self.parser, "image.fits", self.save, "s.fits", SCIENCE)
+        service.retrieve(transfer)
+        self.assertEqual(self.saved("s.fits"), self.data)
+
+        with open(part_name(transfer.filename()), 'wb') as f:
+            f.write(b"x" * 500)
+        transfer.offset = 500  # with the real ETag, so the wrong bytes are kept
+        self.assertRaises(IOError, service.retrieve, transfer)
+        self.assertFalse(os.path.exists(part_name(transfer.filename())))
+
+    def test_partial_file_is_hidden_until_complete(self):
+        service = FlakyService('127.0.0.1', self.port, chunk=30000)
+        transfer = Transfer(self.parser, "image.fits", self.save, "s.fits", SCIENCE)
+        self.assertRaises(socket.error, service.retrieve, transfer)
+        self.assertFalse(os.path.exists(transfer.filename()))
+        self.assertEqual(os.path.getsize(part_name(transfer.filename())), 30000)
+
+        self.scheduler.retries = 0
+        self.scheduler.submit(self.parser, "missing.fits", self.save, "s.fits")
+        with open(part_name(transfer.filename()), 'wb') as f:
+            f.write(b"x")
+        self.scheduler.run(service, self.scheduler.next())
+        self.assertFalse(os.path.exists(part_name(transfer.filename())))
+
+    def test_gives_up(self):
+        service = FileService('127.0.0.1', 1)
+        self.scheduler.retries = 1
+        self.scheduler.submit(self.parser, "image.fits", self.save, "s.fits")
+        self.scheduler.run(service, self.scheduler.next())
+        self.assertEqual(len(self.parser.failed), 1)
+        self.assertIsInstance(self.parser.failed[0], (socket.error, httplib.HTTPException))